@@ -0,0 +1,143 @@
+# Registro de actividad (auditoría) con escritura diferida
+#
+# record() solo construye la entrada y la encola en un BatchWorker, así que
+# auditar una mutación cuesta microsegundos y no una ida y vuelta a la base de
+# datos. Las entradas se escriben por lotes (ACTIVITY_BATCH_SIZE o
+# ACTIVITY_FLUSH_MS). Lo que no se puede escribir (cola llena, fallo de la base
+# de datos o parada del servidor) se añade a un fichero de volcado JSON Lines
+# que se reescribe en el siguiente arranque. Cada entrada lleva su id desde el
+# origen, así que la función de escritura debe ignorar ids ya existentes y
+# reintentar un volcado nunca duplica entradas.
+#
+# Con varios workers el fichero de volcado es compartido: cada volcado se añade
+# con una sola escritura O_APPEND y solo un worker a la vez lo reescribe.
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from fastapi.concurrency import run_in_threadpool
+
+from batch_worker import BatchWorker
+
+logger = logging.getLogger("planner.activity")
+
+BATCH_SIZE = int(os.getenv("ACTIVITY_BATCH_SIZE", "200"))
+FLUSH_SECONDS = float(os.getenv("ACTIVITY_FLUSH_MS", "500")) / 1000.0
+BUFFER_SIZE = int(os.getenv("ACTIVITY_BUFFER_SIZE", "10000"))
+
+
+def changed_values(old: Dict[str, Any], new: Dict[str, Any]) -> tuple:
+    """Devuelve (old_values, new_values) solo con las columnas que cambian"""
+    keys = [k for k, v in new.items() if old.get(k) != v]
+    return {k: old.get(k) for k in keys}, {k: new[k] for k in keys}
+
+
+class ActivityLog:
+    """Búfer acotado de entradas de actividad con volcado a disco
+
+    Args:
+        write: Función síncrona que inserta una lista de entradas (ignorando ids repetidos)
+        spill_path: Fichero JSON Lines donde se guardan las entradas no escritas
+    """
+
+    def __init__(self, write: Callable[[List[dict]], None], spill_path: str,
+                 max_batch: int = BATCH_SIZE, max_delay: float = FLUSH_SECONDS, max_queue: int = BUFFER_SIZE):
+        self.write = write
+        self.spill_path = os.getenv("ACTIVITY_SPILL_PATH", spill_path)
+        self.worker = BatchWorker("activity_log", self._flush, max_batch=max_batch, max_delay=max_delay,
+                                  max_queue=max_queue, on_failure=self._on_failure)
+        self._spill_lock = threading.Lock()
+
+    def record(self, user_id: Optional[str], action: str, entity_type: str, entity_id: str,
+               project_id: Optional[str] = None, old_values: Optional[dict] = None,
+               new_values: Optional[dict] = None, description: Optional[str] = None) -> None:
+        entry = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "action": action,
+            "entity_type": entity_type,
+            "entity_id": entity_id,
+            "project_id": project_id,
+            "old_values": old_values,
+            "new_values": new_values,
+            "description": description,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if not self.worker.submit(entry):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._spill([entry])
+            else:
+                # Cola llena: el volcado (write + fsync) no bloquea el bucle de eventos
+                loop.run_in_executor(None, self._spill, [entry])
+
+    async def _flush(self, entries: List[dict]) -> None:
+        await run_in_threadpool(self.write, entries)
+
+    async def _on_failure(self, entries: List[dict], error: BaseException) -> None:
+        await run_in_threadpool(self._spill, entries)
+
+    def _spill(self, entries: List[dict]) -> None:
+        """Añade las entradas al fichero de volcado (bloqueante: desde código async, en el pool de hilos)"""
+        data = "".join(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in entries).encode("utf-8")
+        with self._spill_lock:
+            # Una sola escritura en modo append no se entremezcla con la de otro worker
+            fd = os.open(self.spill_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                written = 0
+                while written < len(data):
+                    written += os.write(fd, data[written:])
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    async def replay_spill(self) -> int:
+        """Reescribe las entradas volcadas en ejecuciones anteriores; devuelve cuántas"""
+        with open(self.spill_path + ".lock", "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Otro worker ya lo está reescribiendo
+                    return 0
+            return await self._replay_spill()
+
+    async def _replay_spill(self) -> int:
+        replay_path = self.spill_path + ".replay"
+        with self._spill_lock:
+            if os.path.exists(self.spill_path):
+                if os.path.exists(replay_path):
+                    # Restos de una reinyección interrumpida: se unen al volcado actual
+                    with open(replay_path, encoding="utf-8") as old, open(self.spill_path, "a", encoding="utf-8") as f:
+                        f.write(old.read())
+                os.replace(self.spill_path, replay_path)
+        if not os.path.exists(replay_path):
+            return 0
+        with open(replay_path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        try:
+            for start in range(0, len(entries), self.worker.max_batch):
+                await run_in_threadpool(self.write, entries[start:start + self.worker.max_batch])
+        except Exception:
+            logger.exception("No se pudo reescribir el volcado de actividad; se conserva para el próximo arranque")
+            await run_in_threadpool(self._spill, entries)
+        os.remove(replay_path)
+        return len(entries)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Escribe lo pendiente y vuelca a disco lo que no dé tiempo a escribir"""
+        await self.worker.stop(timeout)
+        pending = self.worker.take_pending()
+        if pending:
+            await run_in_threadpool(self._spill, pending)
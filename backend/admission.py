@@ -0,0 +1,319 @@
+# Control de admisión y limitación de peticiones para Project Planner
+#
+# Middleware ASGI que, por cada regla de ruta, aplica:
+#   - límites de concurrencia con una cola de espera acotada (503 si se llena
+#     o se agota la espera),
+#   - token buckets por usuario (sub del JWT) y por IP (429 si se vacían).
+# Ambas respuestas incluyen Retry-After. El estado de los buckets vive en
+# memoria; con RATE_LIMIT_STORE=<ruta.db> se comparte entre workers a través
+# de un fichero SQLite.
+import asyncio
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import registry
+
+admission_rejections = registry.counter(
+    "planner_admission_rejections_total", "Peticiones rechazadas por el control de admisión",
+    ("rule", "reason"),
+)
+admission_queued = registry.gauge(
+    "planner_admission_queued", "Peticiones esperando un hueco de concurrencia", ("rule",),
+)
+
+
+@dataclass
+class RouteLimit:
+    """Límites de una ruta (o grupo de rutas)
+
+    Args:
+        name: Nombre de la regla (etiqueta de métricas)
+        pattern: Ruta con parámetros estilo FastAPI, p. ej. "/projects/{project_id}/tasks";
+            un "*" final aplica la regla a todo el prefijo
+        methods: Métodos HTTP a los que aplica (vacío = todos)
+        concurrency: Peticiones simultáneas por worker (None = sin límite)
+        queue_size: Peticiones que pueden esperar un hueco antes de responder 503
+        queue_timeout: Segundos máximos de espera en la cola
+        user_rate / user_burst: Token bucket por usuario (peticiones/s y ráfaga)
+        ip_rate / ip_burst: Token bucket por IP
+    """
+    name: str
+    pattern: str
+    methods: Tuple[str, ...] = ()
+    concurrency: Optional[int] = None
+    queue_size: int = 0
+    queue_timeout: float = 5.0
+    user_rate: Optional[float] = None
+    user_burst: Optional[float] = None
+    ip_rate: Optional[float] = None
+    ip_burst: Optional[float] = None
+
+    def compile(self) -> "re.Pattern":
+        if self.pattern.endswith("*"):
+            return re.compile(re.escape(self.pattern[:-1]) + ".*")
+        parts = re.split(r"(\{[^}]+\})", self.pattern)
+        regex = "".join("[^/]+" if part.startswith("{") else re.escape(part) for part in parts)
+        return re.compile(regex + "/?$")
+
+
+# Buckets sin uso durante más de BUCKET_IDLE_SECONDS se consideran llenos y se
+# eliminan; MemoryBucketStore los busca cada PRUNE_SECONDS
+BUCKET_IDLE_SECONDS = 3600
+PRUNE_SECONDS = 60
+
+
+class MemoryBucketStore:
+    """Token buckets en memoria del proceso"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._pruned = time.time()
+
+    async def take(self, key: str, rate: float, burst: float, now: float) -> float:
+        """Consume un token; devuelve 0 si se admite o los segundos hasta el siguiente token"""
+        with self._lock:
+            if now - self._pruned > PRUNE_SECONDS:
+                self._prune(now)
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1.0:
+                self._buckets[key] = (tokens - 1.0, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (1.0 - tokens) / rate
+
+    def _prune(self, now: float) -> None:
+        # Elimina buckets inactivos (llenos de nuevo) para acotar la memoria
+        stale = [k for k, (_, updated) in self._buckets.items() if now - updated > BUCKET_IDLE_SECONDS]
+        for key in stale:
+            del self._buckets[key]
+        self._pruned = now
+
+
+class SQLiteBucketStore:
+    """Token buckets compartidos entre workers en un fichero SQLite"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # Con preload_app (gunicorn_conf.py) el almacén se crea antes del fork: cada worker abre su conexión
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    async def take(self, key: str, rate: float, burst: float, now: float) -> float:
+        # BEGIN IMMEDIATE puede esperar al lock de escritura de otro worker: fuera del event loop
+        return await run_in_threadpool(self._take, key, rate, burst, now)
+
+    def _take(self, key: str, rate: float, burst: float, now: float) -> float:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0 if tokens >= 1.0 else (1.0 - tokens) / rate
+            if wait == 0.0:
+                tokens -= 1.0
+            conn.execute(
+                "INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+            return wait
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            # Si el almacén compartido falla se admite la petición (fail-open)
+            return 0.0
+
+
+class ConcurrencyLimiter:
+    """Semáforo con cola de espera acotada y tiempo máximo de espera"""
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: deque = deque()
+
+    async def acquire(self) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        admission_queued.inc((self.name,))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # El hueco llegó justo al expirar (o al cancelarse la petición): se devuelve
+                self.release()
+            else:
+                waiter.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return False
+        finally:
+            admission_queued.dec((self.name,))
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    def release(self) -> None:
+        # El hueco pasa directamente al primer esperando (sin decrementar active)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.timeout))
+
+
+class AdmissionControlMiddleware:
+    """Aplica las reglas de admisión antes de enrutar la petición
+
+    Args:
+        app: Aplicación ASGI
+        rules: Reglas evaluadas en orden; aplica la primera que coincide
+        identify_user: Función que devuelve el id de usuario a partir de la cabecera Authorization
+        store: Almacén de token buckets (memoria por defecto o SQLite compartido)
+        trust_proxy_headers: Usar X-Forwarded-For para la IP del cliente
+    """
+
+    def __init__(self, app, rules: List[RouteLimit], identify_user: Callable[[str], Optional[str]],
+                 store=None, trust_proxy_headers: bool = False):
+        self.app = app
+        self.rules = [(rule, rule.compile()) for rule in rules]
+        self.identify_user = identify_user
+        self.store = store or MemoryBucketStore()
+        self.trust_proxy_headers = trust_proxy_headers
+        self.limiters = {
+            rule.name: ConcurrencyLimiter(rule.name, rule.concurrency, rule.queue_size, rule.queue_timeout)
+            for rule in rules if rule.concurrency
+        }
+
+    def _match(self, method: str, path: str) -> Optional[RouteLimit]:
+        for rule, regex in self.rules:
+            if (not rule.methods or method in rule.methods) and regex.match(path):
+                return rule
+        return None
+
+    def _client_ip(self, scope, headers: Dict[bytes, bytes]) -> str:
+        if self.trust_proxy_headers and b"x-forwarded-for" in headers:
+            return headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def _reject(self, send, status_code: int, detail: str, retry_after: float) -> None:
+        body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        rule = self._match(scope["method"], scope["path"])
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        now = time.time()
+        if rule.ip_rate or rule.user_rate:
+            headers = dict(scope.get("headers") or [])
+            if rule.ip_rate:
+                key = f"ip:{rule.name}:{self._client_ip(scope, headers)}"
+                wait = await self.store.take(key, rule.ip_rate, rule.ip_burst or rule.ip_rate, now)
+                if wait:
+                    admission_rejections.inc((rule.name, "ip_rate"))
+                    await self._reject(send, 429, "Demasiadas peticiones, inténtalo más tarde", wait)
+                    return
+            if rule.user_rate and b"authorization" in headers:
+                user_id = self.identify_user(headers[b"authorization"].decode("latin-1"))
+                if user_id:
+                    key = f"user:{rule.name}:{user_id}"
+                    wait = await self.store.take(key, rule.user_rate, rule.user_burst or rule.user_rate, now)
+                    if wait:
+                        admission_rejections.inc((rule.name, "user_rate"))
+                        await self._reject(send, 429, "Demasiadas peticiones, inténtalo más tarde", wait)
+                        return
+
+        limiter = self.limiters.get(rule.name)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        if not await limiter.acquire():
+            admission_rejections.inc((rule.name, "overloaded"))
+            await self._reject(send, 503, "Servidor ocupado, inténtalo más tarde", limiter.retry_after())
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+
+def bucket_store_from_env():
+    """Almacén de buckets según RATE_LIMIT_STORE (ruta a SQLite) o en memoria"""
+    path = os.getenv("RATE_LIMIT_STORE")
+    return SQLiteBucketStore(path) if path else MemoryBucketStore()
+
+
+def jwt_subject_resolver(secret_key: str, algorithm: str) -> Callable[[str], Optional[str]]:
+    """Crea una función que extrae el 'sub' de un 'Bearer <jwt>' válido"""
+    import jwt
+
+    def identify(authorization: str) -> Optional[str]:
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        try:
+            return jwt.decode(token, secret_key, algorithms=[algorithm]).get("sub")
+        except jwt.PyJWTError:
+            return None
+
+    return identify
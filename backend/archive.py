@@ -0,0 +1,153 @@
+# Archivo de proyectos archivados y de tareas completadas antiguas
+#
+# Las tablas calientes (projects, tasks, comments, attachments) solo guardan
+# el trabajo activo: un trabajo periódico (ver scheduler.py) mueve por lotes a
+# archived_projects los proyectos marcados con is_archived, con todo su
+# contenido, y a archived_tasks las tareas completadas y sin cambios desde
+# hace más de TASKS_AFTER_DAYS días (ver archive_batch en
+# supabase_schema.sql). Cada entrada guarda sus filas completas en JSONB, así
+# que los listados normales, sus índices y las políticas RLS no las recorren.
+# El archivo se consulta con GET /archive/... (paginado por keyset sobre
+# archived_at, id) y POST /archive/.../restore devuelve una entrada a las
+# tablas calientes.
+#
+# Cada lote bloquea sus candidatos con SKIP LOCKED, así que no espera a las
+# escrituras de la API (las filas ocupadas pasan al lote siguiente), y una
+# ejecución encadena lotes hasta vaciar los candidatos o hacer MAX_BATCHES.
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import registry
+from pagination import decode_cursor, encode_cursor
+
+logger = logging.getLogger("planner.archive")
+
+# Intervalo entre ejecuciones del archivo (s)
+ARCHIVE_SECONDS = float(os.getenv("ARCHIVE_SECONDS", "3600"))
+# Proyectos y tareas por lote (una transacción cada uno)
+BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
+# Lotes por ejecución como máximo
+MAX_BATCHES = int(os.getenv("ARCHIVE_MAX_BATCHES", "50"))
+# Días desde que se completa (y se modifica por última vez) una tarea hasta archivarla
+TASKS_AFTER_DAYS = float(os.getenv("ARCHIVE_TASKS_AFTER_DAYS", "90"))
+
+archived_entries = registry.counter(
+    "planner_archived_total", "Proyectos y tareas movidos al archivo", ("kind",),
+)
+
+
+class SupabaseArchiveStore:
+    """Archivo en Postgres: lotes y restauraciones por conexión directa o RPC, lecturas por PostgREST"""
+
+    def __init__(self, client, pg):
+        self.client = client
+        self.pg = pg
+
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    async def _rpc(self, name: str, params: dict):
+        return await run_in_threadpool(lambda: self.client.rpc(name, params).execute().data)
+
+    async def archive_batch(self, limit: int, completed_before: datetime) -> dict:
+        """Un lote de archive_batch: {projects: [id], tasks: [{id, project_id}]}"""
+        if self.pg.enabled:
+            return await self.pg.archive_batch(limit, completed_before.isoformat())
+        return await self._rpc("archive_batch", {"p_limit": limit, "p_completed_before": completed_before.isoformat()})
+
+    async def restore_project(self, project_id: str) -> Optional[dict]:
+        """Fila del proyecto restaurado (None si no está en el archivo)"""
+        if self.pg.enabled:
+            return await self.pg.restore_archived_project(project_id)
+        return await self._rpc("restore_archived_project", {"p_project_id": project_id})
+
+    async def restore_task(self, task_id: str) -> Optional[dict]:
+        """Fila de la tarea restaurada (None si no está en el archivo)"""
+        if self.pg.enabled:
+            return await self.pg.restore_archived_task(task_id)
+        return await self._rpc("restore_archived_task", {"p_task_id": task_id})
+
+    async def _page(self, query, limit: int, cursor: Optional[str]) -> Tuple[List[dict], Optional[str]]:
+        # Más recientes primero, por keyset (archived_at, id)
+        if cursor:
+            archived_at, last_id = decode_cursor(cursor)
+            query = query.or_(f'archived_at.lt."{archived_at}",and(archived_at.eq."{archived_at}",id.lt.{last_id})')
+        query = query.order("archived_at", desc=True).order("id", desc=True).limit(limit + 1)
+        result = await run_in_threadpool(query.execute)
+        items = result.data[:limit]
+        next_cursor = encode_cursor(items[-1]["archived_at"], items[-1]["id"]) if len(result.data) > limit else None
+        return items, next_cursor
+
+    async def list_projects(self, user_id: str, limit: int,
+                            cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """Página de proyectos archivados de los que el usuario era miembro (sin su contenido)"""
+        query = self.client.table("archived_projects").select("id, project, archived_at").contains("members", [user_id])
+        return await self._page(query, limit, cursor)
+
+    async def list_tasks(self, project_id: str, limit: int,
+                         cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        """Página de tareas archivadas de un proyecto activo (sin comentarios ni adjuntos)"""
+        query = self.client.table("archived_tasks").select("id, task, archived_at").eq("project_id", project_id)
+        return await self._page(query, limit, cursor)
+
+    async def get_project(self, project_id: str) -> Optional[dict]:
+        """Entrada completa de un proyecto archivado"""
+        result = await run_in_threadpool(
+            lambda: self.client.table("archived_projects").select("*").eq("id", project_id).execute()
+        )
+        return result.data[0] if result.data else None
+
+    async def get_task(self, task_id: str) -> Optional[dict]:
+        """Entrada completa de una tarea archivada"""
+        result = await run_in_threadpool(
+            lambda: self.client.table("archived_tasks").select("*").eq("id", task_id).execute()
+        )
+        return result.data[0] if result.data else None
+
+    async def references_object(self, content_hash: str) -> bool:
+        """Si algún adjunto archivado usa el objeto almacenado con ese hash"""
+        for table in ("archived_projects", "archived_tasks"):
+            result = await run_in_threadpool(
+                lambda: self.client.table(table).select("id").contains("content_hashes", [content_hash]).limit(1).execute()
+            )
+            if result.data:
+                return True
+        return False
+
+
+class Archiver:
+    """Trabajo periódico que mueve al archivo los proyectos archivados y las tareas completadas antiguas
+
+    Args:
+        store: SupabaseArchiveStore
+        on_archived: Función llamada con el resultado de cada lote que archiva algo
+    """
+
+    def __init__(self, store, on_archived: Callable[[dict], None], batch_size: int = BATCH_SIZE,
+                 max_batches: int = MAX_BATCHES, tasks_after_days: float = TASKS_AFTER_DAYS):
+        self.store = store
+        self.on_archived = on_archived
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.tasks_after = timedelta(days=tasks_after_days)
+
+    async def run(self, ctx) -> Dict[str, int]:
+        completed_before = self.store.now() - self.tasks_after
+        totals = {"projects": 0, "tasks": 0}
+        for _ in range(self.max_batches):
+            batch = await self.store.archive_batch(self.batch_size, completed_before)
+            for kind in totals:
+                if batch[kind]:
+                    totals[kind] += len(batch[kind])
+                    archived_entries.inc((kind,), len(batch[kind]))
+            if batch["projects"] or batch["tasks"]:
+                self.on_archived(batch)
+            if len(batch["projects"]) < self.batch_size and len(batch["tasks"]) < self.batch_size:
+                break
+        else:
+            logger.info("Archivo: %s lotes sin vaciar los candidatos; sigue en la próxima ejecución", self.max_batches)
+        return totals
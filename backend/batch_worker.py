@@ -0,0 +1,150 @@
+# Trabajador en segundo plano que agrupa escrituras en lotes
+#
+# Los endpoints encolan elementos con submit() (sin esperar a la base de datos)
+# y una tarea asyncio los agrupa hasta max_batch elementos o max_delay segundos
+# y los entrega juntos a la función flush. La cola está acotada: si se llena,
+# submit() descarta el elemento y lo contabiliza en las métricas en lugar de
+# frenar a quien lo genera.
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+
+from metrics import registry
+
+logger = logging.getLogger("planner.batch_worker")
+
+batch_queue_depth = registry.gauge(
+    "planner_batch_queue_depth", "Elementos pendientes en la cola del trabajador", ("worker",),
+)
+batch_items = registry.counter(
+    "planner_batch_items_total", "Elementos procesados por el trabajador por resultado", ("worker", "result"),
+)
+batch_flush_duration = registry.histogram(
+    "planner_batch_flush_seconds", "Duración de cada escritura de lote", ("worker",),
+)
+
+
+class BatchWorker:
+    """Agrupa elementos encolados y los escribe por lotes en segundo plano
+
+    Args:
+        name: Nombre del trabajador (etiqueta de métricas y logs)
+        flush: Corrutina que recibe la lista de elementos de un lote
+        max_batch: Tamaño máximo de lote
+        max_delay: Segundos máximos que un elemento espera a que se complete su lote
+        max_queue: Elementos que pueden quedar pendientes antes de descartar
+        on_failure: Corrutina opcional llamada con (lote, excepción) si flush falla
+    """
+
+    def __init__(self, name: str, flush: Callable[[List[Any]], Awaitable[None]], max_batch: int = 500,
+                 max_delay: float = 0.25, max_queue: int = 10_000,
+                 on_failure: Optional[Callable[[List[Any], Exception], Awaitable[None]]] = None):
+        self.name = name
+        self.flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.on_failure = on_failure
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._collecting: List[Any] = []
+
+    def _ensure_started(self) -> None:
+        if self._task is None or self._task.done():
+            self._queue = self._queue or asyncio.Queue(self.max_queue)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def submit(self, item: Any) -> bool:
+        """Encola un elemento; devuelve False si la cola está llena y se descarta"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            batch_items.inc((self.name, "dropped"))
+            return False
+        batch_queue_depth.inc((self.name,))
+        return True
+
+    async def _next_batch(self, batch: List[Any]) -> None:
+        batch.append(await self._queue.get())
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self) -> None:
+        while True:
+            # El lote en formación queda en _collecting hasta que se entrega a flush
+            # u on_failure, para que take_pending() lo recupere si se detiene antes
+            batch = self._collecting = []
+            await self._next_batch(batch)
+            started = time.perf_counter()
+            try:
+                await self.flush(batch)
+                self._collecting = []
+                batch_items.inc((self.name, "flushed"), len(batch))
+            except asyncio.CancelledError as e:
+                # Detenido a mitad de escritura: el lote se entrega a on_failure antes de salir
+                if self.on_failure is not None:
+                    self._collecting = []
+                    await self.on_failure(batch, e)
+                raise
+            except Exception as e:
+                self._collecting = []
+                batch_items.inc((self.name, "failed"), len(batch))
+                logger.exception("Error al escribir un lote de %s (%d elementos)", self.name, len(batch))
+                if self.on_failure is not None:
+                    try:
+                        await self.on_failure(batch, e)
+                    except Exception:
+                        logger.exception("Error en on_failure de %s", self.name)
+            finally:
+                batch_flush_duration.observe((self.name,), time.perf_counter() - started)
+                if self._collecting is not batch:
+                    batch_queue_depth.dec((self.name,), len(batch))
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def drain(self) -> None:
+        """Espera a que se escriban todos los elementos encolados hasta ahora"""
+        if self._queue is not None and self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Escribe lo pendiente (como mucho timeout segundos) y detiene la tarea"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%s: se detiene con %d elementos sin escribir", self.name, self._queue.qsize())
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def take_pending(self) -> List[Any]:
+        """Saca los elementos que quedan sin escribir (tras stop())"""
+        items, self._collecting = self._collecting, []
+        batch_queue_depth.dec((self.name,), len(items))
+        while self._queue is not None and not self._queue.empty():
+            items.append(self._queue.get_nowait())
+            self._queue.task_done()
+            batch_queue_depth.dec((self.name,))
+        return items
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
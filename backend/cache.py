@@ -0,0 +1,87 @@
+# Cachés en memoria por proceso invalidadas a través del bus (ver invalidation.py)
+#
+# Cada caché es un tema del bus: invalidate(key) la vacía en este worker y en
+# los demás, y cada lectura aplica antes las invalidaciones pendientes. El TTL
+# solo acota lo que puede durar un valor si el bus compartido no está
+# configurado o falla.
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+from invalidation import InvalidationBus
+from metrics import record_cache_access
+
+
+class SharedCache:
+    """Caché LRU con TTL cuyo contenido se invalida en todos los workers
+
+    Args:
+        name: Nombre de la caché (tema del bus y etiqueta de las métricas)
+        bus: Bus de invalidación del proceso
+        ttl: Validez máxima de un valor (s)
+        max_entries: Entradas máximas (se descartan las menos usadas)
+    """
+
+    def __init__(self, name: str, bus: InvalidationBus, ttl: float, max_entries: int = 10_000):
+        self.name = name
+        self.bus = bus
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        bus.subscribe(name, self._evict)
+
+    def _evict(self, key: Optional[str]) -> None:
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        """(True, valor) si está en caché; si no, (False, generación actual)"""
+        self.bus.sync()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                record_cache_access(self.name, True)
+                return True, entry[0]
+            generation = self._generation
+        record_cache_access(self.name, False)
+        return False, generation
+
+    def _store(self, key: Hashable, value: Any, generation: int) -> None:
+        with self._lock:
+            # Si hubo una invalidación mientras se cargaba, el valor puede ser antiguo
+            if generation != self._generation:
+                return
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """Valor cacheado o load() si no está (los None también se cachean)"""
+        hit, found = self._lookup(key)
+        if hit:
+            return found
+        value = load()
+        self._store(key, value, found)
+        return value
+
+    async def aget_or_load(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        """Como get_or_load con una función de carga asíncrona"""
+        hit, found = self._lookup(key)
+        if hit:
+            return found
+        value = await load()
+        self._store(key, value, found)
+        return value
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Descarta la clave (o toda la caché) en este worker y en los demás"""
+        self.bus.publish(self.name, key)
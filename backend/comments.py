@@ -0,0 +1,61 @@
+# Hilos de comentarios de tareas y proyectos (backend Supabase)
+#
+# Un hilo se obtiene con una sola llamada a la función get_comment_thread de
+# supabase_schema.sql: una página de comentarios raíz (keyset por created_at,
+# id) y todas sus respuestas en orden de lectura. Aquí solo se anidan las filas.
+from typing import List, Optional, Tuple
+
+from pagination import decode_cursor, encode_cursor
+
+
+def format_comment_for_response(comment_data: dict) -> dict:
+    """Formatea un comentario para la respuesta de la API"""
+    return {
+        "id": comment_data.get("id"),
+        "content": comment_data.get("content"),
+        "project_id": comment_data.get("project_id"),
+        "task_id": comment_data.get("task_id"),
+        "parent_comment_id": comment_data.get("parent_comment_id"),
+        "created_by": comment_data.get("created_by"),
+        "is_edited": comment_data.get("is_edited", False),
+        "created_at": comment_data.get("created_at"),
+        "updated_at": comment_data.get("updated_at"),
+    }
+
+
+def build_comment_tree(rows: List[dict], limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Anida las filas del hilo; devuelve (comentarios raíz, cursor de la siguiente página)
+
+    Se piden limit + 1 raíces: si llega la de más, se descarta con sus
+    respuestas y hay página siguiente.
+    """
+    roots: List[dict] = []
+    nodes = {}
+    for row in rows:
+        node = {**format_comment_for_response(row), "replies": []}
+        nodes[node["id"]] = node
+        if row["depth"] == 0:
+            roots.append(node)
+        else:
+            nodes[row["parent_comment_id"]]["replies"].append(node)
+    if len(roots) <= limit:
+        return roots, None
+    roots = roots[:limit]
+    return roots, encode_cursor(roots[-1]["created_at"], roots[-1]["id"])
+
+
+async def fetch_comment_thread(client, pg, task_id: Optional[str], project_id: Optional[str],
+                               limit: int, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Página de un hilo de comentarios; ValueError si el cursor no es válido"""
+    after_created_at, after_id = decode_cursor(cursor) if cursor else (None, None)
+    if pg.enabled:
+        rows = await pg.comment_thread(task_id, project_id, limit + 1, after_created_at, after_id)
+    else:
+        rows = client.rpc("get_comment_thread", {
+            "p_task_id": task_id,
+            "p_project_id": project_id,
+            "p_limit": limit + 1,
+            "p_after_created_at": after_created_at,
+            "p_after_id": after_id,
+        }).execute().data
+    return build_comment_tree(rows, limit)
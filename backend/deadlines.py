@@ -0,0 +1,127 @@
+# Barrido periódico de vencimientos de tareas
+#
+# En cada ejecución (ver scheduler.py) se recorre por rango el índice de
+# due_date entre el barrido anterior y ahora:
+#   - due_soon: tareas cuyo vencimiento entra en el horizonte de aviso
+#     (due_date en (último + horizonte, ahora + horizonte]),
+#   - overdue: tareas que acaban de vencer (due_date en (último, ahora]).
+# Cada tarea pendiente que cruza un umbral se marca en deadline_status con un
+# UPDATE ... RETURNING y se emite un evento por ella, así que el coste de un
+# barrido depende de las tareas que cruzan su vencimiento y no del tamaño de la
+# tabla. El marcado es idempotente (solo cambia las filas aún no marcadas), así
+# que repetir una ventana tras un fallo no duplica eventos. El final de la
+# ventana se guarda en el estado del lease del trabajo.
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List
+
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import registry
+
+logger = logging.getLogger("planner.deadlines")
+
+# Intervalo entre barridos (s)
+SWEEP_SECONDS = float(os.getenv("DEADLINE_SWEEP_SECONDS", "60"))
+# Antelación con la que una tarea pasa a due_soon
+DUE_SOON_HOURS = float(os.getenv("DEADLINE_DUE_SOON_HOURS", "24"))
+# Ventana del primer barrido cuando no hay estado guardado
+INITIAL_LOOKBACK_HOURS = float(os.getenv("DEADLINE_INITIAL_LOOKBACK_HOURS", "24"))
+
+deadline_events = registry.counter(
+    "planner_deadline_events_total", "Tareas marcadas por el barrido de vencimientos", ("state",),
+)
+
+
+class SqliteDeadlineStore:
+    """Marcado de vencimientos en la tabla tasks de SQLite (columnas camelCase)
+
+    dueDate se guarda como texto ISO en hora local, igual que el resto de
+    fechas de main.py, así que las ventanas se comparan como texto (una fecha
+    sin hora vence a las 00:00 de ese día).
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def _flag(self, start: str, end: str, state: str, from_states: List[str]) -> List[dict]:
+        placeholders = ", ".join("?" for _ in from_states) or "NULL"
+        with self.connect() as conn:
+            rows = conn.execute(
+                f"""
+                UPDATE tasks SET deadlineStatus = ?
+                WHERE dueDate > ? AND dueDate <= ?
+                  AND COALESCE(status, '') NOT IN ('completed', 'cancelled')
+                  AND (deadlineStatus IS NULL OR deadlineStatus IN ({placeholders}))
+                RETURNING id, title, projectId, assignedTo, dueDate
+                """,
+                (state, start, end, *from_states),
+            ).fetchall()
+            conn.commit()
+        return [dict(row) for row in rows]
+
+    async def flag(self, start: datetime, end: datetime, state: str, from_states: List[str]) -> List[dict]:
+        return await run_in_threadpool(
+            self._flag, start.isoformat(timespec="seconds"), end.isoformat(timespec="seconds"), state, from_states
+        )
+
+
+class SupabaseDeadlineStore:
+    """Marcado de vencimientos en Postgres (conexión directa o PostgREST)"""
+
+    def __init__(self, client, pg):
+        self.client = client
+        self.pg = pg
+
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    async def flag(self, start: datetime, end: datetime, state: str, from_states: List[str]) -> List[dict]:
+        if self.pg.enabled:
+            return await self.pg.flag_deadlines(start.isoformat(), end.isoformat(), state, from_states)
+        previous = ",".join(["deadline_status.is.null"] + [f"deadline_status.eq.{s}" for s in from_states])
+        result = await run_in_threadpool(
+            lambda: self.client.table("tasks").update({"deadline_status": state})
+            .gt("due_date", start.isoformat()).lte("due_date", end.isoformat())
+            .neq("status", "completed").neq("status", "cancelled")
+            .or_(previous).execute()
+        )
+        return result.data or []
+
+
+class DeadlineSweeper:
+    """Trabajo periódico que marca las tareas que cruzan su vencimiento
+
+    Args:
+        store: SqliteDeadlineStore o SupabaseDeadlineStore
+        on_flagged: Función llamada con (estado, tareas marcadas) tras cada barrido
+    """
+
+    def __init__(self, store, on_flagged: Callable[[str, List[dict]], None],
+                 due_soon_hours: float = DUE_SOON_HOURS, initial_lookback_hours: float = INITIAL_LOOKBACK_HOURS):
+        self.store = store
+        self.on_flagged = on_flagged
+        self.due_soon = timedelta(hours=due_soon_hours)
+        self.initial_lookback = timedelta(hours=initial_lookback_hours)
+
+    async def sweep(self, ctx) -> Dict[str, int]:
+        now = self.store.now()
+        saved = await ctx.load_state()
+        last = datetime.fromisoformat(saved) if saved else now - self.initial_lookback
+        if last >= now:
+            return {"due_soon": 0, "overdue": 0}
+        flagged = {
+            "due_soon": await self.store.flag(last + self.due_soon, now + self.due_soon, "due_soon", []),
+            "overdue": await self.store.flag(last, now, "overdue", ["due_soon"]),
+        }
+        if not await ctx.save_state(now.isoformat()):
+            logger.warning("Lease de %s perdido durante el barrido; otro worker repetirá la ventana", ctx.job.name)
+        for state, tasks in flagged.items():
+            if tasks:
+                deadline_events.inc((state,), len(tasks))
+                self.on_flagged(state, tasks)
+        return {state: len(tasks) for state, tasks in flagged.items()}
@@ -0,0 +1,61 @@
+# ETags: control de concurrencia optimista en las escrituras de proyectos y tareas
+#
+# projects y tasks tienen una columna version que el trigger
+# update_updated_at_unless_counters incrementa con cada modificación (no con
+# los contadores mantenidos por el sistema). Las respuestas la devuelven como
+# ETag y PUT exige If-Match con la versión leída: el UPDATE lleva la versión en
+# su WHERE junto al predicado de permisos, así que una sola sentencia comprueba
+# que la fila existe, que el usuario puede modificarla y que nadie la ha
+# cambiado desde que la leyó. Solo si no modifica nada se vuelve a leer la fila
+# para responder 404, 403 o 412. If-Match: * escribe sin comprobar la versión.
+# Mientras los clientes se actualizan, una petición sin If-Match se acepta como
+# If-Match: * con un aviso en el log; REQUIRE_IF_MATCH=true la rechaza con 428.
+#
+# Las respuestas de datos de referencia (ver reference_data.py) llevan en cambio
+# un ETag del contenido y responden 304 a If-None-Match.
+import hashlib
+import logging
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException, Request
+
+logger = logging.getLogger("planner.etags")
+
+# Si PUT sin If-Match se rechaza (428) o se acepta sin comprobar la versión (transición)
+REQUIRE_IF_MATCH = os.getenv("REQUIRE_IF_MATCH", "false").lower() == "true"
+
+
+def version_etag(version: int) -> str:
+    """ETag de una versión de fila"""
+    return f'"{version}"'
+
+
+def if_match_version(request: Request, if_match: Optional[str] = Header(None)) -> Optional[int]:
+    """Dependencia de FastAPI: versión de If-Match (None con * o, en transición, si falta);
+    428 si falta y REQUIRE_IF_MATCH, 412 si no es una versión"""
+    if if_match is None:
+        if REQUIRE_IF_MATCH:
+            raise HTTPException(status_code=428, detail="Falta la cabecera If-Match con el ETag leído")
+        logger.warning("%s %s sin If-Match: se escribe sin comprobar la versión", request.method, request.url.path)
+        return None
+    tag = if_match.strip()
+    if tag == "*":
+        return None
+    if len(tag) > 2 and tag[0] == tag[-1] == '"' and tag[1:-1].isdigit():
+        return int(tag[1:-1])
+    # Una etiqueta débil o con otro formato nunca coincide con la versión actual
+    raise HTTPException(status_code=412, detail="If-Match no coincide con la versión actual")
+
+
+def content_etag(body: bytes) -> str:
+    """ETag fuerte del contenido exacto de una respuesta"""
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Si If-None-Match incluye el ETag (comparación débil, como indica la RFC 9110)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
@@ -0,0 +1,58 @@
+# Selección de campos (?fields=) en las lecturas de proyectos y tareas
+#
+# ?fields=id,title,status limita la respuesta a esas claves y la consulta a
+# esas columnas (select() de PostgREST o SELECT de SQL), así que las vistas
+# de lista no transfieren descripciones largas que no muestran. Los nombres
+# se validan contra una lista permitida: son lo único que llega al SQL. Se
+# devuelven siempre en el orden de la lista, para que cada combinación dé un
+# único texto de consulta (y una sola sentencia preparada).
+from typing import Iterable, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Query
+
+from serializers import PROJECT_SERIALIZER, TASK_SERIALIZER
+
+# Campos de respuesta de main_supabase.py
+PROJECT_FIELDS = PROJECT_SERIALIZER.names
+TASK_FIELDS = TASK_SERIALIZER.names
+
+# Columnas de main.py (SQLite)
+SQLITE_PROJECT_FIELDS = (
+    "id", "name", "description", "startDate", "endDate", "priority", "status", "createdBy", "createdAt",
+    "updatedAt", "changeSeq",
+)
+SQLITE_TASK_FIELDS = (
+    "id", "title", "description", "assignedTo", "priority", "status", "dueDate", "projectId", "createdAt",
+    "deadlineStatus", "startDate", "updatedAt", "changeSeq",
+)
+
+Fields = Optional[Tuple[str, ...]]
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> Fields:
+    """Campos pedidos (siempre con id) en el orden de allowed; None = todos. ValueError si alguno no está permitido"""
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested.difference(allowed)
+    if unknown:
+        raise ValueError(f"Campos no permitidos: {', '.join(sorted(unknown))}")
+    requested.add("id")
+    return tuple(name for name in allowed if name in requested)
+
+
+def fields_param(allowed: Sequence[str]):
+    """Dependencia de FastAPI con el ?fields= validado (400 si pide campos no permitidos)"""
+    def dependency(fields: Optional[str] = Query(None, description="Campos separados por comas")) -> Fields:
+        try:
+            return parse_fields(fields, allowed)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return dependency
+
+
+def column_list(fields: Fields, extra: Iterable[str] = ()) -> str:
+    """Columnas a leer: los campos pedidos más los que necesita el servidor ("*" si se piden todos)"""
+    if fields is None:
+        return "*"
+    return ", ".join(dict.fromkeys((*fields, *extra)))
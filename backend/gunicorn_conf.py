@@ -0,0 +1,45 @@
+# Configuración de Gunicorn para servir la API con varios workers
+#
+#   gunicorn -c gunicorn_conf.py main_supabase:app     (o main:app)
+#
+# - Un worker de uvicorn por CPU disponible (WEB_CONCURRENCY para fijarlo).
+# - preload_app: la aplicación se importa una vez en el proceso maestro antes
+#   de crear los workers (arranque más rápido y memoria compartida por
+#   copy-on-write). Las conexiones (Postgres, SQLite, clientes HTTP) se abren
+#   en cada worker en su evento de startup o en el primer uso.
+# - Las cachés en memoria de cada worker se invalidan entre workers con el bus
+#   de invalidation.py, y los límites de peticiones se comparten en un fichero
+#   SQLite. Si no se indican rutas se usan ficheros del directorio temporal del
+#   host; con varios contenedores hay que apuntarlas a un volumen compartido.
+import os
+import tempfile
+
+
+def cpu_count() -> int:
+    """CPUs que puede usar este proceso (afinidad del contenedor incluida)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - sin sched_getaffinity (macOS)
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8001')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or cpu_count()
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+
+# Un worker que no responde en este tiempo se reinicia; al apagar, las
+# peticiones en curso y los lotes pendientes (actividad, notificaciones)
+# tienen graceful_timeout segundos para terminar
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+# Estado compartido entre workers (se fija antes de importar la aplicación)
+_shared_dir = os.getenv("SHARED_STATE_DIR", tempfile.gettempdir())
+os.environ.setdefault("CACHE_INVALIDATION_DB", os.path.join(_shared_dir, "planner-invalidation.db"))
+os.environ.setdefault("RATE_LIMIT_STORE", os.path.join(_shared_dir, "planner-rate-limits.db"))
@@ -0,0 +1,166 @@
+# Bus de invalidación de cachés entre workers
+#
+# Con varios workers (gunicorn_conf.py) cada proceso tiene sus propias cachés
+# en memoria. Cuando un worker modifica algo publica una invalidación (tema y
+# clave opcional) que se aplica en el acto a sus cachés y se añade a la tabla
+# cache_invalidations de un fichero SQLite compartido (CACHE_INVALIDATION_DB).
+# Los demás workers leen las filas nuevas (seq > última vista) antes de servir
+# un valor cacheado, así que una lectura posterior a la escritura en cualquier
+# worker ya no ve el valor antiguo. La consulta es un rango sobre la clave
+# primaria y cuesta decenas de microsegundos.
+#
+# Sin CACHE_INVALIDATION_DB el bus solo invalida las cachés del propio proceso
+# (un único worker). Todos los workers y contenedores deben ver el mismo
+# fichero (mismo host o volumen compartido).
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger("planner.invalidation")
+
+# Antigüedad a partir de la cual se borran las filas ya aplicadas (s)
+RETENTION_SECONDS = float(os.getenv("CACHE_INVALIDATION_RETENTION", "3600"))
+# Publicaciones entre dos limpiezas de filas antiguas
+PRUNE_EVERY = 1000
+
+Handler = Callable[[Optional[str]], None]
+
+
+class InvalidationBus:
+    """Publica invalidaciones y las aplica en las cachés suscritas de cada proceso
+
+    Args:
+        path: Fichero SQLite compartido entre workers (None: solo este proceso)
+    """
+
+    def __init__(self, path: Optional[str] = None, retention_seconds: float = RETENTION_SECONDS):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid: Optional[int] = None
+        self._origin = ""
+        self._last_seq = 0
+        self._published = 0
+
+    @property
+    def shared(self) -> bool:
+        return bool(self.path)
+
+    def subscribe(self, topic: str, handler: Handler) -> None:
+        """handler(key) se llama con la clave invalidada (None: todo el tema)"""
+        self._handlers[topic].append(handler)
+
+    def _dispatch(self, topic: str, key: Optional[str]) -> None:
+        for handler in self._handlers.get(topic, ()):
+            try:
+                handler(key)
+            except Exception:
+                logger.exception("Error al invalidar la caché %s", topic)
+
+    def _dispatch_all(self) -> None:
+        for topic in list(self._handlers):
+            self._dispatch(topic, None)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Estado por proceso: con preload_app el módulo se importa antes del fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._local = threading.local()
+                    self._local.conn = self._open()
+                    self._origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+                    self._last_seq = self._max_seq(self._local.conn)
+                    self._published = 0
+                    self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_invalidations (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                key TEXT,
+                origin TEXT NOT NULL,
+                createdAt REAL NOT NULL
+            )
+        ''')
+        return conn
+
+    @staticmethod
+    def _max_seq(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT COALESCE(max(seq), 0) FROM cache_invalidations").fetchone()[0]
+
+    def publish(self, topic: str, key: Optional[str] = None) -> None:
+        """Invalida la clave (o todo el tema) en este proceso y en los demás workers"""
+        self._dispatch(topic, key)
+        if not self.shared:
+            return
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO cache_invalidations (topic, key, origin, createdAt) VALUES (?, ?, ?, ?)",
+                (topic, key, self._origin, time.time()),
+            )
+            self._published += 1
+            if self._published % PRUNE_EVERY == 0:
+                self._prune(conn)
+        except sqlite3.Error:
+            # Sin el fichero compartido los demás workers solo se corrigen por TTL
+            logger.exception("No se pudo publicar la invalidación de %s", topic)
+
+    def _prune(self, conn: sqlite3.Connection) -> None:
+        # Se conserva siempre la última fila para poder detectar huecos en sync()
+        conn.execute(
+            "DELETE FROM cache_invalidations WHERE createdAt < ? "
+            "AND seq < (SELECT max(seq) FROM cache_invalidations)",
+            (time.time() - self.retention_seconds,),
+        )
+
+    def sync(self) -> None:
+        """Aplica las invalidaciones publicadas por otros workers desde la última llamada"""
+        if not self.shared:
+            return
+        try:
+            conn = self._connect()
+            with self._lock:
+                last_seq = self._last_seq
+                rows = conn.execute(
+                    "SELECT seq, topic, key, origin FROM cache_invalidations WHERE seq > ? ORDER BY seq",
+                    (last_seq,),
+                ).fetchall()
+                if not rows:
+                    return
+                self._last_seq = rows[-1][0]
+        except sqlite3.Error:
+            logger.exception("No se pudieron leer las invalidaciones")
+            return
+        if rows[0][0] > last_seq + 1:
+            # Filas borradas sin haberlas leído (worker parado más que la retención)
+            self._dispatch_all()
+            return
+        for _, topic, key, origin in rows:
+            if origin != self._origin:
+                self._dispatch(topic, key)
+
+
+def bus_from_env() -> InvalidationBus:
+    """Bus compartido si CACHE_INVALIDATION_DB indica el fichero SQLite"""
+    return InvalidationBus(os.getenv("CACHE_INVALIDATION_DB") or None)
+
+
+# Instancia global del proceso
+bus = bus_from_env()
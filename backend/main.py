@@ -1,16 +1,29 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel
 from typing import List, Optional
 import sqlite3
+import json
 import hashlib
 import jwt
 import datetime
 from contextlib import contextmanager
 import os
+from metrics import MetricsMiddleware, registry, metrics_authorized, PROMETHEUS_CONTENT_TYPE
+from query_log import ProfiledConnection, profiler
+from admission import AdmissionControlMiddleware, RouteLimit, bucket_store_from_env, jwt_subject_resolver
+from activity import ActivityLog
+from scheduler import Scheduler, SqliteLeaseStore
+from deadlines import DeadlineSweeper, SqliteDeadlineStore, SWEEP_SECONDS
+from timeline import sqlite_timeline
+from fields import SQLITE_PROJECT_FIELDS, SQLITE_TASK_FIELDS, Fields, column_list, fields_param
+from serializers import sqlite_response
+from sync import DEFAULT_LIMIT as SYNC_DEFAULT_LIMIT, MAX_LIMIT as SYNC_MAX_LIMIT, PRUNE_SECONDS, SqliteTombstones, sqlite_sync
+from pagination import decode_cursor, encode_cursor
+from partitions import MAINTENANCE_SECONDS as PARTITION_SECONDS, RETENTION_MONTHS, SqliteMonthlyTables
 
 app = FastAPI(title="Project Planner API", version="1.0.0")
 
@@ -35,6 +48,29 @@ if SECRET_KEY == "your-secret-key-change-in-production-please" and os.getenv("EN
 
 security = HTTPBearer()
 
+# Control de admisión: se aplica la primera regla que coincide con la ruta
+ADMISSION_RULES = [
+    RouteLimit("auth_login", "/api/auth/login", ("POST",), concurrency=8, queue_size=32,
+               queue_timeout=5.0, ip_rate=1.0, ip_burst=10),
+    RouteLimit("auth_register", "/api/auth/register", ("POST",), concurrency=4, queue_size=16,
+               queue_timeout=5.0, ip_rate=0.2, ip_burst=5),
+    RouteLimit("tasks_list", "/api/tasks", ("GET",), concurrency=4, queue_size=32,
+               queue_timeout=10.0, user_rate=2.0, user_burst=10),
+    RouteLimit("api", "/api/*", user_rate=20.0, user_burst=60, ip_rate=50.0, ip_burst=100),
+]
+if os.getenv("RATE_LIMITS_ENABLED", "true").lower() != "false":
+    app.add_middleware(
+        AdmissionControlMiddleware,
+        rules=ADMISSION_RULES,
+        identify_user=jwt_subject_resolver(SECRET_KEY, ALGORITHM),
+        store=bucket_store_from_env(),
+        trust_proxy_headers=os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true",
+    )
+app.add_middleware(MetricsMiddleware)
+
+# Ruta de la base de datos SQLite (configurable para despliegues y benchmarks)
+DATABASE_PATH = os.getenv("SQLITE_DB_PATH", "planner.db")
+
 # Modelos Pydantic
 class UserCreate(BaseModel):
     name: str
@@ -72,6 +108,7 @@ class TaskCreate(BaseModel):
     status: str
     dueDate: str
     projectId: str
+    startDate: Optional[str] = None
 
 # Funciones de utilidad
 def hash_password(password: str) -> str:
@@ -94,18 +131,49 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Token inválido")
 
+def verify_admin(user_id: str = Depends(verify_token)):
+    with get_db() as conn:
+        user = conn.execute("SELECT role FROM users WHERE id = ?", (user_id,)).fetchone()
+    if not user or user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Se requieren permisos de administrador")
+    return user_id
+
 # Gestión de base de datos
 @contextmanager
 def get_db():
-    conn = sqlite3.connect('planner.db')
+    conn = sqlite3.connect(DATABASE_PATH, factory=ProfiledConnection)
     conn.row_factory = sqlite3.Row
     try:
         yield conn
     finally:
         conn.close()
 
+# Registro de actividad en una tabla por mes con retención (ver partitions.py)
+activity_tables = SqliteMonthlyTables(
+    get_db,
+    "activity_log",
+    """
+        id TEXT PRIMARY KEY,
+        userId TEXT,
+        action TEXT NOT NULL,
+        entityType TEXT NOT NULL,
+        entityId TEXT NOT NULL,
+        projectId TEXT,
+        oldValues TEXT,
+        newValues TEXT,
+        description TEXT,
+        createdAt TEXT NOT NULL
+    """,
+    (("entity", "entityType, entityId, createdAt, id"), ("project", "projectId, createdAt, id")),
+    "createdAt",
+    retention_months=RETENTION_MONTHS["activity_log"],
+)
+
 def init_db():
     with get_db() as conn:
+        # Con varios workers (gunicorn_conf.py) todos ejecutan init_db al arrancar: se hace de uno en uno
+        conn.execute("BEGIN IMMEDIATE")
+        
         # Tabla de usuarios
         conn.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -132,6 +200,8 @@ def init_db():
                 status TEXT,
                 createdBy TEXT,
                 createdAt TEXT NOT NULL,
+                updatedAt TEXT,
+                changeSeq INTEGER NOT NULL DEFAULT 0,
                 FOREIGN KEY (createdBy) REFERENCES users (id)
             )
         ''')
@@ -148,11 +218,135 @@ def init_db():
                 dueDate TEXT,
                 projectId TEXT,
                 createdAt TEXT NOT NULL,
+                deadlineStatus TEXT,
+                startDate TEXT,
+                updatedAt TEXT,
+                changeSeq INTEGER NOT NULL DEFAULT 0,
                 FOREIGN KEY (projectId) REFERENCES projects (id)
             )
         ''')
+        # Bases creadas antes de deadlineStatus (marcado por el barrido de vencimientos)
+        task_columns = {row["name"] for row in conn.execute("PRAGMA table_info(tasks)")}
+        if "deadlineStatus" not in task_columns:
+            conn.execute("ALTER TABLE tasks ADD COLUMN deadlineStatus TEXT")
+        if "startDate" not in task_columns:
+            conn.execute("ALTER TABLE tasks ADD COLUMN startDate TEXT")
+        # Bases creadas antes de la sincronización incremental: las filas existentes
+        # quedan en la posición 0 y llegan con la primera sincronización completa
+        project_columns = {row["name"] for row in conn.execute("PRAGMA table_info(projects)")}
+        for table, columns in (("projects", project_columns), ("tasks", task_columns)):
+            if "updatedAt" not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN updatedAt TEXT")
+                conn.execute(f"UPDATE {table} SET updatedAt = createdAt")
+            if "changeSeq" not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN changeSeq INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks (dueDate)")
+        
+        # Índice de intervalos [startDate, dueDate] para la línea de tiempo (ver timeline.py).
+        # minT/maxT son float32 redondeados hacia fuera; startAt/endAt guardan los segundos exactos.
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tasks_timeline USING rtree(id, minT, maxT, +startAt, +endAt)")
+        conn.execute('''
+            CREATE VIEW IF NOT EXISTS tasks_timeline_source AS
+            SELECT id, min(a, b) AS startAt, max(a, b) AS endAt FROM (
+                SELECT rowid AS id,
+                       CAST(strftime('%s', COALESCE(startDate, dueDate)) AS INTEGER) AS a,
+                       CAST(strftime('%s', COALESCE(dueDate, startDate)) AS INTEGER) AS b
+                FROM tasks
+            )
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS tasks_timeline_insert AFTER INSERT ON tasks BEGIN
+                INSERT INTO tasks_timeline (id, minT, maxT, startAt, endAt)
+                SELECT id, startAt, endAt, startAt, endAt FROM tasks_timeline_source
+                WHERE id = NEW.rowid AND startAt IS NOT NULL;
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS tasks_timeline_update AFTER UPDATE OF startDate, dueDate ON tasks BEGIN
+                DELETE FROM tasks_timeline WHERE id = OLD.rowid;
+                INSERT INTO tasks_timeline (id, minT, maxT, startAt, endAt)
+                SELECT id, startAt, endAt, startAt, endAt FROM tasks_timeline_source
+                WHERE id = NEW.rowid AND startAt IS NOT NULL;
+            END
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS tasks_timeline_delete AFTER DELETE ON tasks BEGIN
+                DELETE FROM tasks_timeline WHERE id = OLD.rowid;
+            END
+        ''')
+        # Se rellena si no cuadra con tasks (tareas anteriores a la tabla). Tras un VACUUM,
+        # que puede renumerar los rowid de tasks, hay que borrar tasks_timeline para reconstruirla.
+        indexed = conn.execute("SELECT count(*) FROM tasks_timeline").fetchone()[0]
+        dated = conn.execute("SELECT count(*) FROM tasks WHERE COALESCE(startDate, dueDate) IS NOT NULL").fetchone()[0]
+        if indexed != dated:
+            conn.execute("DELETE FROM tasks_timeline")
+            conn.execute(
+                "INSERT INTO tasks_timeline (id, minT, maxT, startAt, endAt) "
+                "SELECT id, startAt, endAt, startAt, endAt FROM tasks_timeline_source WHERE startAt IS NOT NULL"
+            )
+
+        # Sincronización incremental (ver sync.py): cada alta o cambio de un proyecto o
+        # una tarea toma la siguiente posición de sync_state y cada baja deja una lápida
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                changeSeq INTEGER NOT NULL
+            )
+        ''')
+        conn.execute("INSERT OR IGNORE INTO sync_state (id, changeSeq) VALUES (1, 0)")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS deleted_records (
+                changeSeq INTEGER PRIMARY KEY,
+                entityType TEXT NOT NULL,
+                entityId TEXT NOT NULL,
+                projectId TEXT,
+                deletedAt TEXT NOT NULL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_deleted_records_deleted_at ON deleted_records (deletedAt)")
+        for table, entity, project_column in (("projects", "project", "id"), ("tasks", "task", "projectId")):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_change_seq ON {table} (changeSeq, id)")
+            # El UPDATE del trigger de alta cambia changeSeq, así que no cuenta otra vez como modificación
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table} BEGIN
+                    UPDATE sync_state SET changeSeq = changeSeq + 1 WHERE id = 1;
+                    UPDATE {table} SET changeSeq = (SELECT changeSeq FROM sync_state WHERE id = 1),
+                                       updatedAt = COALESCE(NEW.updatedAt, NEW.createdAt)
+                    WHERE rowid = NEW.rowid;
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE ON {table}
+                WHEN NEW.changeSeq = OLD.changeSeq BEGIN
+                    UPDATE sync_state SET changeSeq = changeSeq + 1 WHERE id = 1;
+                    UPDATE {table} SET changeSeq = (SELECT changeSeq FROM sync_state WHERE id = 1),
+                                       updatedAt = strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')
+                    WHERE rowid = NEW.rowid;
+                END
+            ''')
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_sync_delete AFTER DELETE ON {table} BEGIN
+                    UPDATE sync_state SET changeSeq = changeSeq + 1 WHERE id = 1;
+                    INSERT INTO deleted_records (changeSeq, entityType, entityId, projectId, deletedAt)
+                    VALUES ((SELECT changeSeq FROM sync_state WHERE id = 1), '{entity}', OLD.id, OLD.{project_column},
+                            strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime'));
+                END
+            ''')
+
+        # Registro de actividad (se escribe por lotes desde ActivityLog), una tabla por mes
+        activity_tables.migrate(conn)
+        activity_tables.rotate(conn)
+        
+        # Leases y estado de los trabajos periódicos (ver scheduler.py)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS scheduler_leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expiresAt REAL NOT NULL,
+                state TEXT
+            )
+        ''')
         
-        conn.commit()
         
         # Crear usuario admin por defecto
         cursor = conn.execute("SELECT * FROM users WHERE username = ?", ("admin123",))
@@ -163,7 +357,35 @@ def init_db():
                 (admin_id, "Administrador", "admin123", "admin@planner.com", 
                  hash_password("admin123"), "admin", datetime.datetime.now().isoformat())
             )
-            conn.commit()
+        conn.commit()
+
+def write_activity(entries: List[dict]):
+    with get_db() as conn:
+        activity_tables.insert(
+            conn,
+            ("id", "userId", "action", "entityType", "entityId", "projectId", "oldValues", "newValues", "description", "createdAt"),
+            [(e["id"], e["user_id"], e["action"], e["entity_type"], e["entity_id"], e["project_id"],
+              json.dumps(e["old_values"]) if e["old_values"] is not None else None,
+              json.dumps(e["new_values"]) if e["new_values"] is not None else None,
+              e["description"], e["created_at"]) for e in entries],
+            verb="INSERT OR IGNORE",
+        )
+        conn.commit()
+
+# Auditoría de mutaciones con escritura diferida (ver activity.py)
+activity = ActivityLog(write_activity, f"{DATABASE_PATH}.activity-spill.jsonl")
+
+# Barrido periódico de vencimientos con un único líder entre workers (ver deadlines.py)
+def record_deadlines(state: str, tasks: List[dict]):
+    for task in tasks:
+        activity.record(None, state, "task", task["id"], project_id=task["projectId"],
+                        new_values={"deadlineStatus": state, "dueDate": task["dueDate"]})
+
+scheduler = Scheduler(SqliteLeaseStore(get_db))
+deadline_sweeper = DeadlineSweeper(SqliteDeadlineStore(get_db), record_deadlines)
+scheduler.add_job("deadline_sweep", SWEEP_SECONDS, deadline_sweeper.sweep)
+scheduler.add_job("sync_tombstone_prune", PRUNE_SECONDS, SqliteTombstones(get_db).prune)
+scheduler.add_job("partition_maintenance", PARTITION_SECONDS, activity_tables.maintain)
 
 # Endpoints de autenticación
 @app.post("/api/auth/register")
@@ -237,11 +459,11 @@ async def get_current_user(user_id: str = Depends(verify_token)):
 
 # Endpoints de proyectos
 @app.get("/api/projects")
-async def get_projects(user_id: str = Depends(verify_token)):
+async def get_projects(fields: Fields = Depends(fields_param(SQLITE_PROJECT_FIELDS)),
+                       user_id: str = Depends(verify_token)):
     with get_db() as conn:
-        cursor = conn.execute("SELECT * FROM projects ORDER BY createdAt DESC")
-        projects = [dict(row) for row in cursor.fetchall()]
-        return projects
+        cursor = conn.execute(f"SELECT {column_list(fields)} FROM projects ORDER BY createdAt DESC")
+        return sqlite_response(cursor)
 
 @app.post("/api/projects")
 async def create_project(project: ProjectCreate, user_id: str = Depends(verify_token)):
@@ -254,32 +476,123 @@ async def create_project(project: ProjectCreate, user_id: str = Depends(verify_t
              datetime.datetime.now().isoformat())
         )
         conn.commit()
+        activity.record(user_id, "created", "project", project_id, project_id=project_id, new_values=project.dict())
         return {"success": True, "id": project_id}
 
 # Endpoints de tareas
 @app.get("/api/tasks")
-async def get_tasks(project_id: Optional[str] = None, user_id: str = Depends(verify_token)):
+async def get_tasks(project_id: Optional[str] = None, fields: Fields = Depends(fields_param(SQLITE_TASK_FIELDS)),
+                    user_id: str = Depends(verify_token)):
+    columns = column_list(fields)
     with get_db() as conn:
         if project_id:
-            cursor = conn.execute("SELECT * FROM tasks WHERE projectId = ? ORDER BY createdAt DESC", (project_id,))
+            cursor = conn.execute(f"SELECT {columns} FROM tasks WHERE projectId = ? ORDER BY createdAt DESC", (project_id,))
         else:
-            cursor = conn.execute("SELECT * FROM tasks ORDER BY createdAt DESC")
-        tasks = [dict(row) for row in cursor.fetchall()]
-        return tasks
+            cursor = conn.execute(f"SELECT {columns} FROM tasks ORDER BY createdAt DESC")
+        return sqlite_response(cursor)
 
 @app.post("/api/tasks")
 async def create_task(task: TaskCreate, user_id: str = Depends(verify_token)):
     with get_db() as conn:
         task_id = f"task_{int(datetime.datetime.now().timestamp() * 1000)}"
         conn.execute(
-            "INSERT INTO tasks (id, title, description, assignedTo, priority, status, dueDate, projectId, createdAt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            "INSERT INTO tasks (id, title, description, assignedTo, priority, status, startDate, dueDate, projectId, createdAt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
             (task_id, task.title, task.description, task.assignedTo, 
-             task.priority, task.status, task.dueDate, task.projectId,
+             task.priority, task.status, task.startDate, task.dueDate, task.projectId,
              datetime.datetime.now().isoformat())
         )
         conn.commit()
+        activity.record(user_id, "created", "task", task_id, project_id=task.projectId, new_values=task.dict())
         return {"success": True, "id": task_id}
 
+# Línea de tiempo (vista de calendario / Gantt)
+@app.get("/api/timeline")
+async def get_timeline(
+    start: str = Query(..., alias="from"),
+    end: str = Query(..., alias="to"),
+    project_id: Optional[str] = None,
+    group_by: str = Query("project", pattern="^(project|assignee)$"),
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(verify_token),
+):
+    try:
+        with get_db() as conn:
+            return sqlite_timeline(conn, start, end, group_by, limit, project_id=project_id, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Sincronización incremental del caché local del frontend (ver sync.py)
+@app.get("/api/sync")
+async def sync_changes(
+    since: Optional[str] = None,
+    cursor: Optional[str] = Query(None, deprecated=True),  # nombre anterior de since
+    limit: int = Query(SYNC_DEFAULT_LIMIT, ge=1, le=SYNC_MAX_LIMIT),
+    user_id: str = Depends(verify_token),
+):
+    try:
+        with get_db() as conn:
+            return sqlite_sync(conn, since or cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Historial de actividad
+@app.get("/api/activity")
+async def get_activity(
+    entity_type: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    project_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    user_id: str = Depends(verify_token),
+):
+    if entity_type and entity_id:
+        where, params = "entityType = ? AND entityId = ?", [entity_type, entity_id]
+    elif project_id:
+        where, params = "projectId = ?", [project_id]
+    else:
+        raise HTTPException(status_code=400, detail="Indica entity_type y entity_id, o project_id")
+    created_at = None
+    if cursor:
+        try:
+            created_at, last_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        where += " AND (createdAt < ? OR (createdAt = ? AND id < ?))"
+        params += [created_at, created_at, last_id]
+    
+    # Solo se leen las tablas mensuales necesarias para llenar la página
+    with get_db() as conn:
+        rows = activity_tables.select_recent(conn, where, params, "createdAt DESC, id DESC", limit + 1,
+                                             before=created_at)
+    
+    items = rows[:limit]
+    for item in items:
+        item["oldValues"] = json.loads(item["oldValues"]) if item["oldValues"] else None
+        item["newValues"] = json.loads(item["newValues"]) if item["newValues"] else None
+    next_cursor = encode_cursor(items[-1]["createdAt"], items[-1]["id"]) if len(rows) > limit else None
+    return {"items": items, "nextCursor": next_cursor}
+
+# Endpoints de administración
+@app.get("/api/admin/slow-queries")
+async def get_slow_queries(limit: int = 20, user_id: str = Depends(verify_admin)):
+    return {
+        "threshold_ms": profiler.slow_query_seconds * 1000,
+        "queries": profiler.top(max(1, min(limit, 200)))
+    }
+
+@app.delete("/api/admin/slow-queries")
+async def reset_slow_queries(user_id: str = Depends(verify_admin)):
+    profiler.reset()
+    return {"success": True}
+
+# Endpoint de métricas (formato Prometheus)
+@app.get("/metrics")
+async def metrics(authorization: Optional[str] = Header(None)):
+    if not metrics_authorized(authorization):
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 # Configurar archivos estáticos
 static_dir = os.path.join(os.path.dirname(__file__), "..", "frontend")
 if os.path.exists(static_dir):
@@ -310,6 +623,13 @@ if os.path.exists(static_dir):
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    await activity.replay_spill()
+    scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await scheduler.stop()
+    await activity.close()
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,19 +1,49 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from fastapi.responses import JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, EmailStr, Field, ValidationError
+from typing import Literal, Optional, List
+from uuid import UUID
 import os
 from datetime import datetime, timedelta
 import jwt
 from passlib.context import CryptContext
-from supabase_config import supabase, db_utils
+from supabase_config import supabase, admin_supabase, supabase_config, db_utils
+from metrics import MetricsMiddleware, registry, metrics_authorized, PROMETHEUS_CONTENT_TYPE
+from admission import AdmissionControlMiddleware, RouteLimit, bucket_store_from_env, jwt_subject_resolver
+from pg_direct import pg
+from notifications import MARK_READ_MAX_IDS, NotificationService
+from activity import ActivityLog, changed_values
+from pagination import decode_cursor, encode_cursor
+from comments import fetch_comment_thread, format_comment_for_response
+from storage import UploadTooLarge, storage_from_env
+from scheduler import Scheduler, SupabaseLeaseStore
+from deadlines import DeadlineSweeper, SupabaseDeadlineStore, SWEEP_SECONDS
+from timeline import fetch_timeline
+from fields import PROJECT_FIELDS, TASK_FIELDS, Fields, column_list, fields_param
+from serializers import PROJECT_SERIALIZER, TASK_SERIALIZER
+from sync import DEFAULT_LIMIT as SYNC_DEFAULT_LIMIT, MAX_LIMIT as SYNC_MAX_LIMIT, PRUNE_SECONDS, SupabaseTombstones, fetch_sync
+from workload import WorkloadCache, parse_week_window
+from archive import ARCHIVE_SECONDS, Archiver, SupabaseArchiveStore
+from etags import if_match_version, version_etag
+from reference_data import ReferenceData
+from user_search import SupabaseUserSearch, UserDirectorySnapshot, load_user_directory
+from partitions import MAINTENANCE_SECONDS as PARTITION_SECONDS, SupabasePartitions
+from invalidation import bus
+from cache import SharedCache
+import logging
+import mimetypes
+import time
 import uuid
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
 
+logger = logging.getLogger("planner.api")
+
 # Configuración de seguridad
 SECRET_KEY = os.getenv("SECRET_KEY", "your-fallback-secret-key")
 ALGORITHM = "HS256"
@@ -36,6 +66,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Control de admisión: se aplica la primera regla que coincide con la ruta
+ADMISSION_RULES = [
+    RouteLimit("auth_login", "/auth/login", ("POST",), concurrency=4, queue_size=32,
+               queue_timeout=5.0, ip_rate=1.0, ip_burst=10),
+    RouteLimit("auth_register", "/auth/register", ("POST",), concurrency=2, queue_size=16,
+               queue_timeout=5.0, ip_rate=0.2, ip_burst=5),
+    RouteLimit("project_tasks", "/projects/{project_id}/tasks", ("GET",), concurrency=16, queue_size=64,
+               queue_timeout=10.0, user_rate=5.0, user_burst=20),
+    RouteLimit("health", "/health*"),
+    RouteLimit("default", "*", user_rate=20.0, user_burst=60, ip_rate=50.0, ip_burst=100),
+]
+if os.getenv("RATE_LIMITS_ENABLED", "true").lower() != "false":
+    app.add_middleware(
+        AdmissionControlMiddleware,
+        rules=ADMISSION_RULES,
+        identify_user=jwt_subject_resolver(SECRET_KEY, ALGORITHM),
+        store=bucket_store_from_env(),
+        trust_proxy_headers=os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true",
+    )
+app.add_middleware(MetricsMiddleware)
+
 # Configuración de autenticación
 security = HTTPBearer()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -86,6 +137,16 @@ class ProjectUpdate(BaseModel):
     budget: Optional[float] = None
     is_archived: Optional[bool] = None
 
+class MarkNotificationsRead(BaseModel):
+    ids: Optional[List[UUID]] = Field(None, max_length=MARK_READ_MAX_IDS)  # None = todas
+
+class CommentCreate(BaseModel):
+    content: str
+    parent_comment_id: Optional[str] = None
+
+class CommentUpdate(BaseModel):
+    content: str
+
 class TaskCreate(BaseModel):
     title: str
     description: Optional[str] = None
@@ -114,6 +175,16 @@ class TaskUpdate(BaseModel):
     tags: Optional[List[str]] = None
     dependencies: Optional[List[str]] = None
 
+class BatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    entity: Literal["task", "project"]
+    id: Optional[str] = None  # update y delete
+    data: Optional[dict] = None  # create y update: mismos campos que los endpoints individuales
+    version: Optional[int] = None  # update: versión leída (ETag); 412 si la fila ha cambiado
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
 # Funciones de utilidad
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -163,7 +234,8 @@ async def register(user: UserCreate):
             raise HTTPException(status_code=400, detail="El email ya está registrado")
         
         # Crear nuevo usuario
-        hashed_password = hash_password(user.password)
+        # bcrypt es costoso: se ejecuta fuera del event loop
+        hashed_password = await run_in_threadpool(hash_password, user.password)
         new_user_data = {
             "name": user.name,
             "username": user.username,
@@ -177,6 +249,7 @@ async def register(user: UserCreate):
             raise HTTPException(status_code=500, detail="Error al crear usuario")
         
         user_data = result.data[0]
+        user_directory.invalidate()
         return {
             "message": "Usuario creado exitosamente",
             "user": db_utils.format_user_for_response(user_data)
@@ -195,7 +268,7 @@ async def login(user: UserLogin):
         user_data = result.data[0]
         
         # Verificar contraseña
-        if not verify_password(user.password, user_data["password_hash"]):
+        if not await run_in_threadpool(verify_password, user.password, user_data["password_hash"]):
             raise HTTPException(status_code=401, detail="Credenciales inválidas")
         
         # Crear token de acceso
@@ -217,92 +290,408 @@ async def login(user: UserLogin):
 @app.get("/auth/me")
 async def get_current_user(current_user_id: str = Depends(verify_token)):
     try:
-        result = supabase.table("users").select("*").eq("id", current_user_id).execute()
-        if not result.data:
+        user = load_user(current_user_id)
+        if not user:
             raise HTTPException(status_code=404, detail="Usuario no encontrado")
         
-        return db_utils.format_user_for_response(result.data[0])
+        return db_utils.format_user_for_response(user)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
+# Clientes de Supabase: se crean al arrancar cada worker y no al importar (ver supabase_config.py)
+@app.on_event("startup")
+async def warm_up_supabase():
+    supabase_config.validate()
+    try:
+        await run_in_threadpool(supabase_config.warm_up)
+    except Exception:
+        # La primera petición volverá a intentarlo; /health/ready informa mientras tanto
+        logger.warning("No se pudo precalentar la conexión con Supabase", exc_info=True)
+
+# Conexión directa a Postgres (opcional, ver pg_direct.py)
+@app.on_event("startup")
+async def start_direct_postgres():
+    await pg.start()
+
+@app.on_event("shutdown")
+async def close_direct_postgres():
+    await pg.close()
+
+# Escrituras en segundo plano con la service role key si está configurada
+admin_client = admin_supabase
+
+# Notificaciones: se insertan por lotes en segundo plano (ver notifications.py)
+notifications = NotificationService(admin_client)
+
+@app.on_event("shutdown")
+async def flush_notifications():
+    await notifications.close()
+
+# Auditoría de mutaciones con escritura diferida (ver activity.py)
+def write_activity(entries: List[dict]):
+    # La clave primaria de la tabla particionada incluye created_at (fijado al registrar la entrada)
+    admin_client.table("activity_log").upsert(entries, on_conflict="id,created_at", ignore_duplicates=True).execute()
+
+activity = ActivityLog(write_activity, "activity_spill.jsonl")
+
+@app.on_event("startup")
+async def replay_activity_spill():
+    await activity.replay_spill()
+
+@app.on_event("shutdown")
+async def flush_activity():
+    await activity.close()
+
+# Barrido periódico de vencimientos con un único líder entre workers (ver deadlines.py)
+DEADLINE_MESSAGES = {
+    "due_soon": ("task_due_soon", "Tarea próxima a vencer", "La tarea «{title}» vence pronto"),
+    "overdue": ("task_overdue", "Tarea vencida", "La tarea «{title}» ha vencido"),
+}
+
+def emit_deadline_events(state: str, tasks: List[dict]):
+    notification_type, title, message = DEADLINE_MESSAGES[state]
+    for task in tasks:
+        activity.record(None, state, "task", task["id"], project_id=task["project_id"],
+                        new_values={"deadline_status": state, "due_date": task["due_date"]})
+        notifications.notify([task["assigned_to"], task["created_by"]], notification_type, title,
+                             message.format(title=task["title"]), "task", task["id"])
+
+scheduler = Scheduler(SupabaseLeaseStore(admin_client, pg))
+deadline_sweeper = DeadlineSweeper(SupabaseDeadlineStore(admin_client, pg), emit_deadline_events)
+scheduler.add_job("deadline_sweep", SWEEP_SECONDS, deadline_sweeper.sweep)
+scheduler.add_job("sync_tombstone_prune", PRUNE_SECONDS, SupabaseTombstones(admin_client).prune)
+
+@app.on_event("startup")
+async def start_scheduler():
+    scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    await scheduler.stop()
+
+# Después de vaciar los lotes pendientes, que todavía escriben en Supabase
+@app.on_event("shutdown")
+async def close_supabase():
+    supabase_config.close()
+
+# Almacenamiento de adjuntos (ver storage.py)
+storage = storage_from_env(admin_client)
+
+# Cachés por worker invalidadas en todos los workers con cada escritura (ver cache.py)
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "60"))
+project_cache = SharedCache("projects", bus, CACHE_TTL_SECONDS)
+user_cache = SharedCache("users", bus, CACHE_TTL_SECONDS)
+
+# Categorías y directorio de usuarios en memoria con ETag (ver reference_data.py)
+categories_data = ReferenceData(
+    "categories", lambda: supabase.table("categories").select("*").order("name").order("id").execute().data, bus,
+)
+user_directory = ReferenceData(
+    "user_directory", lambda: load_user_directory(supabase), bus, snapshot=UserDirectorySnapshot,
+)
+# Búsqueda en la base de datos si el directorio no se puede cargar (ver user_search.py)
+user_search = SupabaseUserSearch(supabase, pg)
+
+@app.on_event("startup")
+async def load_reference_data():
+    for data in (categories_data, user_directory):
+        try:
+            await data.refresh()
+        except Exception:
+            # La primera petición volverá a intentarlo
+            logger.warning("No se pudieron cargar los datos de referencia %s", data.name, exc_info=True)
+
+# Carga de trabajo por persona, cacheada por ventana (ver workload.py)
+workload_cache = WorkloadCache(bus)
+
+# Archivo de proyectos archivados y tareas completadas antiguas por lotes (ver archive.py)
+archive_store = SupabaseArchiveStore(admin_client, pg)
+
+def entries_archived(batch: dict):
+    for project_id in batch["projects"]:
+        project_cache.invalidate(project_id)
+    workload_cache.invalidate()
+
+scheduler.add_job("archive", ARCHIVE_SECONDS, Archiver(archive_store, entries_archived).run)
+
+# Particiones mensuales de notifications y activity_log: creación anticipada y retención (ver partitions.py)
+scheduler.add_job("partition_maintenance", PARTITION_SECONDS, SupabasePartitions(admin_client, pg).maintain)
+
+async def load_project(project_id: str) -> Optional[dict]:
+    """Obtiene un proyecto por id (conexión directa si está disponible, si no PostgREST)"""
+    async def fetch():
+        if pg.enabled:
+            return await pg.get_project(project_id)
+        result = supabase.table("projects").select("*").eq("id", project_id).execute()
+        return result.data[0] if result.data else None
+    return await project_cache.aget_or_load(project_id, fetch)
+
+def load_user(user_id: str) -> Optional[dict]:
+    """Obtiene un usuario por id (cacheado)"""
+    def fetch():
+        result = supabase.table("users").select("*").eq("id", user_id).execute()
+        return result.data[0] if result.data else None
+    return user_cache.get_or_load(user_id, fetch)
+
+def has_project_access(project: dict, user_id: str) -> bool:
+    return project["created_by"] == user_id or user_id in (project.get("assigned_to") or [])
+
+async def authorize_entity_access(current_user_id: str, task_id: Optional[str] = None,
+                                   project_id: Optional[str] = None) -> tuple:
+    """Comprueba que el usuario puede acceder a la tarea o el proyecto; devuelve (proyecto, tarea)"""
+    task = None
+    if task_id:
+        if pg.enabled:
+            task = await pg.get_task_with_project(task_id)
+            project = {"id": task["project_id"], "created_by": task["project_created_by"],
+                       "assigned_to": task["project_assigned_to"] or []} if task else None
+        else:
+            task_result = supabase.table("tasks").select("project_id, assigned_to").eq("id", task_id).execute()
+            task = task_result.data[0] if task_result.data else None
+            project = await load_project(task["project_id"]) if task else None
+        if not task:
+            raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    else:
+        project = await load_project(project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+    if not has_project_access(project, current_user_id) and not (task and task["assigned_to"] == current_user_id):
+        raise HTTPException(status_code=403, detail="No tienes permisos para acceder a este elemento")
+    return project, task
+
+# Datos y efectos de las escrituras de proyectos y tareas (endpoints individuales y /batch)
+def project_create_data(project: ProjectCreate, current_user_id: str) -> dict:
+    return {
+        "name": project.name,
+        "description": project.description,
+        "start_date": project.start_date,
+        "end_date": project.end_date,
+        "priority": project.priority,
+        "category_id": project.category_id,
+        "created_by": current_user_id,
+        "assigned_to": project.assigned_to or [],
+        "tags": project.tags or [],
+        "budget": project.budget
+    }
+
+def task_create_data(task: TaskCreate, current_user_id: str) -> dict:
+    return {
+        "title": task.title,
+        "description": task.description,
+        "project_id": task.project_id,
+        "parent_task_id": task.parent_task_id,
+        "assigned_to": task.assigned_to,
+        "priority": task.priority,
+        "due_date": task.due_date,
+        "start_date": task.start_date,
+        "estimated_hours": task.estimated_hours,
+        "tags": task.tags or [],
+        "dependencies": task.dependencies or [],
+        "created_by": current_user_id
+    }
+
+def task_update_data(task_update: TaskUpdate) -> dict:
+    update_data = {k: v for k, v in task_update.dict().items() if v is not None}
+    if not update_data:
+        return update_data
+
+    # Si se marca como completada, agregar fecha de completado
+    if update_data.get("status") == "completed" and not update_data.get("completed_date"):
+        update_data["completed_date"] = datetime.utcnow().isoformat()
+
+    # Con un vencimiento nuevo la tarea vuelve a pasar por el barrido de vencimientos
+    if "due_date" in update_data:
+        update_data["deadline_status"] = None
+    return update_data
+
+def can_edit_task(project: dict, task: dict, user_id: str) -> bool:
+    return has_project_access(project, user_id) or task["assigned_to"] == user_id
+
+# Escrituras condicionales con If-Match (ver etags.py): los motivos de rechazo
+# solo se averiguan cuando el UPDATE no ha modificado nada
+PROJECT_CHANGED = "El proyecto ha cambiado desde que se leyó; vuelve a cargarlo"
+TASK_CHANGED = "La tarea ha cambiado desde que se leyó; vuelve a cargarla"
+
+def project_write_error(project: Optional[dict], user_id: str, version: Optional[int]) -> Optional[HTTPException]:
+    """Error de la escritura del proyecto con la versión leída (None si se puede escribir)"""
+    if not project:
+        return HTTPException(status_code=404, detail="Proyecto no encontrado")
+    if project["created_by"] != user_id:
+        return HTTPException(status_code=403, detail="No tienes permisos para modificar este proyecto")
+    if version is not None and project.get("version", 1) != version:
+        return HTTPException(status_code=412, detail=PROJECT_CHANGED)
+    return None
+
+def task_write_error(task: Optional[dict], project: Optional[dict], user_id: str,
+                     version: Optional[int]) -> Optional[HTTPException]:
+    """Error de la escritura de la tarea con la versión leída (None si se puede escribir)"""
+    if not task:
+        return HTTPException(status_code=404, detail="Tarea no encontrada")
+    if not project:
+        return HTTPException(status_code=404, detail="Proyecto no encontrado")
+    if not can_edit_task(project, task, user_id):
+        return HTTPException(status_code=403, detail="No tienes permisos para modificar esta tarea")
+    if version is not None and task.get("version", 1) != version:
+        return HTTPException(status_code=412, detail=TASK_CHANGED)
+    return None
+
+async def load_task_for_write(task_id: str) -> tuple:
+    """Tarea y datos de permisos de su proyecto (None si no existen)"""
+    if pg.enabled:
+        # Tarea y permisos del proyecto en una sola consulta
+        task = await pg.get_task_with_project(task_id)
+        if not task:
+            return None, None
+        return task, {"created_by": task.pop("project_created_by"), "assigned_to": task.pop("project_assigned_to") or []}
+    existing_task = supabase.table("tasks").select("*").eq("id", task_id).execute()
+    if not existing_task.data:
+        return None, None
+    task = existing_task.data[0]
+    # Permisos del proyecto desde la caché (invalidada en cada cambio del proyecto)
+    return task, await load_project(task["project_id"])
+
+def project_created(current_user_id: str, created: dict, project_data: dict):
+    activity.record(current_user_id, "created", "project", created["id"], project_id=created["id"], new_values=project_data)
+
+def project_updated(current_user_id: str, project: dict, update_data: dict, updated: dict):
+    project_cache.invalidate(project["id"])
+    old_values, new_values = changed_values(project, update_data)
+    activity.record(current_user_id, "updated", "project", project["id"], project_id=project["id"],
+                    old_values=old_values, new_values=new_values)
+    notifications.notify(
+        [updated["created_by"], *(project.get("assigned_to") or []), *(updated.get("assigned_to") or [])],
+        "project_updated", "Proyecto actualizado", f"El proyecto «{updated['name']}» ha sido actualizado",
+        "project", project["id"], actor_id=current_user_id,
+    )
+
+def project_deleted(current_user_id: str, project: dict):
+    project_cache.invalidate(project["id"])
+    workload_cache.invalidate()
+    activity.record(current_user_id, "deleted", "project", project["id"], project_id=project["id"], old_values=project)
+
+def task_created(current_user_id: str, created: dict, task_data: dict):
+    # El progreso del proyecto se recalcula por trigger
+    project_cache.invalidate(created["project_id"])
+    workload_cache.invalidate()
+    activity.record(current_user_id, "created", "task", created["id"], project_id=created["project_id"], new_values=task_data)
+    notifications.notify(
+        [created.get("assigned_to")], "task_assigned", "Nueva tarea asignada",
+        f"Se te ha asignado la tarea «{created['title']}»", "task", created["id"], actor_id=current_user_id,
+    )
+
+def task_updated(current_user_id: str, task: dict, update_data: dict, updated: dict):
+    project_cache.invalidate(task["project_id"])
+    workload_cache.invalidate()
+    old_values, new_values = changed_values(task, update_data)
+    activity.record(current_user_id, "updated", "task", task["id"], project_id=task["project_id"],
+                    old_values=old_values, new_values=new_values)
+    if update_data.get("assigned_to") and update_data["assigned_to"] != task["assigned_to"]:
+        notifications.notify(
+            [update_data["assigned_to"]], "task_assigned", "Nueva tarea asignada",
+            f"Se te ha asignado la tarea «{updated['title']}»", "task", task["id"], actor_id=current_user_id,
+        )
+
+def task_deleted(current_user_id: str, task: dict):
+    project_cache.invalidate(task["project_id"])
+    workload_cache.invalidate()
+    activity.record(current_user_id, "deleted", "task", task["id"], project_id=task["project_id"], old_values=task)
+
 # Endpoints de proyectos
 @app.get("/projects")
-async def get_projects(current_user_id: str = Depends(verify_token)):
+async def get_projects(fields: Fields = Depends(fields_param(PROJECT_FIELDS)),
+                       current_user_id: str = Depends(verify_token)):
     try:
-        result = supabase.table("projects").select("*").or_(f"created_by.eq.{current_user_id},assigned_to.cs.{{{current_user_id}}}").execute()
-        projects = [db_utils.format_project_for_response(project) for project in result.data]
-        return projects
+        columns = column_list(fields)
+        if pg.enabled:
+            rows = await pg.list_projects(current_user_id, columns)
+        else:
+            # Una sola ida y vuelta: join con las membresías del usuario (embebidas con !inner)
+            rows = supabase.table("projects").select(f"{columns}, project_members!inner(user_id)") \
+                .eq("project_members.user_id", current_user_id).execute().data
+            for row in rows:
+                del row["project_members"]
+        # Con ?fields= la consulta ya devuelve las columnas exactas de la respuesta
+        return PROJECT_SERIALIZER.response(rows, fields, projected=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 @app.post("/projects")
-async def create_project(project: ProjectCreate, current_user_id: str = Depends(verify_token)):
-    try:
-        project_data = {
-            "name": project.name,
-            "description": project.description,
-            "start_date": project.start_date,
-            "end_date": project.end_date,
-            "priority": project.priority,
-            "category_id": project.category_id,
-            "created_by": current_user_id,
-            "assigned_to": project.assigned_to or [],
-            "tags": project.tags or [],
-            "budget": project.budget
-        }
+async def create_project(project: ProjectCreate, response: Response, current_user_id: str = Depends(verify_token)):
+    try:
+        project_data = project_create_data(project, current_user_id)
         
         result = supabase.table("projects").insert(project_data).execute()
         if not result.data:
             raise HTTPException(status_code=500, detail="Error al crear proyecto")
         
-        return db_utils.format_project_for_response(result.data[0])
+        created = result.data[0]
+        project_created(current_user_id, created, project_data)
+        response.headers["ETag"] = version_etag(created.get("version", 1))
+        return db_utils.format_project_for_response(created)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 @app.get("/projects/{project_id}")
-async def get_project(project_id: str, current_user_id: str = Depends(verify_token)):
+async def get_project(project_id: str, response: Response, fields: Fields = Depends(fields_param(PROJECT_FIELDS)),
+                      current_user_id: str = Depends(verify_token)):
     try:
-        result = supabase.table("projects").select("*").eq("id", project_id).execute()
-        if not result.data:
+        project = await load_project(project_id)
+        if not project:
             raise HTTPException(status_code=404, detail="Proyecto no encontrado")
         
-        project = result.data[0]
-        
         # Verificar permisos
         if project["created_by"] != current_user_id and current_user_id not in project.get("assigned_to", []):
             raise HTTPException(status_code=403, detail="No tienes permisos para ver este proyecto")
         
-        return db_utils.format_project_for_response(project)
+        # El proyecto completo ya está en caché: solo se recorta la respuesta
+        response.headers["ETag"] = version_etag(project.get("version", 1))
+        return PROJECT_SERIALIZER.format(project, fields)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 @app.put("/projects/{project_id}")
-async def update_project(project_id: str, project_update: ProjectUpdate, current_user_id: str = Depends(verify_token)):
+async def update_project(project_id: str, project_update: ProjectUpdate, response: Response,
+                         version: Optional[int] = Depends(if_match_version),
+                         current_user_id: str = Depends(verify_token)):
     try:
-        # Verificar que el proyecto existe y el usuario tiene permisos
-        existing_project = supabase.table("projects").select("*").eq("id", project_id).execute()
-        if not existing_project.data:
-            raise HTTPException(status_code=404, detail="Proyecto no encontrado")
-        
-        project = existing_project.data[0]
-        if project["created_by"] != current_user_id:
-            raise HTTPException(status_code=403, detail="No tienes permisos para modificar este proyecto")
-        
         # Preparar datos de actualización
         update_data = {k: v for k, v in project_update.dict().items() if v is not None}
         
-        if not update_data:
-            return db_utils.format_project_for_response(project)
+        if update_data and pg.enabled:
+            # Una sola sentencia con el creador y la versión en el WHERE
+            result = await pg.update_project(project_id, update_data, current_user_id, version)
+            if not result:
+                raise (project_write_error(await pg.get_project(project_id), current_user_id, version)
+                       or HTTPException(status_code=412, detail=PROJECT_CHANGED))
+            updated, project = result
+        else:
+            # PostgREST no devuelve los valores anteriores: se leen para el registro de actividad
+            existing_project = supabase.table("projects").select("*").eq("id", project_id).execute()
+            project = existing_project.data[0] if existing_project.data else None
+            error = project_write_error(project, current_user_id, version)
+            if error:
+                raise error
+            
+            if not update_data:
+                response.headers["ETag"] = version_etag(project.get("version", 1))
+                return db_utils.format_project_for_response(project)
+            
+            # La versión en el filtro evita pisar una escritura hecha entre la lectura y el UPDATE
+            query = supabase.table("projects").update(update_data).eq("id", project_id).eq("created_by", current_user_id)
+            if version is not None:
+                query = query.eq("version", version)
+            result = query.execute()
+            if not result.data:
+                raise HTTPException(status_code=412, detail=PROJECT_CHANGED)
+            updated = result.data[0]
         
-        result = supabase.table("projects").update(update_data).eq("id", project_id).execute()
-        if not result.data:
-            raise HTTPException(status_code=500, detail="Error al actualizar proyecto")
-        
-        return db_utils.format_project_for_response(result.data[0])
+        project_updated(current_user_id, project, update_data, updated)
+        response.headers["ETag"] = version_etag(updated["version"])
+        return db_utils.format_project_for_response(updated)
     except HTTPException:
         raise
     except Exception as e:
@@ -322,6 +711,7 @@ async def delete_project(project_id: str, current_user_id: str = Depends(verify_
         
         # Eliminar proyecto (las tareas se eliminan en cascada)
         result = supabase.table("projects").delete().eq("id", project_id).execute()
+        project_deleted(current_user_id, project)
         
         return {"message": "Proyecto eliminado exitosamente"}
     except HTTPException:
@@ -331,99 +721,88 @@ async def delete_project(project_id: str, current_user_id: str = Depends(verify_
 
 # Endpoints de tareas
 @app.get("/projects/{project_id}/tasks")
-async def get_project_tasks(project_id: str, current_user_id: str = Depends(verify_token)):
+async def get_project_tasks(project_id: str, fields: Fields = Depends(fields_param(TASK_FIELDS)),
+                            current_user_id: str = Depends(verify_token)):
     try:
         # Verificar permisos del proyecto
-        project_result = supabase.table("projects").select("*").eq("id", project_id).execute()
-        if not project_result.data:
+        project = await load_project(project_id)
+        if not project:
             raise HTTPException(status_code=404, detail="Proyecto no encontrado")
         
-        project = project_result.data[0]
         if project["created_by"] != current_user_id and current_user_id not in project.get("assigned_to", []):
             raise HTTPException(status_code=403, detail="No tienes permisos para ver las tareas de este proyecto")
         
         # Obtener tareas del proyecto
-        result = supabase.table("tasks").select("*").eq("project_id", project_id).execute()
-        tasks = [db_utils.format_task_for_response(task) for task in result.data]
-        return tasks
+        columns = column_list(fields)
+        if pg.enabled:
+            rows = await pg.list_project_tasks(project_id, columns)
+        else:
+            rows = supabase.table("tasks").select(columns).eq("project_id", project_id).execute().data
+        return TASK_SERIALIZER.response(rows, fields, projected=True)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 @app.post("/tasks")
-async def create_task(task: TaskCreate, current_user_id: str = Depends(verify_token)):
+async def create_task(task: TaskCreate, response: Response, current_user_id: str = Depends(verify_token)):
     try:
         # Verificar permisos del proyecto
-        project_result = supabase.table("projects").select("*").eq("id", task.project_id).execute()
-        if not project_result.data:
+        project = await load_project(task.project_id)
+        if not project:
             raise HTTPException(status_code=404, detail="Proyecto no encontrado")
         
-        project = project_result.data[0]
         if project["created_by"] != current_user_id and current_user_id not in project.get("assigned_to", []):
             raise HTTPException(status_code=403, detail="No tienes permisos para crear tareas en este proyecto")
         
-        task_data = {
-            "title": task.title,
-            "description": task.description,
-            "project_id": task.project_id,
-            "parent_task_id": task.parent_task_id,
-            "assigned_to": task.assigned_to,
-            "priority": task.priority,
-            "due_date": task.due_date,
-            "start_date": task.start_date,
-            "estimated_hours": task.estimated_hours,
-            "tags": task.tags or [],
-            "dependencies": task.dependencies or [],
-            "created_by": current_user_id
-        }
+        task_data = task_create_data(task, current_user_id)
         
         result = supabase.table("tasks").insert(task_data).execute()
         if not result.data:
             raise HTTPException(status_code=500, detail="Error al crear tarea")
         
-        return db_utils.format_task_for_response(result.data[0])
+        created = result.data[0]
+        task_created(current_user_id, created, task_data)
+        response.headers["ETag"] = version_etag(created.get("version", 1))
+        return db_utils.format_task_for_response(created)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
 @app.put("/tasks/{task_id}")
-async def update_task(task_id: str, task_update: TaskUpdate, current_user_id: str = Depends(verify_token)):
+async def update_task(task_id: str, task_update: TaskUpdate, response: Response,
+                      version: Optional[int] = Depends(if_match_version),
+                      current_user_id: str = Depends(verify_token)):
     try:
-        # Verificar que la tarea existe
-        existing_task = supabase.table("tasks").select("*").eq("id", task_id).execute()
-        if not existing_task.data:
-            raise HTTPException(status_code=404, detail="Tarea no encontrada")
-        
-        task = existing_task.data[0]
-        
-        # Verificar permisos del proyecto
-        project_result = supabase.table("projects").select("*").eq("id", task["project_id"]).execute()
-        if not project_result.data:
-            raise HTTPException(status_code=404, detail="Proyecto no encontrado")
-        
-        project = project_result.data[0]
-        if (project["created_by"] != current_user_id and 
-            current_user_id not in project.get("assigned_to", []) and 
-            task["assigned_to"] != current_user_id):
-            raise HTTPException(status_code=403, detail="No tienes permisos para modificar esta tarea")
-        
         # Preparar datos de actualización
-        update_data = {k: v for k, v in task_update.dict().items() if v is not None}
+        update_data = task_update_data(task_update)
         
         if not update_data:
+            task, project = await load_task_for_write(task_id)
+            error = task_write_error(task, project, current_user_id, version)
+            if error:
+                raise error
+            response.headers["ETag"] = version_etag(task.get("version", 1))
             return db_utils.format_task_for_response(task)
         
-        # Si se marca como completada, agregar fecha de completado
-        if update_data.get("status") == "completed" and not update_data.get("completed_date"):
-            update_data["completed_date"] = datetime.utcnow().isoformat()
-        
-        result = supabase.table("tasks").update(update_data).eq("id", task_id).execute()
-        if not result.data:
-            raise HTTPException(status_code=500, detail="Error al actualizar tarea")
+        # Una sola sentencia con los permisos del proyecto y la versión en el WHERE
+        if pg.enabled:
+            result = await pg.update_task(task_id, update_data, current_user_id, version)
+        else:
+            changed = supabase.rpc("update_task_checked", {
+                "p_task_id": task_id, "p_user_id": current_user_id, "p_version": version, "p_changes": update_data,
+            }).execute().data
+            result = (changed["row"], changed["previous"]) if changed else None
+        if not result:
+            # Sin cambios: se averigua el motivo (no existe, sin permisos o versión distinta)
+            raise (task_write_error(*await load_task_for_write(task_id), current_user_id, version)
+                   or HTTPException(status_code=412, detail=TASK_CHANGED))
+        updated, task = result
         
-        return db_utils.format_task_for_response(result.data[0])
+        task_updated(current_user_id, task, update_data, updated)
+        response.headers["ETag"] = version_etag(updated["version"])
+        return db_utils.format_task_for_response(updated)
     except HTTPException:
         raise
     except Exception as e:
@@ -432,24 +811,18 @@ async def update_task(task_id: str, task_update: TaskUpdate, current_user_id: st
 @app.delete("/tasks/{task_id}")
 async def delete_task(task_id: str, current_user_id: str = Depends(verify_token)):
     try:
-        # Verificar que la tarea existe
-        existing_task = supabase.table("tasks").select("*").eq("id", task_id).execute()
-        if not existing_task.data:
+        # Verificar que la tarea existe y los permisos del proyecto
+        task, project = await load_task_for_write(task_id)
+        if not task:
             raise HTTPException(status_code=404, detail="Tarea no encontrada")
-        
-        task = existing_task.data[0]
-        
-        # Verificar permisos del proyecto
-        project_result = supabase.table("projects").select("*").eq("id", task["project_id"]).execute()
-        if not project_result.data:
+        if not project:
             raise HTTPException(status_code=404, detail="Proyecto no encontrado")
-        
-        project = project_result.data[0]
         if project["created_by"] != current_user_id:
             raise HTTPException(status_code=403, detail="No tienes permisos para eliminar esta tarea")
         
         # Eliminar tarea
         result = supabase.table("tasks").delete().eq("id", task_id).execute()
+        task_deleted(current_user_id, task)
         
         return {"message": "Tarea eliminada exitosamente"}
     except HTTPException:
@@ -457,12 +830,659 @@ async def delete_task(task_id: str, current_user_id: str = Depends(verify_token)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
-# Endpoint de categorías
+# Endpoints de comentarios
+async def list_comments(current_user_id: str, limit: int, cursor: Optional[str],
+                        task_id: Optional[str] = None, project_id: Optional[str] = None):
+    try:
+        await authorize_entity_access(current_user_id, task_id, project_id)
+        items, next_cursor = await fetch_comment_thread(supabase, pg, task_id, project_id, limit, cursor)
+        return {"items": items, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+async def create_comment(comment: CommentCreate, current_user_id: str,
+                         task_id: Optional[str] = None, project_id: Optional[str] = None):
+    try:
+        project, task = await authorize_entity_access(current_user_id, task_id, project_id)
+        content = comment.content.strip()
+        if not content:
+            raise HTTPException(status_code=400, detail="El comentario no puede estar vacío")
+        
+        parent = None
+        if comment.parent_comment_id:
+            parent_result = supabase.table("comments").select("id, task_id, project_id, created_by").eq("id", comment.parent_comment_id).execute()
+            parent = parent_result.data[0] if parent_result.data else None
+            if not parent or parent["task_id"] != task_id or parent["project_id"] != project_id:
+                raise HTTPException(status_code=400, detail="El comentario al que respondes no pertenece a este hilo")
+        
+        comment_data = {
+            "content": content,
+            "task_id": task_id,
+            "project_id": project_id,
+            "parent_comment_id": comment.parent_comment_id,
+            "created_by": current_user_id
+        }
+        result = supabase.table("comments").insert(comment_data).execute()
+        if not result.data:
+            raise HTTPException(status_code=500, detail="Error al crear comentario")
+        
+        created = result.data[0]
+        if project_id:
+            # comment_count del proyecto (trigger)
+            project_cache.invalidate(project_id)
+        activity.record(current_user_id, "created", "comment", created["id"], project_id=project["id"], new_values=comment_data)
+        recipients = [parent["created_by"] if parent else None, task["assigned_to"] if task else None]
+        notifications.notify(
+            recipients, "comment_added", "Nuevo comentario", content[:200],
+            "comment", created["id"], actor_id=current_user_id,
+        )
+        return format_comment_for_response(created)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+@app.get("/tasks/{task_id}/comments")
+async def get_task_comments(task_id: str, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                            current_user_id: str = Depends(verify_token)):
+    return await list_comments(current_user_id, limit, cursor, task_id=task_id)
+
+@app.get("/projects/{project_id}/comments")
+async def get_project_comments(project_id: str, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None,
+                               current_user_id: str = Depends(verify_token)):
+    return await list_comments(current_user_id, limit, cursor, project_id=project_id)
+
+@app.post("/tasks/{task_id}/comments")
+async def create_task_comment(task_id: str, comment: CommentCreate, current_user_id: str = Depends(verify_token)):
+    return await create_comment(comment, current_user_id, task_id=task_id)
+
+@app.post("/projects/{project_id}/comments")
+async def create_project_comment(project_id: str, comment: CommentCreate, current_user_id: str = Depends(verify_token)):
+    return await create_comment(comment, current_user_id, project_id=project_id)
+
+@app.put("/comments/{comment_id}")
+async def update_comment(comment_id: str, comment_update: CommentUpdate, current_user_id: str = Depends(verify_token)):
+    try:
+        existing = supabase.table("comments").select("*").eq("id", comment_id).execute()
+        if not existing.data:
+            raise HTTPException(status_code=404, detail="Comentario no encontrado")
+        
+        comment = existing.data[0]
+        if comment["created_by"] != current_user_id:
+            raise HTTPException(status_code=403, detail="Solo el autor puede editar este comentario")
+        project, _ = await authorize_entity_access(current_user_id, comment["task_id"], comment["project_id"])
+        content = comment_update.content.strip()
+        if not content:
+            raise HTTPException(status_code=400, detail="El comentario no puede estar vacío")
+        
+        result = supabase.table("comments").update({"content": content, "is_edited": True}).eq("id", comment_id).execute()
+        if not result.data:
+            raise HTTPException(status_code=500, detail="Error al actualizar comentario")
+        
+        activity.record(current_user_id, "updated", "comment", comment_id, project_id=project["id"],
+                        old_values={"content": comment["content"]}, new_values={"content": content})
+        return format_comment_for_response(result.data[0])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+@app.delete("/comments/{comment_id}")
+async def delete_comment(comment_id: str, current_user_id: str = Depends(verify_token)):
+    try:
+        existing = supabase.table("comments").select("*").eq("id", comment_id).execute()
+        if not existing.data:
+            raise HTTPException(status_code=404, detail="Comentario no encontrado")
+        
+        comment = existing.data[0]
+        project, _ = await authorize_entity_access(current_user_id, comment["task_id"], comment["project_id"])
+        if comment["created_by"] != current_user_id and project["created_by"] != current_user_id:
+            raise HTTPException(status_code=403, detail="No tienes permisos para eliminar este comentario")
+        
+        # Las respuestas se eliminan en cascada (y los contadores se ajustan por trigger)
+        supabase.table("comments").delete().eq("id", comment_id).execute()
+        if comment["project_id"]:
+            project_cache.invalidate(comment["project_id"])
+        activity.record(current_user_id, "deleted", "comment", comment_id, project_id=project["id"], old_values=comment)
+        return {"message": "Comentario eliminado exitosamente"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+# Endpoints de adjuntos
+async def upload_attachment(request: Request, filename: str, current_user_id: str,
+                            task_id: Optional[str] = None, project_id: Optional[str] = None):
+    """Guarda el cuerpo de la petición (en streaming) como adjunto de la tarea o el proyecto"""
+    try:
+        project, _ = await authorize_entity_access(current_user_id, task_id, project_id)
+        original_filename = os.path.basename(filename.replace("\\", "/")).strip()[:255]
+        if not original_filename:
+            raise HTTPException(status_code=400, detail="Nombre de archivo inválido")
+        declared_size = request.headers.get("content-length")
+        if declared_size and declared_size.isdigit() and int(declared_size) > storage.max_bytes:
+            raise HTTPException(status_code=413, detail="El archivo supera el tamaño máximo permitido")
+        
+        content_type = request.headers.get("content-type", "").split(";")[0].strip()
+        if not content_type or content_type == "application/octet-stream":
+            content_type = mimetypes.guess_type(original_filename)[0] or "application/octet-stream"
+        created = None
+        try:
+            # El objeto se publica después de registrar la fila (ver delete_unreferenced en storage.py)
+            async with storage.upload(request.stream(), content_type) as stored:
+                attachment_data = {
+                    "filename": stored.key,
+                    "original_filename": original_filename,
+                    "file_size": stored.size,
+                    "mime_type": content_type[:100],
+                    "file_url": storage.url_for(stored.key),
+                    "content_hash": stored.sha256,
+                    "task_id": task_id,
+                    "project_id": project_id,
+                    "uploaded_by": current_user_id
+                }
+                result = supabase.table("attachments").insert(attachment_data).execute()
+                if not result.data:
+                    raise HTTPException(status_code=500, detail="Error al guardar el adjunto")
+                created = result.data[0]
+        except Exception:
+            # Sin objeto publicado la fila no puede quedarse
+            if created:
+                supabase.table("attachments").delete().eq("id", created["id"]).execute()
+            raise
+        
+        activity.record(current_user_id, "created", "attachment", created["id"], project_id=project["id"],
+                        new_values={"original_filename": original_filename, "file_size": stored.size})
+        return db_utils.format_attachment_for_response(created)
+    except HTTPException:
+        raise
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="El archivo supera el tamaño máximo permitido")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+async def object_referenced(content_hash: str) -> bool:
+    """Si algún adjunto, activo o archivado, usa el objeto con ese contenido"""
+    remaining = supabase.table("attachments").select("id").eq("content_hash", content_hash).limit(1).execute()
+    return bool(remaining.data) or await archive_store.references_object(content_hash)
+
+async def list_attachments(current_user_id: str, task_id: Optional[str] = None, project_id: Optional[str] = None):
+    try:
+        await authorize_entity_access(current_user_id, task_id, project_id)
+        query = supabase.table("attachments").select("*")
+        query = query.eq("task_id", task_id) if task_id else query.eq("project_id", project_id)
+        result = query.order("created_at", desc=True).execute()
+        return [db_utils.format_attachment_for_response(a) for a in result.data]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+async def load_attachment(attachment_id: str, current_user_id: str) -> tuple:
+    """Obtiene el adjunto y comprueba el acceso a su entidad; devuelve (adjunto, proyecto)"""
+    result = supabase.table("attachments").select("*").eq("id", attachment_id).execute()
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Adjunto no encontrado")
+    attachment = result.data[0]
+    if attachment.get("comment_id"):
+        comment = supabase.table("comments").select("task_id, project_id").eq("id", attachment["comment_id"]).execute()
+        if not comment.data:
+            raise HTTPException(status_code=404, detail="Adjunto no encontrado")
+        target = comment.data[0]
+    else:
+        target = attachment
+    project, _ = await authorize_entity_access(current_user_id, target["task_id"], target["project_id"])
+    return attachment, project
+
+@app.post("/tasks/{task_id}/attachments")
+async def upload_task_attachment(task_id: str, request: Request, filename: str = Query(..., min_length=1),
+                                 current_user_id: str = Depends(verify_token)):
+    return await upload_attachment(request, filename, current_user_id, task_id=task_id)
+
+@app.post("/projects/{project_id}/attachments")
+async def upload_project_attachment(project_id: str, request: Request, filename: str = Query(..., min_length=1),
+                                    current_user_id: str = Depends(verify_token)):
+    return await upload_attachment(request, filename, current_user_id, project_id=project_id)
+
+@app.get("/tasks/{task_id}/attachments")
+async def get_task_attachments(task_id: str, current_user_id: str = Depends(verify_token)):
+    return await list_attachments(current_user_id, task_id=task_id)
+
+@app.get("/projects/{project_id}/attachments")
+async def get_project_attachments(project_id: str, current_user_id: str = Depends(verify_token)):
+    return await list_attachments(current_user_id, project_id=project_id)
+
+@app.get("/attachments/{attachment_id}/download")
+async def download_attachment(attachment_id: str, current_user_id: str = Depends(verify_token)):
+    try:
+        attachment, _ = await load_attachment(attachment_id, current_user_id)
+        return await storage.download_response(attachment["filename"], attachment["original_filename"], attachment["mime_type"])
+    except HTTPException:
+        raise
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="El archivo no está disponible en el almacenamiento")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+@app.delete("/attachments/{attachment_id}")
+async def delete_attachment(attachment_id: str, current_user_id: str = Depends(verify_token)):
+    try:
+        attachment, project = await load_attachment(attachment_id, current_user_id)
+        if attachment["uploaded_by"] != current_user_id and project["created_by"] != current_user_id:
+            raise HTTPException(status_code=403, detail="No tienes permisos para eliminar este adjunto")
+        
+        supabase.table("attachments").delete().eq("id", attachment_id).execute()
+        # El objeto almacenado se comparte entre adjuntos con el mismo contenido
+        if attachment.get("content_hash"):
+            await storage.delete_unreferenced(attachment["filename"],
+                                              lambda: object_referenced(attachment["content_hash"]))
+        activity.record(current_user_id, "deleted", "attachment", attachment_id, project_id=project["id"],
+                        old_values=db_utils.format_attachment_for_response(attachment))
+        return {"message": "Adjunto eliminado exitosamente"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+# Línea de tiempo (vista de calendario / Gantt)
+@app.get("/timeline")
+async def get_timeline(
+    start: str = Query(..., alias="from"),
+    end: str = Query(..., alias="to"),
+    project_id: Optional[str] = None,
+    group_by: str = Query("project", pattern="^(project|assignee)$"),
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user_id: str = Depends(verify_token),
+):
+    try:
+        if project_id:
+            await authorize_entity_access(current_user_id, project_id=project_id)
+        return await fetch_timeline(supabase, pg, current_user_id, start, end, group_by, limit,
+                                    project_id=project_id, cursor=cursor)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+# Analítica de carga de trabajo
+@app.get("/analytics/workload")
+async def get_workload(
+    start: Optional[str] = Query(None, alias="from"),
+    end: Optional[str] = Query(None, alias="to"),
+    current_user_id: str = Depends(verify_token),
+):
+    try:
+        monday, weeks = parse_week_window(start, end)
+        workload = await workload_cache.get(admin_client, pg, monday, weeks)
+        user = load_user(current_user_id)
+        if user and user.get("role") == "admin":
+            return workload
+        # Sin rol de administrador solo se ve la carga propia
+        own = [u for u in workload["users"] if u["user_id"] == current_user_id]
+        return {**workload, "users": own, "over_allocated_users": int(any(u["over_allocated_weeks"] for u in own))}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+# Lote de operaciones en una sola petición y una sola transacción (ver apply_batch en supabase_schema.sql)
+MAX_BATCH_OPERATIONS = 100
+
+BATCH_MODELS = {
+    ("task", "create"): TaskCreate, ("task", "update"): TaskUpdate,
+    ("project", "create"): ProjectCreate, ("project", "update"): ProjectUpdate,
+}
+
+def batch_error(index: int, status_code: int, message: str) -> HTTPException:
+    return HTTPException(status_code=status_code, detail=f"Operación {index}: {message}")
+
+def prepare_batch_data(index: int, operation: BatchOperation, current_user_id: str) -> Optional[dict]:
+    """Valida los datos de la operación igual que el endpoint individual"""
+    if operation.op != "create" and not operation.id:
+        raise batch_error(index, 400, "falta el id")
+    model = BATCH_MODELS.get((operation.entity, operation.op))
+    if model is None:
+        return None
+    try:
+        data = model(**(operation.data or {}))
+    except ValidationError as e:
+        raise batch_error(index, 422, str(e))
+    if operation.op == "update":
+        return task_update_data(data) if operation.entity == "task" else {k: v for k, v in data.dict().items() if v is not None}
+    return task_create_data(data, current_user_id) if operation.entity == "task" else project_create_data(data, current_user_id)
+
+def rows_by_id(table: str, ids: set) -> dict:
+    if not ids:
+        return {}
+    return {row["id"]: row for row in supabase.table(table).select("*").in_("id", list(ids)).execute().data}
+
+async def apply_batch(operations: List[dict]) -> List[dict]:
+    if pg.enabled:
+        return await pg.apply_batch(operations)
+    return await run_in_threadpool(
+        lambda: supabase.rpc("apply_batch", {"p_operations": operations}).execute().data
+    )
+
+@app.post("/batch")
+async def run_batch(batch: BatchRequest, current_user_id: str = Depends(verify_token)):
+    try:
+        operations = batch.operations
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            raise HTTPException(status_code=400, detail=f"Un lote admite como máximo {MAX_BATCH_OPERATIONS} operaciones")
+        prepared = [prepare_batch_data(i, op, current_user_id) for i, op in enumerate(operations)]
+
+        # Tareas y proyectos afectados en dos consultas; los permisos se resuelven con ellos
+        tasks = rows_by_id("tasks", {op.id for op in operations if op.entity == "task" and op.op != "create"})
+        project_ids = {op.id for op in operations if op.entity == "project" and op.op != "create"}
+        project_ids |= {task["project_id"] for task in tasks.values()}
+        project_ids |= {data["project_id"] for op, data in zip(operations, prepared) if op.entity == "task" and op.op == "create"}
+        projects = rows_by_id("projects", project_ids)
+
+        touched = set()
+        for i, (op, data) in enumerate(zip(operations, prepared)):
+            # La versión se compara aquí con la fila leída si es la primera operación sobre ella;
+            # apply_batch la vuelve a comprobar en la transacción (409 si cambia entre medias)
+            if op.op == "update" and op.version is not None and (op.entity, op.id) not in touched:
+                row = (tasks if op.entity == "task" else projects).get(op.id)
+                if row and row.get("version", 1) != op.version:
+                    raise batch_error(i, 412, TASK_CHANGED if op.entity == "task" else PROJECT_CHANGED)
+            touched.add((op.entity, op.id))
+            if op.entity == "project":
+                project = projects.get(op.id) if op.op != "create" else None
+                if op.op != "create" and not project:
+                    raise batch_error(i, 404, "Proyecto no encontrado")
+                if project and project["created_by"] != current_user_id:
+                    raise batch_error(i, 403, "No tienes permisos para modificar este proyecto")
+                continue
+            task = tasks.get(op.id) if op.op != "create" else None
+            if op.op != "create" and not task:
+                raise batch_error(i, 404, "Tarea no encontrada")
+            project = projects.get(data["project_id"] if op.op == "create" else task["project_id"])
+            if not project:
+                raise batch_error(i, 404, "Proyecto no encontrado")
+            if op.op == "create":
+                allowed = has_project_access(project, current_user_id)
+            elif op.op == "update":
+                allowed = can_edit_task(project, task, current_user_id)
+            else:
+                allowed = project["created_by"] == current_user_id
+            if not allowed:
+                raise batch_error(i, 403, "No tienes permisos para modificar esta tarea")
+
+        # Las actualizaciones sin cambios no llegan a la base de datos
+        pending = [i for i, (op, data) in enumerate(zip(operations, prepared)) if op.op == "delete" or data]
+        try:
+            rows = await apply_batch([
+                {"op": operations[i].op, "entity": operations[i].entity, "id": operations[i].id, "data": prepared[i],
+                 "version": operations[i].version}
+                for i in pending
+            ]) if pending else []
+        except Exception as e:
+            # Nada se ha aplicado: la transacción se deshace entera
+            raise HTTPException(status_code=409, detail=f"No se pudo aplicar el lote: {str(e)}")
+        written = dict(zip(pending, rows))
+
+        results = []
+        for i, (op, data) in enumerate(zip(operations, prepared)):
+            current = (tasks if op.entity == "task" else projects).get(op.id)
+            row = written.get(i, current)
+            if op.op == "create":
+                (task_created if op.entity == "task" else project_created)(current_user_id, row, data)
+            elif op.op == "update" and data:
+                (task_updated if op.entity == "task" else project_updated)(current_user_id, current, data, row)
+            elif op.op == "delete":
+                (task_deleted if op.entity == "task" else project_deleted)(current_user_id, current)
+            # Las operaciones siguientes sobre la misma fila parten del estado ya escrito
+            if op.op != "delete":
+                (tasks if op.entity == "task" else projects)[row["id"]] = row
+            format_row = db_utils.format_task_for_response if op.entity == "task" else db_utils.format_project_for_response
+            results.append({
+                "index": i, "op": op.op, "entity": op.entity, "id": row["id"],
+                "status": 201 if op.op == "create" else 200,
+                "data": format_row(row) if op.op != "delete" else None,
+            })
+        return {"results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+# Sincronización incremental del caché local del frontend (ver sync.py)
+@app.get("/sync")
+async def sync_changes(
+    since: Optional[str] = None,
+    cursor: Optional[str] = Query(None, deprecated=True),  # nombre anterior de since
+    limit: int = Query(SYNC_DEFAULT_LIMIT, ge=1, le=SYNC_MAX_LIMIT),
+    current_user_id: str = Depends(verify_token),
+):
+    try:
+        return await fetch_sync(supabase, pg, current_user_id, since or cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+# Archivo (ver archive.py): fuera de los listados normales, paginado por keyset
+def format_archived(serializer, row: dict, archived_at: str) -> dict:
+    return {**serializer.format(row), "archived_at": archived_at}
+
+@app.get("/archive/projects")
+async def get_archived_projects(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user_id: str = Depends(verify_token),
+):
+    try:
+        entries, next_cursor = await archive_store.list_projects(current_user_id, limit, cursor)
+        items = [format_archived(PROJECT_SERIALIZER, e["project"], e["archived_at"]) for e in entries]
+        return {"items": items, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+@app.get("/archive/projects/{project_id}")
+async def get_archived_project(project_id: str, current_user_id: str = Depends(verify_token)):
+    try:
+        entry = await archive_store.get_project(project_id)
+        if not entry:
+            raise HTTPException(status_code=404, detail="Proyecto archivado no encontrado")
+        if current_user_id not in entry["members"]:
+            raise HTTPException(status_code=403, detail="No tienes permisos para ver este proyecto")
+        return {
+            **format_archived(PROJECT_SERIALIZER, entry["project"], entry["archived_at"]),
+            "tasks": [TASK_SERIALIZER.format(task) for task in entry["data"]["tasks"]],
+            "comments": [format_comment_for_response(comment) for comment in entry["data"]["comments"]],
+            "attachments": [db_utils.format_attachment_for_response(a) for a in entry["data"]["attachments"]],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+@app.post("/archive/projects/{project_id}/restore")
+async def restore_archived_project(project_id: str, current_user_id: str = Depends(verify_token)):
+    try:
+        entry = await archive_store.get_project(project_id)
+        if not entry:
+            raise HTTPException(status_code=404, detail="Proyecto archivado no encontrado")
+        if entry["project"]["created_by"] != current_user_id:
+            raise HTTPException(status_code=403, detail="No tienes permisos para restaurar este proyecto")
+        
+        restored = await archive_store.restore_project(project_id)
+        if not restored:
+            raise HTTPException(status_code=404, detail="Proyecto archivado no encontrado")
+        project_cache.invalidate(project_id)
+        workload_cache.invalidate()
+        activity.record(current_user_id, "restored", "project", project_id, project_id=project_id)
+        return PROJECT_SERIALIZER.format(restored)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+@app.get("/archive/tasks")
+async def get_archived_tasks(
+    project_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user_id: str = Depends(verify_token),
+):
+    try:
+        await authorize_entity_access(current_user_id, project_id=project_id)
+        entries, next_cursor = await archive_store.list_tasks(project_id, limit, cursor)
+        items = [format_archived(TASK_SERIALIZER, e["task"], e["archived_at"]) for e in entries]
+        return {"items": items, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+@app.post("/archive/tasks/{task_id}/restore")
+async def restore_archived_task(task_id: str, current_user_id: str = Depends(verify_token)):
+    try:
+        entry = await archive_store.get_task(task_id)
+        if not entry:
+            raise HTTPException(status_code=404, detail="Tarea archivada no encontrada")
+        project = await load_project(entry["project_id"])
+        if not project:
+            raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+        if not can_edit_task(project, entry["task"], current_user_id):
+            raise HTTPException(status_code=403, detail="No tienes permisos para restaurar esta tarea")
+        
+        restored = await archive_store.restore_task(task_id)
+        if not restored:
+            raise HTTPException(status_code=404, detail="Tarea archivada no encontrada")
+        project_cache.invalidate(project["id"])
+        workload_cache.invalidate()
+        activity.record(current_user_id, "restored", "task", task_id, project_id=project["id"])
+        return TASK_SERIALIZER.format(restored)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+# Historial de actividad
+@app.get("/activity")
+async def get_activity(
+    entity_type: Optional[str] = None,
+    entity_id: Optional[str] = None,
+    project_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user_id: str = Depends(verify_token),
+):
+    try:
+        if entity_type and entity_id:
+            query = supabase.table("activity_log").select("*").eq("entity_type", entity_type).eq("entity_id", entity_id)
+            if entity_type == "project":
+                access_project_id = entity_id
+            elif entity_type == "task":
+                task_result = supabase.table("tasks").select("project_id").eq("id", entity_id).execute()
+                access_project_id = task_result.data[0]["project_id"] if task_result.data else None
+            else:
+                raise HTTPException(status_code=400, detail="entity_type debe ser 'project' o 'task'")
+        elif project_id:
+            query = supabase.table("activity_log").select("*").eq("project_id", project_id)
+            access_project_id = project_id
+        else:
+            raise HTTPException(status_code=400, detail="Indica entity_type y entity_id, o project_id")
+        
+        # Verificar permisos del proyecto (el historial de entidades eliminadas solo lo ve su autor)
+        project = await load_project(access_project_id) if access_project_id else None
+        if project:
+            if project["created_by"] != current_user_id and current_user_id not in project.get("assigned_to", []):
+                raise HTTPException(status_code=403, detail="No tienes permisos para ver esta actividad")
+        else:
+            query = query.eq("user_id", current_user_id)
+        
+        if cursor:
+            created_at, last_id = decode_cursor(cursor)
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{last_id})')
+        result = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute()
+        items = result.data[:limit]
+        next_cursor = encode_cursor(items[-1]["created_at"], items[-1]["id"]) if len(result.data) > limit else None
+        return {"items": items, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+# Endpoints de notificaciones
+@app.get("/notifications")
+async def get_notifications(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    unread_only: bool = False,
+    current_user_id: str = Depends(verify_token),
+):
+    try:
+        items, next_cursor = await notifications.list_for_user(current_user_id, limit, cursor, unread_only)
+        return {
+            "items": items,
+            "next_cursor": next_cursor,
+            "unread_count": await notifications.unread_count(current_user_id),
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+@app.post("/notifications/mark-read")
+async def mark_notifications_read(body: MarkNotificationsRead, current_user_id: str = Depends(verify_token)):
+    try:
+        ids = None if body.ids is None else [str(notification_id) for notification_id in body.ids]
+        updated = await notifications.mark_read(current_user_id, ids)
+        return {"updated": updated, "unread_count": await notifications.unread_count(current_user_id)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+# Datos de referencia servidos desde memoria (304 si If-None-Match coincide con el ETag)
 @app.get("/categories")
-async def get_categories(current_user_id: str = Depends(verify_token)):
+async def get_categories(if_none_match: Optional[str] = Header(None), current_user_id: str = Depends(verify_token)):
+    try:
+        return (await categories_data.get()).response(if_none_match)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+@app.get("/users/directory")
+async def get_user_directory(if_none_match: Optional[str] = Header(None),
+                             current_user_id: str = Depends(verify_token)):
+    """Usuarios activos (id, name, username, profile_photo) para mostrar responsables"""
+    try:
+        return (await user_directory.get()).response(if_none_match)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+@app.get("/users/search")
+async def search_users(
+    prefix: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    current_user_id: str = Depends(verify_token),
+):
+    """Usuarios activos cuyo nombre de usuario, nombre o email empieza por prefix (selector de responsables)"""
     try:
-        result = supabase.table("categories").select("*").execute()
-        return result.data
+        try:
+            directory = await user_directory.get()
+        except Exception:
+            logger.warning("Directorio de usuarios no disponible; se busca en la base de datos", exc_info=True)
+            return await user_search.search(prefix, limit)
+        return directory.search(prefix, limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
@@ -471,6 +1491,32 @@ async def get_categories(current_user_id: str = Depends(verify_token)):
 async def health_check():
     return {"status": "healthy", "database": "supabase", "version": "2.0.0"}
 
+# Preparación para recibir tráfico: latencia de ida y vuelta a cada backend
+@app.get("/health/ready")
+async def readiness_check():
+    checks = {}
+    ready = True
+    backends = [("supabase", lambda: run_in_threadpool(supabase_config.ping))]
+    if pg.enabled:
+        backends.append(("postgres", pg.ping))
+    for name, ping in backends:
+        started = time.perf_counter()
+        try:
+            await ping()
+            checks[name] = {"status": "ok", "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+        except Exception as e:
+            ready = False
+            checks[name] = {"status": "error", "error": str(e)}
+    return JSONResponse({"status": "ready" if ready else "unavailable", "checks": checks},
+                        status_code=200 if ready else 503)
+
+# Endpoint de métricas (formato Prometheus)
+@app.get("/metrics")
+async def metrics(authorization: Optional[str] = Header(None)):
+    if not metrics_authorized(authorization):
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8001))
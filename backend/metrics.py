@@ -0,0 +1,444 @@
+# Métricas estilo Prometheus para Project Planner
+#
+# Registro en proceso de contadores, gauges e histogramas con exposición en
+# formato de texto de Prometheus (/metrics). La recogida está pensada para
+# quedarse activa en producción: cada observación es una búsqueda en un dict,
+# un bisect y un lock sin contención por métrica.
+import contextlib
+import contextvars
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets de latencia en segundos (de 1 ms a 10 s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets para número de consultas por petición
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: Tuple[str, ...] = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1.0) -> None:
+        self.inc(labels, -amount)
+
+    def set(self, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Por combinación de etiquetas: [conteos por bucket (no acumulados)..., +Inf, suma]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._values.get(labels)
+            if child is None:
+                child = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            child[index] += 1
+            child[-1] += value
+
+    def count(self, labels: Tuple[str, ...]) -> int:
+        child = self._values.get(labels)
+        return int(sum(child[:-1])) if child else 0
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = sorted((labels, list(child)) for labels, child in self._values.items())
+        for labels, child in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(child[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registro de métricas de un proceso"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Exposición en formato de texto de Prometheus (versión 0.0.4)"""
+        _update_cache_ratios()
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Métricas HTTP
+http_request_duration = registry.histogram(
+    "planner_http_request_duration_seconds", "Duración de las peticiones HTTP por ruta",
+    ("method", "route", "status"),
+)
+http_requests_in_flight = registry.gauge(
+    "planner_http_requests_in_flight", "Peticiones HTTP en curso", ("method",),
+)
+
+# Métricas de base de datos
+db_query_duration = registry.histogram(
+    "planner_db_query_duration_seconds", "Duración de cada consulta a la base de datos",
+    ("backend", "operation", "table"),
+)
+db_fetch_seconds = registry.counter(
+    "planner_db_fetch_seconds_total", "Tiempo dedicado a leer filas de cursores SQLite", ("backend",),
+)
+db_queries_per_request = registry.histogram(
+    "planner_db_queries_per_request", "Consultas (o llamadas a Supabase) por petición HTTP",
+    ("route",), QUERY_COUNT_BUCKETS,
+)
+db_time_per_request = registry.histogram(
+    "planner_db_time_per_request_seconds", "Tiempo total en base de datos por petición HTTP", ("route",),
+)
+
+# Métricas de cachés
+cache_requests = registry.counter(
+    "planner_cache_requests_total", "Accesos a cachés en memoria", ("cache", "result"),
+)
+cache_hit_ratio = registry.gauge(
+    "planner_cache_hit_ratio", "Proporción de aciertos por caché desde el arranque", ("cache",),
+)
+
+
+def _update_cache_ratios() -> None:
+    caches = {labels[0] for labels in list(cache_requests._values)}
+    for cache in caches:
+        hits = cache_requests.value((cache, "hit"))
+        total = hits + cache_requests.value((cache, "miss"))
+        cache_hit_ratio.set((cache,), hits / total if total else 0.0)
+
+
+def record_cache_access(cache: str, hit: bool) -> None:
+    """Registra un acierto o fallo en una caché en memoria"""
+    cache_requests.inc((cache, "hit" if hit else "miss"))
+
+
+def metrics_authorized(authorization: Optional[str]) -> bool:
+    """Si METRICS_TOKEN está configurado, /metrics exige 'Authorization: Bearer <token>'"""
+    expected = os.getenv("METRICS_TOKEN")
+    if not expected:
+        return True
+    return hmac.compare_digest(authorization or "", f"Bearer {expected}")
+
+
+class RequestStats:
+    """Acumulador de consultas de la petición en curso"""
+
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "planner_request_stats", default=None
+)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+class QueryRecord(NamedTuple):
+    """Consulta registrada por capture_queries; shape es la consulta sin valores (SQL o cadena de PostgREST)"""
+
+    backend: str
+    operation: str
+    table: str
+    shape: str
+
+
+_query_log: contextvars.ContextVar[Optional[List[QueryRecord]]] = contextvars.ContextVar(
+    "planner_query_log", default=None
+)
+
+
+@contextlib.contextmanager
+def capture_queries() -> Iterator[List[QueryRecord]]:
+    """Registra las consultas hechas dentro del bloque, también en hilos y tareas que
+    hereden el contexto (presupuestos de consultas en las pruebas)"""
+    log: List[QueryRecord] = []
+    token = _query_log.set(log)
+    try:
+        yield log
+    finally:
+        _query_log.reset(token)
+
+
+def record_db_query(backend: str, operation: str, table: str, seconds: float, shape: str = "") -> None:
+    """Registra una consulta (SQLite, Postgres) o una ida y vuelta a Supabase"""
+    db_query_duration.observe((backend, operation, table), seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+    log = _query_log.get()
+    if log is not None:
+        log.append(QueryRecord(backend, operation, table, shape or f"{operation} {table}"))
+
+
+def _record_db_time(backend: str, seconds: float) -> None:
+    db_fetch_seconds.inc((backend,), seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.db_seconds += seconds
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que mide duración por plantilla de ruta y consultas por petición"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        http_requests_in_flight.inc((method,))
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec((method,))
+            _request_stats.reset(token)
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "<unmatched>"
+            http_request_duration.observe((method, template, str(status_code[0])), elapsed)
+            db_queries_per_request.observe((template,), stats.queries)
+            db_time_per_request.observe((template,), stats.db_seconds)
+
+
+# Instrumentación de SQLite
+def _sql_operation(sql: str) -> str:
+    stripped = sql.lstrip()
+    return stripped[:stripped.find(" ")].upper() if " " in stripped else stripped.upper()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor que contabiliza el tiempo de lectura de filas"""
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _record_db_time("sqlite", time.perf_counter() - started)
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args, **kwargs)
+        finally:
+            _record_db_time("sqlite", time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _record_db_time("sqlite", time.perf_counter() - started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Conexión SQLite que mide cada sentencia (usar con sqlite3.connect(factory=...))"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return self.cursor().execute(sql, parameters)
+        finally:
+            record_db_query("sqlite", _sql_operation(sql), "", time.perf_counter() - started, sql)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return self.cursor().executemany(sql, seq_of_parameters)
+        finally:
+            record_db_query("sqlite", _sql_operation(sql), "", time.perf_counter() - started, sql)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record_db_query("sqlite", "COMMIT", "", time.perf_counter() - started)
+
+
+# Instrumentación de Supabase
+_SUPABASE_ACTIONS = {"select", "insert", "update", "upsert", "delete"}
+
+
+class _InstrumentedRequest:
+    """Envuelve un constructor de consultas de postgrest y mide cada execute()"""
+
+    __slots__ = ("_builder", "_table", "_action", "_calls")
+
+    def __init__(self, builder, table: str, action: str = "select", calls: Tuple[str, ...] = ()):
+        self._builder = builder
+        self._table = table
+        self._action = action
+        # Métodos encadenados con su columna (sin valores): forma de la consulta
+        self._calls = calls
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._builder.execute(*args, **kwargs)
+        finally:
+            shape = f"{self._table} {' '.join(self._calls)}" if _query_log.get() is not None else ""
+            record_db_query("supabase", self._action, self._table, time.perf_counter() - started, shape)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._builder, name)
+        if not callable(attribute):
+            return attribute
+        action = name if name in _SUPABASE_ACTIONS else self._action
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if hasattr(result, "execute"):
+                column = args[0] if args and isinstance(args[0], str) else ""
+                return _InstrumentedRequest(result, self._table, action, (*self._calls, f"{name}({column})"))
+            return result
+
+        return call
+
+
+class InstrumentedClient:
+    """Envuelve un cliente de Supabase para contabilizar cada ida y vuelta"""
+
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def wrapped(self):
+        return self._client
+
+    def table(self, name: str):
+        return _InstrumentedRequest(self._client.table(name), name)
+
+    def from_(self, name: str):
+        return self.table(name)
+
+    def rpc(self, name: str, params: Optional[dict] = None, *args, **kwargs):
+        return _InstrumentedRequest(self._client.rpc(name, params or {}, *args, **kwargs), f"rpc:{name}", "rpc")
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def instrument_supabase(client):
+    """Devuelve el cliente envuelto con instrumentación (idempotente)"""
+    if client is None or isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client)
+
@@ -0,0 +1,151 @@
+# Notificaciones de Project Planner (backend Supabase)
+#
+# Los endpoints llaman a notify() con la lista de destinatarios: solo se encola
+# un evento, así que la latencia de la mutación no depende del número de
+# destinatarios. El BatchWorker expande los eventos en filas, descarta las
+# notificaciones repetidas (mismo usuario, tipo y entidad) dentro de la
+# ventana de coalescencia y las inserta en bloque. El contador de no leídas de
+# cada usuario se cachea y se ajusta con cada lote y con cada marcado. Ambos
+# registros en memoria están acotados: los envíos recientes por antigüedad y
+# los contadores como LRU.
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from batch_worker import BatchWorker
+from metrics import record_cache_access
+from pagination import decode_cursor, encode_cursor
+
+# Segundos durante los que una notificación igual a otra ya enviada se descarta
+COALESCE_SECONDS = float(os.getenv("NOTIFICATIONS_COALESCE_SECONDS", "60"))
+# Validez del contador cacheado (acota la desviación con varios workers)
+UNREAD_TTL_SECONDS = float(os.getenv("NOTIFICATIONS_UNREAD_TTL", "30"))
+# Filas máximas por INSERT
+INSERT_CHUNK = 1000
+# Entradas máximas de los envíos recientes y de los contadores cacheados
+RECENT_MAX_ENTRIES = 100_000
+UNREAD_MAX_ENTRIES = 10_000
+# Ids máximos por petición de marcado como leídas
+MARK_READ_MAX_IDS = 500
+
+
+class NotificationService:
+    """Cola de notificaciones con inserción por lotes y contador de no leídas"""
+
+    def __init__(self, client, coalesce_seconds: float = COALESCE_SECONDS,
+                 unread_ttl: float = UNREAD_TTL_SECONDS, **worker_options):
+        self.client = client
+        self.coalesce_seconds = coalesce_seconds
+        self.unread_ttl = unread_ttl
+        self.worker = BatchWorker("notifications", self._flush, **worker_options)
+        # Envíos recientes por orden de envío (el más antiguo primero)
+        self._recent: "OrderedDict[tuple, float]" = OrderedDict()
+        self._unread: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+
+    def notify(self, recipients: Iterable[Optional[str]], type: str, title: str, message: str,
+               entity_type: Optional[str] = None, entity_id: Optional[str] = None,
+               actor_id: Optional[str] = None) -> None:
+        """Encola una notificación para varios usuarios (el autor del cambio no la recibe)"""
+        users = tuple({user for user in recipients if user and user != actor_id})
+        if users:
+            self.worker.submit((users, type, title, message, entity_type, entity_id))
+
+    def _coalesce(self, key: tuple, now: float) -> bool:
+        """True si ya se envió una notificación igual dentro de la ventana"""
+        sent_at = self._recent.get(key)
+        if sent_at is not None and now - sent_at < self.coalesce_seconds:
+            return True
+        self._recent[key] = now
+        self._recent.move_to_end(key)
+        if len(self._recent) > RECENT_MAX_ENTRIES:
+            self._recent.popitem(last=False)
+        return False
+
+    def _prune_recent(self, now: float) -> None:
+        # Las entradas están ordenadas por envío: basta con quitar las del principio
+        while self._recent and now - next(iter(self._recent.values())) >= self.coalesce_seconds:
+            self._recent.popitem(last=False)
+
+    async def _flush(self, events: List[tuple]) -> None:
+        now = time.monotonic()
+        self._prune_recent(now)
+        rows = []
+        for users, type, title, message, entity_type, entity_id in events:
+            for user_id in users:
+                if self._coalesce((user_id, type, entity_type, entity_id), now):
+                    continue
+                rows.append({
+                    "user_id": user_id,
+                    "title": title,
+                    "message": message,
+                    "type": type,
+                    "entity_type": entity_type,
+                    "entity_id": entity_id,
+                })
+        for start in range(0, len(rows), INSERT_CHUNK):
+            chunk = rows[start:start + INSERT_CHUNK]
+            await run_in_threadpool(lambda: self.client.table("notifications").insert(chunk).execute())
+            for row in chunk:
+                self._adjust_unread(row["user_id"], 1)
+
+    def _adjust_unread(self, user_id: str, delta: int) -> None:
+        cached = self._unread.get(user_id)
+        if cached is not None:
+            self._unread[user_id] = (max(0, cached[0] + delta), cached[1])
+
+    def _cache_unread(self, user_id: str, count: int) -> None:
+        self._unread[user_id] = (count, time.monotonic())
+        self._unread.move_to_end(user_id)
+        if len(self._unread) > UNREAD_MAX_ENTRIES:
+            self._unread.popitem(last=False)
+
+    async def unread_count(self, user_id: str) -> int:
+        cached = self._unread.get(user_id)
+        if cached is not None and time.monotonic() - cached[1] < self.unread_ttl:
+            self._unread.move_to_end(user_id)
+            record_cache_access("notifications_unread", True)
+            return cached[0]
+        record_cache_access("notifications_unread", False)
+        result = await run_in_threadpool(
+            lambda: self.client.table("notifications").select("id", count="exact")
+            .eq("user_id", user_id).eq("is_read", False).limit(1).execute()
+        )
+        count = result.count or 0
+        self._cache_unread(user_id, count)
+        return count
+
+    async def list_for_user(self, user_id: str, limit: int, cursor: Optional[str] = None,
+                            unread_only: bool = False) -> Tuple[List[dict], Optional[str]]:
+        """Página de notificaciones (más recientes primero) y cursor de la siguiente"""
+        query = self.client.table("notifications").select("*").eq("user_id", user_id)
+        if unread_only:
+            query = query.eq("is_read", False)
+        if cursor:
+            created_at, notification_id = decode_cursor(cursor)
+            query = query.or_(
+                f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{notification_id})'
+            )
+        query = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1)
+        result = await run_in_threadpool(query.execute)
+        items = result.data[:limit]
+        next_cursor = encode_cursor(items[-1]["created_at"], items[-1]["id"]) if len(result.data) > limit else None
+        return items, next_cursor
+
+    async def mark_read(self, user_id: str, ids: Optional[List[str]] = None) -> int:
+        """Marca como leídas las notificaciones indicadas (todas si ids es None)"""
+        query = self.client.table("notifications").update({"is_read": True}).eq("user_id", user_id).eq("is_read", False)
+        if ids is not None:
+            query = query.in_("id", ids)
+        result = await run_in_threadpool(query.execute)
+        updated = len(result.data or [])
+        if ids is None:
+            self._cache_unread(user_id, 0)
+        else:
+            self._adjust_unread(user_id, -updated)
+        return updated
+
+    async def close(self) -> None:
+        await self.worker.stop()
@@ -0,0 +1,42 @@
+# Cursores opacos para paginación por keyset sobre (created_at, id) o sobre
+# varias columnas (encode_keyset)
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Any, List, Sequence, Tuple
+
+
+def encode_cursor(created_at: str, row_id: str) -> str:
+    raw = f"{created_at}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """Devuelve (created_at, id) del cursor; ValueError si no es válido"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|")
+        # Ambos valores acaban en filtros de consulta: solo se aceptan con su formato
+        datetime.fromisoformat(created_at)
+        uuid.UUID(row_id)
+    except Exception:
+        raise ValueError("Cursor inválido")
+    return created_at, row_id
+
+
+def encode_keyset(values: Sequence[Any]) -> str:
+    """Cursor opaco para un keyset de varias columnas"""
+    raw = json.dumps(list(values), separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_keyset(cursor: str, size: int) -> List[Any]:
+    """Devuelve los size valores del cursor; ValueError si no es válido"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError
+    except Exception:
+        raise ValueError("Cursor inválido")
+    return values
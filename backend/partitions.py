@@ -0,0 +1,181 @@
+# Particiones mensuales de las tablas de solo inserción (activity_log y
+# notifications) con retención
+#
+# Las filas se reparten por el mes de su fecha de creación, así que borrar lo
+# antiguo es eliminar una partición entera (una operación de catálogo, sin
+# DELETE fila a fila ni filas muertas que limpiar) y las consultas de historia
+# reciente solo leen las últimas particiones.
+#   - Postgres: tablas particionadas por rango de created_at (<tabla>_pAAAAMM,
+#     meses en UTC) y una partición DEFAULT para lo que llegue sin partición.
+#     maintain_monthly_partitions (ver supabase_schema.sql) crea por adelantado
+#     las de los PREMAKE_MONTHS meses siguientes y elimina las caducadas.
+#   - SQLite (main.py, solo activity_log): una tabla por mes con las mismas
+#     columnas e índices (SqliteMonthlyTables); las lecturas recorren las
+#     tablas de la más reciente a la más antigua y paran al llenar la página.
+# La retención es el número de meses completos que se conservan además del
+# actual (0 = todos).
+import os
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+# Intervalo entre ejecuciones del mantenimiento (s)
+MAINTENANCE_SECONDS = float(os.getenv("PARTITION_MAINTENANCE_SECONDS", "86400"))
+# Meses siguientes al actual con partición creada de antemano
+PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))
+# Meses conservados por tabla además del actual (0 = sin límite)
+RETENTION_MONTHS = {
+    "activity_log": int(os.getenv("ACTIVITY_RETENTION_MONTHS", "24")),
+    "notifications": int(os.getenv("NOTIFICATION_RETENTION_MONTHS", "6")),
+}
+
+
+def add_months(month: date, months: int) -> date:
+    """Primer día del mes desplazado months meses"""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_suffix(created_at: str) -> str:
+    """AAAAMM de una fecha ISO (texto)"""
+    return created_at[0:4] + created_at[5:7]
+
+
+# SQLite
+class SqliteMonthlyTables:
+    """Una tabla de SQLite por mes (<base>_AAAAMM) con las mismas columnas e índices
+
+    Args:
+        connect: Función que abre una conexión (para el trabajo periódico)
+        base: Nombre de la tabla lógica
+        columns: Definición de columnas (cuerpo del CREATE TABLE)
+        indexes: (sufijo del nombre, columnas) de cada índice
+        date_column: Columna con la fecha ISO de creación que decide la tabla
+    """
+
+    def __init__(self, connect, base: str, columns: str, indexes: Sequence[Tuple[str, str]], date_column: str,
+                 retention_months: int = 0, premake_months: int = PREMAKE_MONTHS):
+        self.connect = connect
+        self.base = base
+        self.columns = columns
+        self.indexes = indexes
+        self.date_column = date_column
+        self.retention_months = retention_months
+        self.premake_months = premake_months
+
+    def table(self, suffix: str) -> str:
+        return f"{self.base}_{suffix}"
+
+    def tables(self, conn) -> List[str]:
+        """Tablas mensuales existentes, de la más reciente a la más antigua"""
+        rows = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+            (f"{self.base}_[0-9][0-9][0-9][0-9][0-9][0-9]",),
+        ).fetchall()
+        return sorted((row[0] for row in rows), reverse=True)
+
+    def ensure(self, conn, suffix: str) -> bool:
+        """Crea la tabla del mes si no existe; devuelve si no existía"""
+        table = self.table(suffix)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+            return False
+        # IF NOT EXISTS: otro worker puede crearla entre la comprobación y el CREATE
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({self.columns})")
+        for name, columns in self.indexes:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{name} ON {table} ({columns})")
+        return True
+
+    def migrate(self, conn) -> None:
+        """Reparte las filas de una tabla sin particionar anterior y la elimina"""
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.base,)).fetchone():
+            return
+        suffixes = conn.execute(
+            f"SELECT DISTINCT substr({self.date_column}, 1, 4) || substr({self.date_column}, 6, 2) FROM {self.base}"
+        ).fetchall()
+        for (suffix,) in suffixes:
+            self.ensure(conn, suffix)
+            conn.execute(
+                f"INSERT OR IGNORE INTO {self.table(suffix)} SELECT * FROM {self.base} "
+                f"WHERE substr({self.date_column}, 1, 4) || substr({self.date_column}, 6, 2) = ?",
+                (suffix,),
+            )
+        conn.execute(f"DROP TABLE {self.base}")
+
+    def rotate(self, conn, today: Optional[date] = None) -> Dict[str, List[str]]:
+        """Crea las tablas del mes actual y siguientes y elimina las caducadas"""
+        current = (today or datetime.now(timezone.utc).date()).replace(day=1)
+        created = [
+            self.table(f"{month:%Y%m}")
+            for month in (add_months(current, i) for i in range(self.premake_months + 1))
+            if self.ensure(conn, f"{month:%Y%m}")
+        ]
+        dropped = []
+        if self.retention_months > 0:
+            cutoff = self.table(f"{add_months(current, -self.retention_months):%Y%m}")
+            for table in self.tables(conn):
+                if table < cutoff:
+                    conn.execute(f"DROP TABLE {table}")
+                    dropped.append(table)
+        return {"created": created, "dropped": dropped}
+
+    def insert(self, conn, columns: Sequence[str], rows: Iterable[Sequence], verb: str = "INSERT") -> None:
+        """Inserta cada fila en la tabla de su mes (la columna de fecha debe estar en columns)"""
+        position = list(columns).index(self.date_column)
+        by_table: Dict[str, List[Sequence]] = {}
+        for row in rows:
+            by_table.setdefault(month_suffix(row[position]), []).append(row)
+        placeholders = ", ".join("?" for _ in columns)
+        for suffix, chunk in by_table.items():
+            self.ensure(conn, suffix)
+            conn.executemany(
+                f"{verb} INTO {self.table(suffix)} ({', '.join(columns)}) VALUES ({placeholders})", chunk
+            )
+
+    def select_recent(self, conn, where: str, params: Sequence, order: str, limit: int,
+                      before: Optional[str] = None) -> List[dict]:
+        """Hasta limit filas de WHERE where en orden descendente de fecha, recorriendo las tablas
+        de la más reciente a la más antigua; before (fecha ISO) salta las tablas posteriores"""
+        rows: List[dict] = []
+        for table in self.tables(conn):
+            if before is not None and table > self.table(month_suffix(before)):
+                continue
+            cursor = conn.execute(f"SELECT * FROM {table} WHERE {where} ORDER BY {order} LIMIT ?",
+                                  (*params, limit - len(rows)))
+            rows += [dict(row) for row in cursor.fetchall()]
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def _rotate(self) -> Dict[str, List[str]]:
+        with self.connect() as conn:
+            result = self.rotate(conn)
+            conn.commit()
+        return result
+
+    async def maintain(self, context) -> Dict[str, List[str]]:
+        return await run_in_threadpool(self._rotate)
+
+
+# Postgres / Supabase
+class SupabasePartitions:
+    """Mantenimiento periódico de las particiones de activity_log y notifications"""
+
+    def __init__(self, client, pg, retention_months: Optional[Dict[str, int]] = None,
+                 premake_months: int = PREMAKE_MONTHS):
+        self.client = client
+        self.pg = pg
+        self.retention_months = retention_months or RETENTION_MONTHS
+        self.premake_months = premake_months
+
+    async def maintain(self, context) -> Dict[str, dict]:
+        results = {}
+        for table, retention in self.retention_months.items():
+            params = {"p_table": table, "p_retention_months": retention, "p_premake_months": self.premake_months}
+            if self.pg.enabled:
+                results[table] = await self.pg.maintain_partitions(**params)
+            else:
+                results[table] = await run_in_threadpool(
+                    lambda: self.client.rpc("maintain_monthly_partitions", params).execute().data
+                )
+        return results
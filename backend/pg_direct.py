@@ -0,0 +1,340 @@
+# Acceso directo a Postgres para las consultas calientes de main_supabase.py
+#
+# Opcional: si SUPABASE_DB_URL está configurada y asyncpg está instalado se
+# abre un pool asíncrono contra la base de datos de Supabase y las consultas
+# más frecuentes (listado de proyectos y tareas, comprobación de permisos y
+# actualización de proyectos y tareas) se ejecutan sin pasar por PostgREST.
+# asyncpg mantiene cada sentencia preparada en la caché de su conexión, así
+# que las consultas con texto constante se planifican una sola vez por conexión.
+#
+# Con el pooler de Supabase en modo transacción (puerto 6543) las sentencias
+# preparadas no sobreviven entre transacciones: usar la conexión directa
+# (puerto 5432) o el modo sesión, o PG_STATEMENT_CACHE_SIZE=0.
+#
+# Esta conexión no pasa por RLS: los permisos los sigue comprobando la API.
+import json
+import os
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover - dependencia opcional
+    asyncpg = None
+
+from metrics import record_db_query
+
+# Tipos de columna de tasks para los UPDATE parametrizados (los valores llegan como JSON)
+TASK_COLUMN_CASTS = {
+    "title": "::text",
+    "description": "::text",
+    "assigned_to": "::text::uuid",
+    "priority": "::text",
+    "status": "::text",
+    "progress": "::int",
+    "due_date": "::text::timestamptz",
+    "start_date": "::text::timestamptz",
+    "completed_date": "::text::timestamptz",
+    "estimated_hours": "::float8",
+    "actual_hours": "::float8",
+    "tags": "::text[]",
+    "dependencies": "::text[]::uuid[]",
+    "deadline_status": "::text",
+}
+
+# Tipos de columna de projects para los UPDATE parametrizados
+PROJECT_COLUMN_CASTS = {
+    "name": "::text",
+    "description": "::text",
+    "start_date": "::text::date",
+    "end_date": "::text::date",
+    "priority": "::text",
+    "status": "::text",
+    "progress": "::int",
+    "category_id": "::text::uuid",
+    "assigned_to": "::text[]::uuid[]",
+    "tags": "::text[]",
+    "budget": "::float8",
+    "is_archived": "::bool",
+}
+
+# {columns}: "*" o columnas de la lista permitida de fields.py (?fields=)
+LIST_PROJECTS_COLUMNS_SQL = """
+    SELECT {columns} FROM projects
+    WHERE id IN (SELECT project_id FROM project_members WHERE user_id = $1::uuid)
+"""
+LIST_PROJECTS_SQL = LIST_PROJECTS_COLUMNS_SQL.format(columns="*")
+GET_PROJECT_SQL = "SELECT * FROM projects WHERE id = $1::uuid"
+LIST_PROJECT_TASKS_COLUMNS_SQL = "SELECT {columns} FROM tasks WHERE project_id = $1::uuid"
+# Tarea junto con los datos de permisos de su proyecto en una sola ida y vuelta
+GET_TASK_WITH_PROJECT_SQL = """
+    SELECT t.*, p.created_by AS project_created_by, p.assigned_to AS project_assigned_to
+    FROM tasks t
+    JOIN projects p ON p.id = t.project_id
+    WHERE t.id = $1::uuid
+"""
+
+COMMENT_THREAD_SQL = """
+    SELECT * FROM get_comment_thread($1::uuid, $2::uuid, $3::int, $4::text::timestamptz, $5::uuid)
+"""
+
+TIMELINE_SQL = """
+    SELECT * FROM get_timeline($1::uuid, $2::text::timestamptz, $3::text::timestamptz, $4::uuid, $5::text,
+                               $6::int, $7::text, $8::text::timestamptz, $9::uuid)
+"""
+
+# UPDATE condicional de una sola sentencia (ver etags.py): $1 id, $2 usuario,
+# $3 versión leída (NULL = cualquiera). La subconsulta bloquea la fila y da sus
+# valores anteriores para el registro de actividad.
+UPDATE_PROJECT_SQL = """
+    UPDATE projects p SET {assignments}
+    FROM (SELECT * FROM projects WHERE id = $1::uuid FOR UPDATE) old
+    WHERE p.id = old.id AND p.created_by = $2::uuid AND ($3::int IS NULL OR p.version = $3::int)
+    RETURNING p.*, to_jsonb(old) AS previous
+"""
+# Como can_edit_task: miembro del proyecto o responsable de la tarea (vía
+# PostgREST, la función update_task_checked de supabase_schema.sql)
+UPDATE_TASK_SQL = """
+    UPDATE tasks t SET {assignments}
+    FROM (SELECT * FROM tasks WHERE id = $1::uuid FOR UPDATE) old, projects p
+    WHERE t.id = old.id AND p.id = t.project_id AND ($3::int IS NULL OR t.version = $3::int)
+      AND (p.created_by = $2::uuid OR $2::uuid = ANY(p.assigned_to) OR t.assigned_to = $2::uuid)
+    RETURNING t.*, to_jsonb(old) AS previous
+"""
+
+# Lote de escrituras en una transacción (ver apply_batch en supabase_schema.sql)
+APPLY_BATCH_SQL = "SELECT apply_batch($1::jsonb) AS row"
+
+CHANGES_SQL = "SELECT get_changes($1::uuid, $2::text, $3::text, $4::text, $5::int) AS result"
+
+# Archivo (ver archive.py)
+ARCHIVE_BATCH_SQL = "SELECT archive_batch($1::int, $2::text::timestamptz) AS result"
+RESTORE_ARCHIVED_PROJECT_SQL = "SELECT restore_archived_project($1::uuid) AS row"
+RESTORE_ARCHIVED_TASK_SQL = "SELECT restore_archived_task($1::uuid) AS row"
+MAINTAIN_PARTITIONS_SQL = "SELECT maintain_monthly_partitions($1::text, $2::int, $3::int) AS result"
+SEARCH_USERS_SQL = "SELECT * FROM search_users($1::text, $2::int)"
+
+# Columnas de carga de trabajo como arrays, en una fila (ver workload.py); usa idx_tasks_time_range
+WORKLOAD_COLUMNS_SQL = """
+    SELECT array_agg(assigned_to::text) AS assigned_to,
+           array_agg(extract(epoch FROM lower(time_range))::float8) AS start_at,
+           array_agg(extract(epoch FROM upper(time_range))::float8) AS end_at,
+           array_agg(estimated_hours::float8) AS estimated_hours,
+           array_agg(actual_hours::float8) AS actual_hours,
+           array_agg(status = 'completed') AS completed
+    FROM tasks
+    WHERE assigned_to IS NOT NULL AND status <> 'cancelled'
+      AND time_range && tstzrange($1::text::timestamptz, $2::text::timestamptz, '[)')
+"""
+
+# Lease del planificador: solo se escribe si es nuestro o ha caducado (ver scheduler.py)
+ACQUIRE_LEASE_SQL = """
+    INSERT INTO scheduler_leases (name, owner, expires_at)
+    VALUES ($1, $2, now() + make_interval(secs => $3::float8))
+    ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+    WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.expires_at < now()
+    RETURNING name
+"""
+# Barrido de vencimientos: recorrido por rango de idx_tasks_due_date (ver deadlines.py)
+FLAG_DEADLINES_SQL = """
+    UPDATE tasks SET deadline_status = $3
+    WHERE due_date > $1::text::timestamptz AND due_date <= $2::text::timestamptz
+      AND status NOT IN ('completed', 'cancelled')
+      AND (deadline_status IS NULL OR deadline_status = ANY($4::text[]))
+    RETURNING id, title, project_id, assigned_to, created_by, due_date
+"""
+
+
+def _to_json_value(value: Any) -> Any:
+    """Convierte tipos de asyncpg a lo que devolvería PostgREST en JSON"""
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, list):
+        return [_to_json_value(v) for v in value]
+    if asyncpg is not None and isinstance(value, asyncpg.Range):
+        # Mismo texto que PostgREST, p. ej. ["2024-01-01 00:00:00+00","2024-01-05 00:00:00+00"]
+        if value.isempty:
+            return "empty"
+        lower = f'"{value.lower.isoformat()}"' if value.lower is not None else ""
+        upper = f'"{value.upper.isoformat()}"' if value.upper is not None else ""
+        return f'{"[" if value.lower_inc else "("}{lower},{upper}{"]" if value.upper_inc else ")"}'
+    return value
+
+
+def record_to_dict(record) -> Dict[str, Any]:
+    return {key: _to_json_value(value) for key, value in record.items()}
+
+
+class DirectPostgres:
+    """Pool asyncpg opcional con las consultas calientes de la API"""
+
+    def __init__(self, dsn: Optional[str] = None, min_size: Optional[int] = None,
+                 max_size: Optional[int] = None, server_settings: Optional[Dict[str, str]] = None):
+        self.dsn = dsn if dsn is not None else os.getenv("SUPABASE_DB_URL", "")
+        self.min_size = min_size or int(os.getenv("PG_POOL_MIN_SIZE", "2"))
+        self.max_size = max_size or int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+        self.statement_cache_size = int(os.getenv("PG_STATEMENT_CACHE_SIZE", "256"))
+        self.server_settings = server_settings
+        self.pool = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.dsn) and asyncpg is not None
+
+    @property
+    def enabled(self) -> bool:
+        return self.pool is not None
+
+    async def start(self) -> None:
+        if not self.configured or self.pool is not None:
+            return
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            statement_cache_size=self.statement_cache_size,
+            server_settings=self.server_settings,
+            init=self._init_connection,
+        )
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @staticmethod
+    async def _init_connection(conn) -> None:
+        # jsonb como dict de Python, igual que en las respuestas de PostgREST
+        await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+    async def _fetch(self, operation: str, table: str, sql: str, *args) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(sql, *args)
+        finally:
+            record_db_query("postgres", operation, table, time.perf_counter() - started, sql)
+        return [record_to_dict(row) for row in rows]
+
+    async def _fetchrow(self, operation: str, table: str, sql: str, *args) -> Optional[Dict[str, Any]]:
+        rows = await self._fetch(operation, table, sql, *args)
+        return rows[0] if rows else None
+
+    async def ping(self) -> None:
+        """Consulta mínima para comprobar la conexión (sondeo de preparación)"""
+        await self._fetch("select", "", "SELECT 1")
+
+    # Consultas calientes
+    async def list_projects(self, user_id: str, columns: str = "*") -> List[Dict[str, Any]]:
+        return await self._fetch("select", "projects", LIST_PROJECTS_COLUMNS_SQL.format(columns=columns), user_id)
+
+    async def get_project(self, project_id: str) -> Optional[Dict[str, Any]]:
+        return await self._fetchrow("select", "projects", GET_PROJECT_SQL, project_id)
+
+    async def list_project_tasks(self, project_id: str, columns: str = "*") -> List[Dict[str, Any]]:
+        return await self._fetch("select", "tasks", LIST_PROJECT_TASKS_COLUMNS_SQL.format(columns=columns), project_id)
+
+    async def get_task_with_project(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Tarea con project_created_by/project_assigned_to para comprobar permisos"""
+        return await self._fetchrow("select", "tasks", GET_TASK_WITH_PROJECT_SQL, task_id)
+
+    async def comment_thread(self, task_id: Optional[str], project_id: Optional[str], limit: int,
+                             after_created_at: Optional[str] = None, after_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Filas de get_comment_thread (comentarios raíz de la página y sus respuestas)"""
+        return await self._fetch("rpc", "comments", COMMENT_THREAD_SQL,
+                                 task_id, project_id, limit, after_created_at, after_id)
+
+    async def timeline(self, p_user_id: str, p_from: str, p_to: str, p_project_id: Optional[str], p_group_by: str,
+                       p_limit: int, p_after_group: Optional[str] = None, p_after_start: Optional[str] = None,
+                       p_after_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Filas de get_timeline (mismos parámetros que la llamada RPC)"""
+        return await self._fetch("rpc", "tasks", TIMELINE_SQL, p_user_id, p_from, p_to, p_project_id, p_group_by,
+                                 p_limit, p_after_group, p_after_start, p_after_id)
+
+    async def apply_batch(self, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Filas resultantes de cada operación del lote (todo o nada)"""
+        rows = await self._fetch("rpc", "batch", APPLY_BATCH_SQL, operations)
+        return [row["row"] for row in rows]
+
+    async def changes(self, p_user_id: str, p_after_xid: str, p_after_kind: str, p_after_id: str,
+                      p_limit: int) -> Dict[str, Any]:
+        """Resultado de get_changes: {horizon, changes} (mismos parámetros que la llamada RPC)"""
+        row = await self._fetchrow("rpc", "sync", CHANGES_SQL, p_user_id, p_after_xid, p_after_kind, p_after_id, p_limit)
+        return row["result"]
+
+    async def archive_batch(self, p_limit: int, p_completed_before: str) -> Dict[str, Any]:
+        """Resultado de archive_batch: {projects, tasks} archivados en el lote"""
+        row = await self._fetchrow("rpc", "archive", ARCHIVE_BATCH_SQL, p_limit, p_completed_before)
+        return row["result"]
+
+    async def restore_archived_project(self, project_id: str) -> Optional[Dict[str, Any]]:
+        row = await self._fetchrow("rpc", "archive", RESTORE_ARCHIVED_PROJECT_SQL, project_id)
+        return row["row"]
+
+    async def restore_archived_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = await self._fetchrow("rpc", "archive", RESTORE_ARCHIVED_TASK_SQL, task_id)
+        return row["row"]
+
+    async def maintain_partitions(self, p_table: str, p_retention_months: int, p_premake_months: int) -> Dict[str, Any]:
+        """Resultado de maintain_monthly_partitions: {created, dropped} (nombres de particiones)"""
+        row = await self._fetchrow("rpc", p_table, MAINTAIN_PARTITIONS_SQL, p_table, p_retention_months, p_premake_months)
+        return row["result"]
+
+    async def search_users(self, prefix: str, limit: int) -> List[Dict[str, Any]]:
+        return await self._fetch("select", "users", SEARCH_USERS_SQL, prefix, limit)
+
+    async def workload_columns(self, start: str, end: str) -> Dict[str, Optional[list]]:
+        """Columnas de las tareas asignadas que se solapan con [start, end) (listas sin convertir)"""
+        started = time.perf_counter()
+        try:
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(WORKLOAD_COLUMNS_SQL, start, end)
+        finally:
+            record_db_query("postgres", "select", "tasks", time.perf_counter() - started, WORKLOAD_COLUMNS_SQL)
+        return dict(row)
+
+    async def _update_versioned(self, table: str, sql: str, casts: Dict[str, str], row_id: str,
+                                update_data: Dict[str, Any], user_id: str,
+                                version: Optional[int]) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        columns = [c for c in update_data if c in casts]
+        if not columns:
+            return None
+        assignments = ", ".join(f"{column} = ${index}{casts[column]}" for index, column in enumerate(columns, start=4))
+        # El texto de la sentencia depende solo de las columnas, así que también se reutiliza
+        row = await self._fetchrow("update", table, sql.format(assignments=assignments),
+                                   row_id, user_id, version, *(update_data[c] for c in columns))
+        if row is None:
+            return None
+        previous = row.pop("previous")
+        return row, previous
+
+    async def update_project(self, project_id: str, update_data: Dict[str, Any], user_id: str,
+                             version: Optional[int]) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """UPDATE del creador con la versión leída; (fila actualizada, fila anterior) o None si no modifica nada"""
+        return await self._update_versioned("projects", UPDATE_PROJECT_SQL, PROJECT_COLUMN_CASTS, project_id,
+                                            update_data, user_id, version)
+
+    async def update_task(self, task_id: str, update_data: Dict[str, Any], user_id: str,
+                          version: Optional[int]) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """UPDATE con permisos y versión leída; (fila actualizada, fila anterior) o None si no modifica nada"""
+        return await self._update_versioned("tasks", UPDATE_TASK_SQL, TASK_COLUMN_CASTS, task_id,
+                                            update_data, user_id, version)
+
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        return await self._fetchrow("upsert", "scheduler_leases", ACQUIRE_LEASE_SQL, name, owner, float(ttl)) is not None
+
+    async def flag_deadlines(self, start: str, end: str, state: str, from_states: List[str]) -> List[Dict[str, Any]]:
+        """Marca con state las tareas pendientes con due_date en (start, end]; devuelve las marcadas"""
+        return await self._fetch("update", "tasks", FLAG_DEADLINES_SQL, start, end, state, from_states)
+
+
+# Instancia global (se arranca en el evento de startup de la aplicación)
+pg = DirectPostgres()
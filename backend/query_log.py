@@ -0,0 +1,267 @@
+# Registro de consultas lentas y captura de planes para el backend SQLite
+#
+# Las conexiones de get_db (main.py) usan ProfiledConnection: cada sentencia se
+# cronometra de execute() hasta que se agota el cursor (o se cierra la
+# conexión), el progress handler de sqlite3 cuenta instrucciones de la VM como
+# medida de trabajo (un full scan dispara el contador) y el trace callback
+# cuenta las sentencias realmente ejecutadas (incluidos triggers). Las
+# sentencias que superan SLOW_QUERY_MS se registran en el log estructurado
+# "planner.slow_query" junto con su EXPLAIN QUERY PLAN.
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from metrics import TimedConnection, TimedCursor
+
+logger = logging.getLogger("planner.slow_query")
+
+# Umbral de consulta lenta en milisegundos
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# Cada cuántas instrucciones de la VM se invoca el progress handler
+PROGRESS_INTERVAL = int(os.getenv("SQLITE_PROGRESS_INTERVAL", "1000"))
+# Máximo de consultas normalizadas distintas que se conservan
+MAX_TRACKED_QUERIES = 500
+# Los planes se vuelven a capturar como mucho una vez por este intervalo (s)
+PLAN_REFRESH_SECONDS = 300
+
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """Normaliza una sentencia: literales a '?', listas IN colapsadas y espacios simples"""
+    normalized = _STRING_LITERAL.sub("?", sql)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _IN_LIST.sub("(?, ...)", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip()
+
+
+class QueryStats:
+    __slots__ = ("query", "calls", "total_seconds", "max_seconds", "slow_calls",
+                 "vm_steps", "statements", "plan", "plan_captured_at")
+
+    def __init__(self, query: str):
+        self.query = query
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.slow_calls = 0
+        self.vm_steps = 0
+        self.statements = 0
+        self.plan: Optional[List[str]] = None
+        self.plan_captured_at = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "query": self.query,
+            "calls": self.calls,
+            "total_ms": round(self.total_seconds * 1000, 3),
+            "avg_ms": round(self.total_seconds * 1000 / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "slow_calls": self.slow_calls,
+            "avg_vm_steps": self.vm_steps // self.calls if self.calls else 0,
+            "avg_statements": round(self.statements / self.calls, 2) if self.calls else 0.0,
+            "plan": self.plan,
+        }
+
+
+class QueryProfiler:
+    """Agregado por consulta normalizada de tiempos, trabajo y planes"""
+
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS):
+        self.slow_query_seconds = slow_query_ms / 1000.0
+        self._stats: Dict[str, QueryStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, conn: sqlite3.Connection, sql: str, parameters, seconds: float,
+               vm_steps: int, statements: int) -> None:
+        query = normalize_sql(sql)
+        slow = seconds >= self.slow_query_seconds
+        with self._lock:
+            stats = self._stats.get(query)
+            if stats is None:
+                if len(self._stats) >= MAX_TRACKED_QUERIES:
+                    self._evict()
+                stats = self._stats[query] = QueryStats(query)
+            stats.calls += 1
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.vm_steps += vm_steps
+            stats.statements += statements
+            if slow:
+                stats.slow_calls += 1
+            capture_plan = slow and time.monotonic() - stats.plan_captured_at > PLAN_REFRESH_SECONDS
+            if capture_plan:
+                stats.plan_captured_at = time.monotonic()
+
+        if not slow:
+            return
+        if capture_plan:
+            stats.plan = explain_query_plan(conn, sql, parameters)
+        logger.warning(json.dumps({
+            "event": "slow_query",
+            "duration_ms": round(seconds * 1000, 3),
+            "threshold_ms": self.slow_query_seconds * 1000,
+            "query": query,
+            "vm_steps": vm_steps,
+            "statements": statements,
+            "plan": stats.plan,
+        }, ensure_ascii=False))
+
+    def _evict(self) -> None:
+        # Descarta la consulta con menos tiempo acumulado
+        victim = min(self._stats.values(), key=lambda s: s.total_seconds)
+        del self._stats[victim.query]
+
+    def top(self, limit: int = 20) -> List[dict]:
+        """Consultas normalizadas ordenadas por tiempo total"""
+        with self._lock:
+            ranked = sorted(self._stats.values(), key=lambda s: s.total_seconds, reverse=True)[:limit]
+            return [s.to_dict() for s in ranked]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+profiler = QueryProfiler()
+
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str, parameters) -> Optional[List[str]]:
+    """Ejecuta EXPLAIN QUERY PLAN con los mismos parámetros y lo devuelve como árbol indentado"""
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    try:
+        rows = sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f"EXPLAIN falló: {e}"]
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+class _PendingQuery:
+    __slots__ = ("sql", "parameters", "elapsed", "steps_start", "statements_start")
+
+    def __init__(self, sql: str, parameters, steps_start: int, statements_start: int):
+        self.sql = sql
+        self.parameters = parameters
+        self.elapsed = 0.0
+        self.steps_start = steps_start
+        self.statements_start = statements_start
+
+
+class ProfiledCursor(TimedCursor):
+    """Cursor que cronometra cada sentencia (execute, executemany, executescript) hasta agotar sus filas"""
+
+    _pending: Optional[_PendingQuery] = None
+
+    def execute(self, sql, parameters=()):
+        return self._profiled(super().execute, sql, parameters, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # El plan se captura con el primer juego de parámetros
+        seq_of_parameters = list(seq_of_parameters)
+        first = seq_of_parameters[0] if seq_of_parameters else ()
+        return self._profiled(super().executemany, sql, first, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._profiled(super().executescript, sql_script, ())
+
+    def _profiled(self, method, sql, parameters, *args):
+        self._finish()
+        conn = self.connection
+        pending = self._pending = _PendingQuery(sql, parameters, conn.vm_steps, conn.traced_statements)
+        started = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            pending.elapsed += time.perf_counter() - started
+            if self.description is None:
+                # Sin columnas de resultado (INSERT/UPDATE/DELETE): la sentencia ya terminó
+                self._finish()
+            else:
+                conn.pending_cursors.add(self)
+
+    def _timed_fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        if self._pending is not None:
+            self._pending.elapsed += time.perf_counter() - started
+        return result
+
+    def fetchone(self):
+        row = self._timed_fetch(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed_fetch(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(super().fetchall)
+        self._finish()
+        return rows
+
+    def _finish(self) -> None:
+        pending = self._pending
+        if pending is None:
+            return
+        self._pending = None
+        conn = self.connection
+        conn.pending_cursors.discard(self)
+        profiler.record(
+            conn, pending.sql, pending.parameters, pending.elapsed,
+            (conn.vm_steps - pending.steps_start) * PROGRESS_INTERVAL,
+            conn.traced_statements - pending.statements_start,
+        )
+
+
+class ProfiledConnection(TimedConnection):
+    """Conexión SQLite con métricas, perfilado por sentencia y captura de planes lentos"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.vm_steps = 0
+        self.traced_statements = 0
+        self.pending_cursors = set()
+        self.set_progress_handler(self._on_progress, PROGRESS_INTERVAL)
+        self.set_trace_callback(self._on_trace)
+
+    def _on_progress(self) -> int:
+        self.vm_steps += 1
+        return 0
+
+    def _on_trace(self, statement: str) -> None:
+        self.traced_statements += 1
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def executescript(self, sql_script):
+        # sqlite3.Connection.executescript usa un cursor propio que no pasa por cursor()
+        return self.cursor().executescript(sql_script)
+
+    def close(self):
+        # Las sentencias cuyo cursor no se agotó se cierran aquí
+        for cursor in list(self.pending_cursors):
+            cursor._finish()
+        super().close()
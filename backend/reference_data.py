@@ -0,0 +1,127 @@
+# Datos de referencia en memoria: categorías y directorio de usuarios
+#
+# GET /categories y GET /users/directory devuelven listas pequeñas que casi
+# nunca cambian y que el frontend pide en cada pantalla (nombres de categoría y
+# de responsables). Cada worker las carga al arrancar y guarda una instantánea
+# con el JSON ya codificado y su ETag fuerte, así que servirlas no consulta la
+# base de datos y una petición con If-None-Match recibe 304 sin cuerpo.
+#
+# Una instantánea se recarga cuando alguien publica un cambio en el bus de
+# invalidación (p. ej. al registrar un usuario, en todos los workers) o cuando
+# supera TTL_SECONDS, que acota lo que tarda en verse un cambio hecho fuera de
+# la API (SQL, panel de Supabase). Si la recarga falla se sigue sirviendo la
+# instantánea anterior, sin esperar ni reintentar, durante RETRY_SECONDS.
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
+
+from etags import content_etag, etag_matches
+from invalidation import InvalidationBus
+from metrics import record_cache_access
+from serializers import dumps
+
+logger = logging.getLogger("planner.reference_data")
+
+# Validez máxima de una instantánea (s)
+TTL_SECONDS = float(os.getenv("REFERENCE_DATA_TTL", "300"))
+# Espera tras una recarga fallida antes de volver a intentarla (s)
+RETRY_SECONDS = float(os.getenv("REFERENCE_DATA_RETRY", "30"))
+
+
+class Snapshot:
+    """Filas cargadas, índice por id y respuesta JSON ya codificada (de public si se indica)"""
+
+    def __init__(self, rows: List[dict], public: Optional[List[dict]] = None):
+        self.rows = rows
+        self.by_id: Dict[Any, dict] = {row["id"]: row for row in rows}
+        self.body = dumps(rows if public is None else public)
+        self.etag = content_etag(self.body)
+        self.loaded_at = time.monotonic()
+
+    def response(self, if_none_match: Optional[str] = None) -> Response:
+        # private: la respuesta depende del token; no-cache: el cliente revalida con el ETag
+        headers = {"ETag": self.etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(if_none_match, self.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+
+class ReferenceData:
+    """Instantánea en memoria de una tabla de referencia, invalidada por el bus o por TTL
+
+    Args:
+        name: Nombre (tema del bus y etiqueta de las métricas)
+        load: Función que devuelve las filas (síncrona, se ejecuta en el pool de hilos)
+        bus: Bus de invalidación del proceso
+        ttl: Validez máxima de la instantánea (s)
+        snapshot: Clase de la instantánea (una subclase de Snapshot puede añadir índices)
+        retry: Espera tras una recarga fallida, sirviendo la instantánea anterior (s)
+    """
+
+    def __init__(self, name: str, load: Callable[[], List[dict]], bus: InvalidationBus,
+                 ttl: float = TTL_SECONDS, snapshot: Callable[[List[dict]], Snapshot] = Snapshot,
+                 retry: float = RETRY_SECONDS):
+        self.name = name
+        self.load = load
+        self.bus = bus
+        self.ttl = ttl
+        self.snapshot = snapshot
+        self.retry = retry
+        self._snapshot: Optional[Snapshot] = None
+        self._retry_at = 0.0
+        self._generation = 0
+        self._loaded_generation = -1
+        self._lock = asyncio.Lock()
+        bus.subscribe(name, self._invalidated)
+
+    def _invalidated(self, key: Optional[str]) -> None:
+        self._generation += 1
+
+    def _fresh(self) -> bool:
+        snapshot = self._snapshot
+        return (snapshot is not None and self._loaded_generation == self._generation
+                and time.monotonic() - snapshot.loaded_at < self.ttl)
+
+    def _backing_off(self) -> bool:
+        # Tras un fallo se sirve la instantánea anterior hasta _retry_at
+        return self._snapshot is not None and time.monotonic() < self._retry_at
+
+    async def refresh(self) -> Snapshot:
+        """Recarga la instantánea (una sola carga aunque lleguen varias peticiones a la vez)"""
+        async with self._lock:
+            # Las peticiones que esperaban a una carga fallida no la reintentan
+            if self._fresh() or self._backing_off():
+                return self._snapshot
+            generation = self._generation
+            try:
+                # La instantánea (JSON, índices) también se construye fuera del bucle de eventos
+                self._snapshot = await run_in_threadpool(lambda: self.snapshot(self.load()))
+            except Exception:
+                if self._snapshot is None:
+                    raise
+                self._retry_at = time.monotonic() + self.retry
+                logger.warning("No se pudo recargar %s; se sirve la versión anterior durante %.0f s",
+                               self.name, self.retry, exc_info=True)
+                return self._snapshot
+            self._retry_at = 0.0
+            # Una invalidación publicada durante la carga obliga a recargar otra vez
+            self._loaded_generation = generation
+            return self._snapshot
+
+    async def get(self) -> Snapshot:
+        """Instantánea vigente (solo consulta la base de datos tras un cambio o al caducar)"""
+        self.bus.sync()
+        fresh = self._fresh()
+        record_cache_access(self.name, fresh)
+        if fresh or self._backing_off():
+            return self._snapshot
+        return await self.refresh()
+
+    def invalidate(self) -> None:
+        """Marca la instantánea como antigua en este worker y en los demás"""
+        self.bus.publish(self.name)
@@ -0,0 +1,235 @@
+# Planificador de tareas periódicas con un único líder entre workers
+#
+# Cada worker ejecuta el mismo Scheduler, pero un trabajo solo corre en el
+# worker que posee su lease: una fila (name, owner, expires_at) que se toma
+# con un upsert condicional y se renueva en cada ejecución. Si el líder cae,
+# otro worker la toma cuando caduca (ttl, por defecto tres intervalos). Los
+# intervalos llevan jitter para que los workers no compitan a la vez. La fila
+# del lease guarda además el estado del trabajo (p. ej. hasta dónde llegó el
+# último barrido), que solo puede escribir quien posee el lease.
+#
+# - SqliteLeaseStore: tabla scheduler_leases del fichero SQLite (main.py).
+# - SupabaseLeaseStore: tabla scheduler_leases de supabase_schema.sql, con
+#   conexión directa a Postgres si está disponible y, si no, vía PostgREST (la
+#   toma del lease es la función acquire_scheduler_lease, que solo puede
+#   ejecutar la service role: el cliente tiene que ser el administrativo).
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import registry
+
+logger = logging.getLogger("planner.scheduler")
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() != "false"
+
+scheduler_runs = registry.counter(
+    "planner_scheduler_runs_total", "Ejecuciones de trabajos periódicos por resultado", ("job", "result"),
+)
+scheduler_duration = registry.histogram(
+    "planner_scheduler_run_seconds", "Duración de cada ejecución de un trabajo periódico", ("job",),
+)
+
+
+def default_owner() -> str:
+    """Identificador único de este worker"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class SqliteLeaseStore:
+    """Leases en la tabla scheduler_leases de SQLite
+
+    Args:
+        connect: Context manager que devuelve una conexión (get_db de main.py)
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+
+    def _acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self.connect() as conn:
+            # El UPSERT solo modifica la fila si el lease es nuestro o ha caducado
+            cursor = conn.execute(
+                """
+                INSERT INTO scheduler_leases (name, owner, expiresAt) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expiresAt = excluded.expiresAt
+                WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.expiresAt < ?
+                """,
+                (name, owner, now + ttl, now),
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def _release(self, name: str, owner: str) -> None:
+        with self.connect() as conn:
+            conn.execute("UPDATE scheduler_leases SET expiresAt = 0 WHERE name = ? AND owner = ?", (name, owner))
+            conn.commit()
+
+    def _load_state(self, name: str) -> Optional[str]:
+        with self.connect() as conn:
+            row = conn.execute("SELECT state FROM scheduler_leases WHERE name = ?", (name,)).fetchone()
+            return row[0] if row else None
+
+    def _save_state(self, name: str, owner: str, state: str) -> bool:
+        with self.connect() as conn:
+            cursor = conn.execute(
+                "UPDATE scheduler_leases SET state = ? WHERE name = ? AND owner = ?", (state, name, owner)
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        return await run_in_threadpool(self._acquire, name, owner, ttl)
+
+    async def release(self, name: str, owner: str) -> None:
+        await run_in_threadpool(self._release, name, owner)
+
+    async def load_state(self, name: str) -> Optional[str]:
+        return await run_in_threadpool(self._load_state, name)
+
+    async def save_state(self, name: str, owner: str, state: str) -> bool:
+        return await run_in_threadpool(self._save_state, name, owner, state)
+
+
+class SupabaseLeaseStore:
+    """Leases en la tabla scheduler_leases de Postgres (conexión directa o PostgREST)
+
+    client tiene que ser el cliente de la service role: la tabla no tiene
+    políticas RLS y acquire_scheduler_lease no se puede ejecutar con otra clave.
+    """
+
+    def __init__(self, client, pg):
+        self.client = client
+        self.pg = pg
+
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        if self.pg.enabled:
+            return await self.pg.acquire_lease(name, owner, ttl)
+        result = await run_in_threadpool(
+            lambda: self.client.rpc("acquire_scheduler_lease", {
+                "p_name": name, "p_owner": owner, "p_ttl_seconds": ttl,
+            }).execute()
+        )
+        return bool(result.data)
+
+    async def release(self, name: str, owner: str) -> None:
+        await run_in_threadpool(
+            lambda: self.client.table("scheduler_leases").update({"expires_at": "1970-01-01T00:00:00+00:00"})
+            .eq("name", name).eq("owner", owner).execute()
+        )
+
+    async def load_state(self, name: str) -> Optional[str]:
+        result = await run_in_threadpool(
+            lambda: self.client.table("scheduler_leases").select("state").eq("name", name).execute()
+        )
+        return result.data[0]["state"] if result.data else None
+
+    async def save_state(self, name: str, owner: str, state: str) -> bool:
+        result = await run_in_threadpool(
+            lambda: self.client.table("scheduler_leases").update({"state": state})
+            .eq("name", name).eq("owner", owner).execute()
+        )
+        return bool(result.data)
+
+
+@dataclass
+class Job:
+    name: str
+    interval: float
+    func: Callable[["JobContext"], Awaitable[Any]]
+    jitter: float
+    ttl: float
+
+
+class JobContext:
+    """Acceso al estado persistente del trabajo durante una ejecución"""
+
+    def __init__(self, store, job: Job, owner: str):
+        self.store = store
+        self.job = job
+        self.owner = owner
+
+    async def load_state(self) -> Optional[str]:
+        return await self.store.load_state(self.job.name)
+
+    async def save_state(self, state: str) -> bool:
+        """Guarda el estado; False si el lease ya no es de este worker"""
+        return await self.store.save_state(self.job.name, self.owner, state)
+
+
+class Scheduler:
+    """Ejecuta trabajos periódicos en el worker que posee el lease de cada uno"""
+
+    def __init__(self, store, owner: Optional[str] = None):
+        self.store = store
+        self.owner = owner or default_owner()
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def add_job(self, name: str, interval: float, func: Callable[[JobContext], Awaitable[Any]],
+                jitter: float = 0.1, ttl: Optional[float] = None) -> None:
+        """Registra un trabajo cada interval segundos (±jitter, en fracción del intervalo)"""
+        self.jobs[name] = Job(name, interval, func, jitter, ttl or interval * 3)
+
+    def _delay(self, job: Job) -> float:
+        return job.interval * random.uniform(1 - job.jitter, 1 + job.jitter)
+
+    async def run_once(self, name: str) -> bool:
+        """Ejecuta el trabajo si este worker obtiene su lease; devuelve si se ejecutó"""
+        job = self.jobs[name]
+        if not await self.store.acquire(job.name, self.owner, job.ttl):
+            scheduler_runs.inc((job.name, "skipped"))
+            return False
+        started = time.perf_counter()
+        try:
+            await job.func(JobContext(self.store, job, self.owner))
+            scheduler_runs.inc((job.name, "ok"))
+        except Exception:
+            scheduler_runs.inc((job.name, "failed"))
+            logger.exception("Error en el trabajo periódico %s", job.name)
+        finally:
+            scheduler_duration.observe((job.name,), time.perf_counter() - started)
+        return True
+
+    async def _loop(self, job: Job) -> None:
+        # Primera ejecución a un punto aleatorio del intervalo para repartir los workers
+        await asyncio.sleep(random.uniform(0, job.interval * job.jitter))
+        while True:
+            try:
+                await self.run_once(job.name)
+            except Exception:
+                # Fallo al tomar el lease (base de datos no disponible): se reintenta en el siguiente ciclo
+                scheduler_runs.inc((job.name, "failed"))
+                logger.exception("No se pudo obtener el lease de %s", job.name)
+            await asyncio.sleep(self._delay(job))
+
+    def start(self) -> None:
+        if self._tasks or not SCHEDULER_ENABLED:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._loop(job)) for job in self.jobs.values()]
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        # Libera los leases para que otro worker tome el relevo sin esperar al ttl
+        for job in self.jobs.values():
+            try:
+                await self.store.release(job.name, self.owner)
+            except Exception:
+                logger.exception("No se pudo liberar el lease de %s", job.name)
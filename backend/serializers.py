@@ -0,0 +1,122 @@
+# Serialización de filas a JSON para las respuestas de proyectos y tareas
+#
+# format_*_for_response construía un dict con una llamada a .get() por campo
+# y FastAPI lo volvía a recorrer con jsonable_encoder antes de codificarlo.
+# Aquí la correspondencia columna -> campo y los valores por defecto se
+# compilan una vez por esquema y por selección de campos (?fields=) en una
+# función generada, y la lista entera se codifica de una vez a bytes con
+# orjson (json de la biblioteca estándar si no está instalado), que se
+# devuelven tal cual en la respuesta. Cuando la consulta ya devuelve las
+# columnas exactas de la respuesta (select con ?fields=) las filas se
+# codifican directamente, sin dicts intermedios.
+import json
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Sequence, Tuple
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    # Tipos que no son JSON nativo (p. ej. columnas DECIMAL): como en jsonable_encoder
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def dumps(data: Any) -> bytes:
+    """JSON compacto en bytes"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def json_response(content: bytes, status_code: int = 200) -> Response:
+    return Response(content=content, status_code=status_code, media_type="application/json")
+
+
+def _compile(name: str, source: str) -> Callable:
+    namespace: Dict[str, Any] = {}
+    exec(compile(source, f"<serializer {name}>", "exec"), namespace)
+    return namespace["format_row"]
+
+
+class RowSerializer:
+    """Campos de respuesta (nombre, valor por defecto) con formateadores compilados por selección"""
+
+    def __init__(self, name: str, fields: Sequence[Tuple[str, Any]]):
+        self.name = name
+        self.names = tuple(field for field, _ in fields)
+        self.defaults = dict(fields)
+        self._formatters: Dict[Optional[Tuple[str, ...]], Callable[[Mapping], dict]] = {}
+
+    def formatter(self, fields: Optional[Tuple[str, ...]] = None) -> Callable[[Mapping], dict]:
+        """Función fila -> dict de respuesta para los campos pedidos (None = todos)"""
+        formatter = self._formatters.get(fields)
+        if formatter is None:
+            entries = []
+            for field in fields or self.names:
+                default = self.defaults[field]
+                # Los valores por defecto son literales: repr() crea una lista nueva en cada llamada
+                value = f"get({field!r})" if default is None else f"get({field!r}, {default!r})"
+                entries.append(f"{field!r}: {value}")
+            source = "def format_row(row):\n    get = row.get\n    return {" + ", ".join(entries) + "}\n"
+            formatter = self._formatters[fields] = _compile(self.name, source)
+        return formatter
+
+    def format(self, row: Optional[Mapping], fields: Optional[Tuple[str, ...]] = None) -> dict:
+        if not row:
+            return {}
+        return self.formatter(fields)(row)
+
+    def encode(self, rows: Iterable[Mapping], fields: Optional[Tuple[str, ...]] = None,
+               projected: bool = False) -> bytes:
+        """Lista JSON de las filas; projected indica que ya traen exactamente las columnas de fields"""
+        if projected and fields is not None:
+            return dumps(rows if isinstance(rows, list) else list(rows))
+        format_row = self.formatter(fields)
+        return dumps([format_row(row) for row in rows])
+
+    def response(self, rows: Iterable[Mapping], fields: Optional[Tuple[str, ...]] = None,
+                 projected: bool = False) -> Response:
+        return json_response(self.encode(rows, fields, projected))
+
+
+# Campos y valores por defecto de las respuestas de main_supabase.py
+PROJECT_SERIALIZER = RowSerializer("project", (
+    ("id", None), ("name", None), ("description", None), ("start_date", None), ("end_date", None),
+    ("priority", "medium"), ("status", "planning"), ("progress", 0), ("budget", None), ("category_id", None),
+    ("created_by", None), ("assigned_to", []), ("tags", []), ("is_archived", False), ("comment_count", 0),
+    ("created_at", None), ("updated_at", None), ("version", 1),
+))
+TASK_SERIALIZER = RowSerializer("task", (
+    ("id", None), ("title", None), ("description", None), ("project_id", None), ("parent_task_id", None),
+    ("assigned_to", None), ("priority", "medium"), ("status", "todo"), ("progress", 0), ("due_date", None),
+    ("start_date", None), ("completed_date", None), ("estimated_hours", None), ("actual_hours", None),
+    ("tags", []), ("dependencies", []), ("comment_count", 0), ("deadline_status", None), ("created_by", None),
+    ("created_at", None), ("updated_at", None), ("version", 1),
+))
+
+
+# SQLite (main.py): las filas se leen como tuplas y se convierten según las columnas del cursor
+_tuple_formatters: Dict[Tuple[str, ...], Callable[[Sequence], dict]] = {}
+
+
+def _tuple_formatter(columns: Tuple[str, ...]) -> Callable[[Sequence], dict]:
+    formatter = _tuple_formatters.get(columns)
+    if formatter is None:
+        entries = ", ".join(f"{column!r}: row[{index}]" for index, column in enumerate(columns))
+        source = f"def format_row(row):\n    return {{{entries}}}\n"
+        formatter = _tuple_formatters[columns] = _compile("sqlite", source)
+    return formatter
+
+
+def sqlite_response(cursor) -> Response:
+    """Respuesta JSON con todas las filas del cursor (las columnas de la consulta son las claves)"""
+    cursor.row_factory = None  # tuplas en lugar de sqlite3.Row
+    format_row = _tuple_formatter(tuple(column[0] for column in cursor.description))
+    return json_response(dumps([format_row(row) for row in cursor.fetchall()]))
@@ -0,0 +1,251 @@
+# Almacenamiento de archivos adjuntos (backend Supabase)
+#
+# Las subidas llegan como un flujo de fragmentos (cuerpo de la petición, con o
+# sin Transfer-Encoding: chunked) que se escribe en un fichero temporal a la vez
+# que se calcula su SHA-256, así que nunca se guarda el archivo entero en
+# memoria. El hash identifica el contenido: dos subidas iguales comparten el
+# mismo objeto almacenado.
+#
+# Como el objeto es compartido, la subida lo publica solo después de registrar
+# su fila (upload(): el cuerpo del with inserta la fila) y el borrado
+# (delete_unreferenced) lo aparta primero a una clave temporal, vuelve a
+# comprobar las referencias y lo devuelve a su sitio si una subida del mismo
+# contenido registró su fila mientras tanto. Así una subida concurrente nunca
+# queda apuntando a un objeto borrado, sin locks entre workers.
+#
+# - LocalFileStorage (por defecto): guarda los objetos en STORAGE_ROOT con la
+#   ruta sha256/ab/cd/<hash>. Las descargas admiten Range y usan
+#   http.response.pathsend o http.response.zerocopysend si el servidor ASGI los
+#   ofrece; si no, se leen por bloques de tamaño fijo.
+# - SupabaseStorage (STORAGE_BACKEND=supabase): sube el fichero temporal a un
+#   bucket de Supabase Storage y las descargas redirigen a una URL firmada. Con
+#   el sustituto en memoria (SUPABASE_URL=memory://...) se usa LocalFileStorage.
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable
+
+import anyio
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.responses import FileResponse, RedirectResponse, Response
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger("planner.storage")
+
+# Tamaño máximo de un adjunto (bytes)
+MAX_UPLOAD_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Bloque de lectura de las descargas sin envío directo desde el fichero
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# Validez de las URLs firmadas de Supabase Storage (segundos)
+SIGNED_URL_SECONDS = int(os.getenv("STORAGE_SIGNED_URL_SECONDS", "300"))
+
+
+class UploadTooLarge(Exception):
+    """El cuerpo de la subida supera el tamaño máximo permitido"""
+
+
+@dataclass
+class StoredObject:
+    key: str
+    size: int
+    sha256: str
+
+
+def object_key(digest: str) -> str:
+    """Ruta del objeto a partir del hash de su contenido"""
+    return f"sha256/{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+async def spool_to_file(chunks: AsyncIterator[bytes], path: str, max_bytes: int) -> StoredObject:
+    """Escribe los fragmentos en path calculando el SHA-256; UploadTooLarge si se pasa de max_bytes"""
+    digest = hashlib.sha256()
+    size = 0
+    async with await anyio.open_file(path, "wb") as f:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge()
+            digest.update(chunk)
+            await f.write(chunk)
+    sha256 = digest.hexdigest()
+    return StoredObject(object_key(sha256), size, sha256)
+
+
+class ZeroCopyFileResponse(FileResponse):
+    """FileResponse que envía el fichero (o el rango pedido) sin copiarlo por Python
+
+    FileResponse ya usa http.response.pathsend para el fichero completo. Con
+    http.response.zerocopysend también se envían así los rangos; sin ninguna de
+    las dos extensiones se mantiene la lectura por bloques.
+    """
+
+    chunk_size = DOWNLOAD_CHUNK_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self._zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    async def _zerocopy_send(self, send: Send, offset: int, count: int) -> None:
+        with open(self.path, "rb") as f:
+            await send({"type": "http.response.zerocopysend", "file": f, "offset": offset,
+                        "count": count, "more_body": False})
+
+    async def _handle_simple(self, send: Send, send_header_only: bool, send_pathsend: bool) -> None:
+        if send_header_only or send_pathsend or not self._zerocopy:
+            return await super()._handle_simple(send, send_header_only, send_pathsend)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await self._zerocopy_send(send, 0, self.stat_result.st_size)
+
+    async def _handle_single_range(self, send: Send, start: int, end: int, file_size: int,
+                                   send_header_only: bool) -> None:
+        if send_header_only or not self._zerocopy:
+            return await super()._handle_single_range(send, start, end, file_size, send_header_only)
+        headers = MutableHeaders(raw=list(self.raw_headers))
+        headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": headers.raw})
+        await self._zerocopy_send(send, start, end - start)
+
+
+class LocalFileStorage:
+    """Objetos direccionados por contenido en un directorio local"""
+
+    name = "local"
+
+    def __init__(self, root: str, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        # Los temporales quedan en el mismo sistema de ficheros para que os.replace sea
+        # atómico. Los directorios se crean al escribir, no al importar la aplicación.
+        self.tmp_dir = os.path.join(self.root, "tmp")
+
+    def path_for(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError("Clave de almacenamiento inválida")
+        return path
+
+    def url_for(self, key: str) -> str:
+        return f"local://{key}"
+
+    @asynccontextmanager
+    async def upload(self, chunks: AsyncIterator[bytes], content_type: str) -> AsyncIterator[StoredObject]:
+        """Guarda la subida en un temporal y la publica al salir del with sin errores"""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, prefix="upload-")
+        os.close(fd)
+        try:
+            stored = await spool_to_file(chunks, tmp_path, self.max_bytes)
+            yield stored
+            # Si el contenido ya estaba almacenado se sustituye por la copia idéntica
+            path = self.path_for(stored.key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def delete_unreferenced(self, key: str, referenced: Callable[[], Awaitable[bool]]) -> bool:
+        """Borra el objeto si referenced() sigue siendo False tras apartarlo; devuelve si se borró"""
+        if await referenced():
+            return False
+        path = self.path_for(key)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        trash = os.path.join(self.tmp_dir, f"delete-{uuid.uuid4().hex}")
+        try:
+            os.replace(path, trash)
+        except FileNotFoundError:
+            return False
+        try:
+            if await referenced():
+                # Una subida del mismo contenido se registró entre las dos comprobaciones
+                os.replace(trash, path)
+                return False
+            return True
+        finally:
+            if os.path.exists(trash):
+                os.remove(trash)
+
+    async def download_response(self, key: str, filename: str, mime_type: str) -> Response:
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(key)
+        return ZeroCopyFileResponse(path, media_type=mime_type, filename=filename,
+                                    headers={"Cache-Control": "private, max-age=0"})
+
+
+class SupabaseStorage:
+    """Adaptador a un bucket de Supabase Storage"""
+
+    name = "supabase"
+
+    def __init__(self, client, bucket: str, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.client = client
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+
+    def url_for(self, key: str) -> str:
+        return f"{self.client.supabase_url}/storage/v1/object/{self.bucket}/{key}"
+
+    @asynccontextmanager
+    async def upload(self, chunks: AsyncIterator[bytes], content_type: str) -> AsyncIterator[StoredObject]:
+        """Guarda la subida en un temporal y la sube al bucket al salir del with sin errores"""
+        fd, tmp_path = tempfile.mkstemp(prefix="planner-upload-")
+        os.close(fd)
+        try:
+            stored = await spool_to_file(chunks, tmp_path, self.max_bytes)
+            yield stored
+            # storage3 envía el fichero por bloques desde disco; upsert porque un
+            # contenido igual ya subido ocupa la misma clave
+            await run_in_threadpool(
+                lambda: self.client.storage.from_(self.bucket).upload(
+                    stored.key, tmp_path, {"content-type": content_type, "upsert": "true"})
+            )
+        finally:
+            os.remove(tmp_path)
+
+    async def delete_unreferenced(self, key: str, referenced: Callable[[], Awaitable[bool]]) -> bool:
+        """Borra el objeto si referenced() sigue siendo False tras apartarlo; devuelve si se borró"""
+        if await referenced():
+            return False
+        bucket = self.client.storage.from_(self.bucket)
+        trash = f"trash/{uuid.uuid4().hex}"
+        try:
+            await run_in_threadpool(lambda: bucket.move(key, trash))
+        except Exception:
+            logger.warning("No se pudo apartar el objeto %s para borrarlo", key, exc_info=True)
+            return False
+        if await referenced():
+            try:
+                await run_in_threadpool(lambda: bucket.move(trash, key))
+            except Exception:
+                # La subida concurrente ya volvió a subir el objeto a su clave
+                await run_in_threadpool(lambda: bucket.remove([trash]))
+            return False
+        await run_in_threadpool(lambda: bucket.remove([trash]))
+        return True
+
+    async def download_response(self, key: str, filename: str, mime_type: str) -> Response:
+        # Supabase Storage sirve el archivo (Range incluido) sin pasar por este servidor
+        signed = await run_in_threadpool(
+            lambda: self.client.storage.from_(self.bucket).create_signed_url(
+                key, SIGNED_URL_SECONDS, {"download": filename})
+        )
+        return RedirectResponse(signed["signedURL"], status_code=307)
+
+
+def storage_from_env(client, default_root: str = "attachments"):
+    """Backend de almacenamiento según STORAGE_BACKEND (local por defecto)"""
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "supabase" and not os.getenv("SUPABASE_URL", "").startswith("memory://"):
+        return SupabaseStorage(client, os.getenv("STORAGE_BUCKET", "attachments"))
+    if backend not in ("local", "supabase"):
+        logger.warning("STORAGE_BACKEND=%s desconocido; se usa almacenamiento local", backend)
+    return LocalFileStorage(os.getenv("STORAGE_ROOT", default_root))
@@ -1,7 +1,22 @@
 # Configuración de Supabase para Project Planner
+#
+# Los clientes se crean en el primer uso, no al importar el módulo: importar la
+# aplicación no lee credenciales ni abre conexiones. Cada proceso tiene un único
+# cliente anónimo y uno con la service role key, y ambos comparten un pool de
+# conexiones HTTP (las cabeceras de autenticación van en cada petición). Con
+# varios workers (preload_app) cada proceso crea los suyos tras el fork.
 import os
-from supabase import create_client, Client
-from typing import Optional
+import threading
+import time
+from supabase import create_client, Client, ClientOptions
+from typing import Dict, Optional
+import httpx
+from metrics import instrument_supabase
+from serializers import PROJECT_SERIALIZER, TASK_SERIALIZER
+
+# Conexiones HTTP máximas del pool compartido y tiempo máximo por petición (s)
+HTTP_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("SUPABASE_HTTP_TIMEOUT", "120"))
 
 class SupabaseConfig:
     def __init__(self):
@@ -9,37 +24,100 @@ class SupabaseConfig:
         # Intentar ambos nombres de variable para compatibilidad
         self.key: str = os.getenv('SUPABASE_ANON_KEY', '') or os.getenv('SUPABASE_KEY', '')
         self.service_role_key: str = os.getenv('SUPABASE_SERVICE_ROLE_KEY', '')
-        
+        self._clients: Dict[bool, Client] = {}
+        self._http_client: Optional[httpx.Client] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def validate(self) -> None:
         if not self.url or not self.key:
             raise ValueError(
                 "SUPABASE_URL y SUPABASE_ANON_KEY (o SUPABASE_KEY) son requeridos. "
                 "Por favor configúralos en las variables de entorno."
             )
-    
+
+    def _create_client(self, use_service_role: bool) -> Client:
+        # SUPABASE_URL=memory://<nombre> usa el sustituto local en memoria (benchmarks y pruebas)
+        if self.url.startswith("memory://"):
+            from supabase_local import get_local_client
+            return get_local_client(self.url)
+
+        if self._http_client is None:
+            self._http_client = httpx.Client(
+                timeout=HTTP_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                    max_keepalive_connections=HTTP_MAX_CONNECTIONS),
+                follow_redirects=True,
+                http2=True,
+            )
+        key = self.service_role_key if use_service_role and self.service_role_key else self.key
+        return create_client(self.url, key, options=ClientOptions(httpx_client=self._http_client))
+
     def get_client(self, use_service_role: bool = False) -> Client:
-        """Obtiene el cliente de Supabase
+        """Obtiene el cliente de Supabase del proceso (se crea en la primera llamada)
         
         Args:
             use_service_role: Si True, usa la service role key para operaciones administrativas
         
         Returns:
-            Cliente de Supabase configurado
+            Cliente de Supabase configurado e instrumentado
         """
-        key = self.service_role_key if use_service_role and self.service_role_key else self.key
-        return create_client(self.url, key)
+        client = self._clients.get(use_service_role) if self._pid == os.getpid() else None
+        if client is not None:
+            return client
+        with self._lock:
+            if self._pid != os.getpid():
+                # Tras un fork no se reutilizan las conexiones del proceso padre
+                self._clients = {}
+                self._http_client = None
+                self._pid = os.getpid()
+            if use_service_role not in self._clients:
+                self.validate()
+                self._clients[use_service_role] = instrument_supabase(self._create_client(use_service_role))
+            return self._clients[use_service_role]
+
+    def warm_up(self) -> None:
+        """Crea los clientes y abre una conexión con una consulta mínima"""
+        self.get_client(use_service_role=True)
+        self.ping()
+
+    def ping(self) -> float:
+        """Latencia de una consulta mínima contra Supabase (s)"""
+        started = time.perf_counter()
+        self.get_client().table("categories").select("id").limit(1).execute()
+        return time.perf_counter() - started
+
+    def close(self) -> None:
+        """Cierra el pool de conexiones HTTP del proceso"""
+        with self._lock:
+            if self._http_client is not None and self._pid == os.getpid():
+                self._http_client.close()
+            self._clients = {}
+            self._http_client = None
+
+class LazyClient:
+    """Delegado del cliente del proceso: se resuelve en cada acceso, no al importar"""
+
+    def __init__(self, use_service_role: bool = False):
+        self._use_service_role = use_service_role
+
+    def __getattr__(self, name):
+        return getattr(supabase_config.get_client(self._use_service_role), name)
 
 # Instancia global de configuración
 supabase_config = SupabaseConfig()
 
 # Cliente principal (con anon key)
-supabase: Client = supabase_config.get_client()
+supabase: Client = LazyClient()
+
+# Cliente administrativo (con service role key si está configurada) - solo para operaciones que lo requieran
+admin_supabase: Client = LazyClient(use_service_role=True)
 
-# Cliente administrativo (con service role key) - solo para operaciones que lo requieran
 def get_admin_client() -> Optional[Client]:
     """Obtiene cliente administrativo si está configurado"""
     try:
         return supabase_config.get_client(use_service_role=True)
-    except:
+    except Exception:
         return None
 
 # Funciones de utilidad para la base de datos
@@ -73,55 +151,31 @@ class DatabaseUtils:
     
     @staticmethod
     def format_project_for_response(project_data: dict) -> dict:
-        """Formatea los datos del proyecto para la respuesta de la API"""
-        if not project_data:
-            return {}
-        
-        return {
-            "id": project_data.get("id"),
-            "name": project_data.get("name"),
-            "description": project_data.get("description"),
-            "start_date": project_data.get("start_date"),
-            "end_date": project_data.get("end_date"),
-            "priority": project_data.get("priority", "medium"),
-            "status": project_data.get("status", "planning"),
-            "progress": project_data.get("progress", 0),
-            "budget": project_data.get("budget"),
-            "category_id": project_data.get("category_id"),
-            "created_by": project_data.get("created_by"),
-            "assigned_to": project_data.get("assigned_to", []),
-            "tags": project_data.get("tags", []),
-            "is_archived": project_data.get("is_archived", False),
-            "created_at": project_data.get("created_at"),
-            "updated_at": project_data.get("updated_at")
-        }
+        """Formatea los datos del proyecto para la respuesta de la API (ver serializers.py)"""
+        return PROJECT_SERIALIZER.format(project_data)
     
     @staticmethod
     def format_task_for_response(task_data: dict) -> dict:
-        """Formatea los datos de la tarea para la respuesta de la API"""
-        if not task_data:
+        """Formatea los datos de la tarea para la respuesta de la API (ver serializers.py)"""
+        return TASK_SERIALIZER.format(task_data)
+    
+    @staticmethod
+    def format_attachment_for_response(attachment_data: dict) -> dict:
+        """Formatea los datos del adjunto para la respuesta de la API"""
+        if not attachment_data:
             return {}
         
         return {
-            "id": task_data.get("id"),
-            "title": task_data.get("title"),
-            "description": task_data.get("description"),
-            "project_id": task_data.get("project_id"),
-            "parent_task_id": task_data.get("parent_task_id"),
-            "assigned_to": task_data.get("assigned_to"),
-            "priority": task_data.get("priority", "medium"),
-            "status": task_data.get("status", "todo"),
-            "progress": task_data.get("progress", 0),
-            "due_date": task_data.get("due_date"),
-            "start_date": task_data.get("start_date"),
-            "completed_date": task_data.get("completed_date"),
-            "estimated_hours": task_data.get("estimated_hours"),
-            "actual_hours": task_data.get("actual_hours"),
-            "tags": task_data.get("tags", []),
-            "dependencies": task_data.get("dependencies", []),
-            "created_by": task_data.get("created_by"),
-            "created_at": task_data.get("created_at"),
-            "updated_at": task_data.get("updated_at")
+            "id": attachment_data.get("id"),
+            "original_filename": attachment_data.get("original_filename"),
+            "file_size": attachment_data.get("file_size"),
+            "mime_type": attachment_data.get("mime_type"),
+            "content_hash": attachment_data.get("content_hash"),
+            "project_id": attachment_data.get("project_id"),
+            "task_id": attachment_data.get("task_id"),
+            "uploaded_by": attachment_data.get("uploaded_by"),
+            "created_at": attachment_data.get("created_at"),
+            "download_url": f"/attachments/{attachment_data.get('id')}/download"
         }
 
 # Instancia global de utilidades
@@ -0,0 +1,912 @@
+# Sustituto local en memoria del cliente de Supabase
+#
+# Implementa el subconjunto de la API de supabase-py/postgrest que usa la
+# aplicación (table().select().eq()...execute()) sobre diccionarios en memoria.
+# Se activa con SUPABASE_URL=memory://<nombre> y sirve para benchmarks y
+# pruebas sin red ni proyecto de Supabase.
+import copy
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+# Valores por defecto equivalentes a los DEFAULT de supabase_schema.sql
+TABLE_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "users": {"role": "user", "profile_photo": "", "is_active": True},
+    "categories": {"color": "#3498db", "icon": "folder"},
+    "projects": {
+        "priority": "medium", "status": "planning", "progress": 0,
+        "assigned_to": [], "tags": [], "is_archived": False, "comment_count": 0, "version": 1,
+    },
+    "tasks": {
+        "priority": "medium", "status": "todo", "progress": 0,
+        "tags": [], "dependencies": [], "comment_count": 0, "version": 1,
+    },
+    "comments": {"is_edited": False},
+    "notifications": {"is_read": False},
+}
+
+# Columnas con índice hash (equivalentes a los índices del esquema)
+TABLE_INDEXES: Dict[str, tuple] = {
+    "users": ("username", "email"),
+    "projects": ("created_by",),
+    "tasks": ("project_id", "assigned_to", "parent_task_id"),
+    "comments": ("project_id", "task_id", "parent_comment_id"),
+    "notifications": ("user_id",),
+    "activity_log": ("entity_id", "project_id"),
+    "attachments": ("project_id", "task_id", "comment_id", "content_hash"),
+    "project_members": ("project_id", "user_id"),
+    "archived_tasks": ("project_id",),
+}
+
+# Borrados en cascada: tabla padre -> [(tabla hija, columna FK)]
+TABLE_CASCADES: Dict[str, List[tuple]] = {
+    "projects": [("tasks", "project_id"), ("comments", "project_id"), ("attachments", "project_id"),
+                 ("project_members", "project_id"), ("archived_tasks", "project_id")],
+    "tasks": [("tasks", "parent_task_id"), ("comments", "task_id"), ("attachments", "task_id")],
+    "comments": [("comments", "parent_comment_id"), ("attachments", "comment_id")],
+}
+
+# Contadores denormalizados (trigger_update_comment_counts):
+# tabla hija -> [(tabla padre, columna FK, columna contador)]
+TABLE_COUNTERS: Dict[str, List[tuple]] = {
+    "comments": [("tasks", "task_id", "comment_count"), ("projects", "project_id", "comment_count")],
+}
+
+# Tablas sin columna updated_at
+NO_UPDATED_AT = {"notifications", "activity_log", "attachments", "scheduler_leases", "deleted_records",
+                 "project_members", "archived_projects", "archived_tasks"}
+
+# Tablas con posición de cambio y lápidas para GET /sync (touch_change_xid y
+# record_deletion): tabla -> tipo de entidad. La posición es un contador del
+# cliente en lugar del id de transacción.
+SYNC_TABLES = {"projects": "project", "tasks": "task"}
+
+# Columnas mantenidas por el sistema: cambiarlas no actualiza updated_at
+# ni incrementa version (update_updated_at_unless_counters)
+SYSTEM_COLUMNS = {"comment_count", "deadline_status"}
+
+# Tablas con columna version (ETag de la API, ver etags.py)
+VERSIONED_TABLES = {"projects", "tasks"}
+
+# Recurso embebido en select(): "tabla(col, ...)" o "tabla!inner(col, ...)".
+# Solo tablas hijas de TABLE_CASCADES; con !inner se descartan las filas sin
+# hijas que cumplan los filtros "tabla.columna".
+EMBED_PATTERN = re.compile(r"^(\w+)(!inner)?\((.*)\)$", re.S)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _coerce(value: Any, sample: Any) -> Any:
+    """Convierte el valor de un filtro (texto) al tipo del valor almacenado"""
+    if isinstance(value, str) and sample is not None and not isinstance(sample, str):
+        if isinstance(sample, bool):
+            return value.lower() == "true"
+        if isinstance(sample, int):
+            try:
+                return int(value)
+            except ValueError:
+                return value
+        if isinstance(sample, float):
+            try:
+                return float(value)
+            except ValueError:
+                return value
+    return value
+
+
+def _parse_array(value: Any) -> list:
+    """Convierte '{a,b}' o una lista en lista de valores"""
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    text = str(value).strip()
+    if text.startswith("{") or text.startswith("("):
+        text = text[1:-1]
+    return [item.strip().strip('"') for item in text.split(",") if item.strip()]
+
+
+def _like(pattern: str, value: Any, case_insensitive: bool) -> bool:
+    if value is None:
+        return False
+    import fnmatch
+    pattern = pattern.replace("%", "*")
+    text = str(value)
+    if case_insensitive:
+        return fnmatch.fnmatchcase(text.lower(), pattern.lower())
+    return fnmatch.fnmatchcase(text, pattern)
+
+
+def _compare(op: str, row_value: Any, value: Any) -> bool:
+    """Evalúa un operador de PostgREST sobre un valor de fila"""
+    if op == "is":
+        if value in (None, "null"):
+            return row_value is None
+        return row_value is _coerce(value, True)
+    if op in ("in",):
+        values = _parse_array(value)
+        # Sin conversión en el caso habitual (mismo tipo): evita O(n) conversiones por fila
+        return row_value in values or row_value in [_coerce(v, row_value) for v in values]
+    if op == "cs":
+        return set(_parse_array(value)) <= set(row_value or [])
+    if op == "cd":
+        return set(row_value or []) <= set(_parse_array(value))
+    if op == "ov":
+        return bool(set(_parse_array(value)) & set(row_value or []))
+    if op == "like":
+        return _like(value, row_value, False)
+    if op == "ilike":
+        return _like(value, row_value, True)
+    value = _coerce(value, row_value)
+    if op == "eq":
+        return row_value == value
+    if op == "neq":
+        return row_value != value
+    if row_value is None:
+        return False
+    if op == "gt":
+        return row_value > value
+    if op == "gte":
+        return row_value >= value
+    if op == "lt":
+        return row_value < value
+    if op == "lte":
+        return row_value <= value
+    raise ValueError(f"Operador no soportado por el sustituto local: {op}")
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Divide por comas ignorando las que están dentro de (), {} o comillas"""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in "({":
+            depth += 1
+        elif not quoted and char in ")}":
+            depth -= 1
+        if char == "," and depth == 0 and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def _parse_logic(expression: str) -> Callable[[dict], bool]:
+    """Compila una expresión de or_()/and() de PostgREST en un predicado"""
+    expression = expression.strip()
+    for keyword, combine in (("and(", all), ("or(", any)):
+        if expression.startswith(keyword) and expression.endswith(")"):
+            inner = [_parse_logic(p) for p in _split_top_level(expression[len(keyword):-1])]
+            return lambda row, inner=inner, combine=combine: combine(p(row) for p in inner)
+    column, op, value = expression.split(".", 2)
+    negate = False
+    if op == "not":
+        negate = True
+        op, value = value.split(".", 1)
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    if negate:
+        return lambda row: not _compare(op, row.get(column), value)
+    return lambda row: _compare(op, row.get(column), value)
+
+
+class LocalAPIResponse:
+    """Equivalente mínimo de postgrest.APIResponse"""
+
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class LocalQueryBuilder:
+    """Constructor de consultas encadenable sobre una tabla en memoria"""
+
+    def __init__(self, client: "LocalSupabaseClient", table: str):
+        self._client = client
+        self._table = table
+        self._action = "select"
+        self._columns: Optional[List[str]] = None
+        self._count: Optional[str] = None
+        self._payload: Any = None
+        self._on_conflict: Optional[str] = None
+        self._filters: List[tuple] = []
+        self._predicates: List[Callable[[dict], bool]] = []
+        self._order: List[tuple] = []
+        self._offset = 0
+        self._limit: Optional[int] = None
+        self._embeds: List[tuple] = []
+
+    # Acciones
+    def select(self, *columns: str, count: Optional[str] = None):
+        spec = ",".join(columns) if columns else "*"
+        columns, self._embeds = [], []
+        for part in (p.strip() for p in _split_top_level(spec)):
+            embed = EMBED_PATTERN.match(part)
+            if embed:
+                name, inner, embedded = embed.groups()
+                self._embeds.append((name, bool(inner), [c.strip() for c in embedded.split(",") if c.strip()]))
+            elif part:
+                columns.append(part)
+        self._columns = None if columns in ([], ["*"]) else columns
+        self._count = count
+        return self
+
+    def insert(self, data: Any, **kwargs):
+        self._action, self._payload = "insert", data
+        return self
+
+    def upsert(self, data: Any, on_conflict: str = "", **kwargs):
+        self._action, self._payload = "upsert", data
+        self._on_conflict = on_conflict or "id"
+        return self
+
+    def update(self, data: dict, **kwargs):
+        self._action, self._payload = "update", data
+        return self
+
+    def delete(self, **kwargs):
+        self._action = "delete"
+        return self
+
+    # Filtros
+    def _filter(self, column: str, op: str, value: Any):
+        self._filters.append((column, op, value))
+        return self
+
+    def eq(self, column: str, value: Any):
+        return self._filter(column, "eq", value)
+
+    def neq(self, column: str, value: Any):
+        return self._filter(column, "neq", value)
+
+    def gt(self, column: str, value: Any):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column: str, value: Any):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column: str, value: Any):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column: str, value: Any):
+        return self._filter(column, "lte", value)
+
+    def in_(self, column: str, values: Any):
+        return self._filter(column, "in", list(values))
+
+    def is_(self, column: str, value: Any):
+        return self._filter(column, "is", value)
+
+    def contains(self, column: str, value: Any):
+        return self._filter(column, "cs", value)
+
+    def ov(self, column: str, value: Any):
+        return self._filter(column, "ov", value)
+
+    def like(self, column: str, pattern: str):
+        return self._filter(column, "like", pattern)
+
+    def ilike(self, column: str, pattern: str):
+        return self._filter(column, "ilike", pattern)
+
+    def or_(self, filters: str, **kwargs):
+        self._predicates.append(_parse_logic(f"or({filters})"))
+        return self
+
+    # Modificadores
+    def order(self, column: str, desc: bool = False, **kwargs):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, size: int, **kwargs):
+        self._limit = size
+        return self
+
+    def range(self, start: int, end: int, **kwargs):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def _matches(self, row: dict) -> bool:
+        for column, op, value in self._filters:
+            if "." not in column and not _compare(op, row.get(column), value):
+                return False
+        return all(predicate(row) for predicate in self._predicates)
+
+    def _project(self, row: dict) -> dict:
+        if self._columns is None:
+            return copy.deepcopy(row)
+        return {c: copy.deepcopy(row.get(c)) for c in self._columns}
+
+    def execute(self) -> LocalAPIResponse:
+        self._client._before_execute()
+        with self._client._lock:
+            handler = getattr(self, f"_execute_{self._action}")
+            return handler()
+
+    def _embedded(self) -> List[tuple]:
+        """(nombre, inner, columnas, filas hijas por id del padre) de cada recurso embebido"""
+        embedded = []
+        for name, inner, columns in self._embeds:
+            foreign_key = dict(TABLE_CASCADES.get(self._table, ()))[name]
+            filters = [(column.split(".", 1)[1], op, value) for column, op, value in self._filters
+                       if column.startswith(name + ".")]
+            children: Dict[str, list] = {}
+            for child in self._client._candidates(name, filters):
+                if all(_compare(op, child.get(column), value) for column, op, value in filters):
+                    children.setdefault(child[foreign_key], []).append(child)
+            embedded.append((name, inner, columns, children))
+        return embedded
+
+    def _execute_select(self) -> LocalAPIResponse:
+        embedded = self._embedded()
+        # Filtros de la propia tabla (los de "tabla.columna" son de los recursos embebidos)
+        filters = [f for f in self._filters if "." not in f[0]]
+        candidates = self._client._candidates(self._table, filters)
+        for _, inner, _, children in embedded:
+            if inner:
+                candidates = [r for r in candidates if r["id"] in children]
+        rows = [r for r in candidates if self._matches(r)]
+        total = len(rows)
+        if self._columns == ["count"]:
+            return LocalAPIResponse([{"count": total}], total)
+        for column, desc in reversed(self._order):
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        end = None if self._limit is None else self._offset + self._limit
+        rows = rows[self._offset:end]
+        data = [self._project(r) for r in rows]
+        for name, _, columns, children in embedded:
+            for row, projected in zip(rows, data):
+                projected[name] = [{c: copy.deepcopy(child.get(c)) for c in columns}
+                                   for child in children.get(row["id"], [])]
+        return LocalAPIResponse(data, total if self._count else None)
+
+    def _execute_insert(self) -> LocalAPIResponse:
+        records = self._payload if isinstance(self._payload, list) else [self._payload]
+        return LocalAPIResponse([copy.deepcopy(self._client._insert(self._table, r)) for r in records])
+
+    def _execute_upsert(self) -> LocalAPIResponse:
+        records = self._payload if isinstance(self._payload, list) else [self._payload]
+        keys = [k.strip() for k in self._on_conflict.split(",")]
+        result = []
+        for record in records:
+            existing = [
+                r for r in self._client._candidates(self._table, [(k, "eq", record.get(k)) for k in keys])
+                if all(r.get(k) == record.get(k) for k in keys)
+            ]
+            if existing:
+                result.append(copy.deepcopy(self._client._update(self._table, existing[0], record)))
+            else:
+                result.append(copy.deepcopy(self._client._insert(self._table, record)))
+        return LocalAPIResponse(result)
+
+    def _execute_update(self) -> LocalAPIResponse:
+        rows = [r for r in self._client._candidates(self._table, self._filters) if self._matches(r)]
+        return LocalAPIResponse([copy.deepcopy(self._client._update(self._table, r, self._payload)) for r in rows])
+
+    def _execute_delete(self) -> LocalAPIResponse:
+        rows = [r for r in self._client._candidates(self._table, self._filters) if self._matches(r)]
+        for row in rows:
+            self._client._delete(self._table, row)
+        return LocalAPIResponse([copy.deepcopy(r) for r in rows])
+
+
+class LocalRPCBuilder:
+    """Llamada a una función RPC registrada en el sustituto local"""
+
+    def __init__(self, client: "LocalSupabaseClient", name: str, params: dict):
+        self._client = client
+        self._name = name
+        self._params = params or {}
+
+    def execute(self) -> LocalAPIResponse:
+        self._client._before_execute()
+        function = self._client._rpc_functions.get(self._name)
+        if function is None:
+            raise Exception(f"Función RPC no disponible en el sustituto local: {self._name}")
+        with self._client._lock:
+            return LocalAPIResponse(function(self._client, **self._params))
+
+
+class LocalSupabaseClient:
+    """Cliente en memoria compatible con el uso que hace la aplicación de supabase-py
+
+    Args:
+        latency_ms: Latencia simulada por llamada a execute() (ida y vuelta HTTP)
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self._lock = threading.RLock()
+        self._tables: Dict[str, Dict[str, dict]] = {}
+        self._indexes: Dict[str, Dict[str, Dict[Any, Dict[str, dict]]]] = {}
+        self._rpc_functions: Dict[str, Callable] = dict(BUILTIN_RPCS)
+        self._change_xid = 0
+
+    def table(self, name: str) -> LocalQueryBuilder:
+        return LocalQueryBuilder(self, name)
+
+    def from_(self, name: str) -> LocalQueryBuilder:
+        return self.table(name)
+
+    def rpc(self, name: str, params: Optional[dict] = None) -> LocalRPCBuilder:
+        return LocalRPCBuilder(self, name, params)
+
+    def register_rpc(self, name: str, function: Callable) -> None:
+        """Registra una función Python que emula una función RPC de Postgres"""
+        self._rpc_functions[name] = function
+
+    def rows(self, table: str) -> List[dict]:
+        """Devuelve las filas almacenadas de una tabla (sin copiar)"""
+        return list(self._tables.get(table, {}).values())
+
+    def bulk_load(self, table: str, records: List[dict]) -> None:
+        """Carga masiva sin copias ni latencia simulada (para sembrar datos)"""
+        with self._lock:
+            for record in records:
+                self._insert(table, record, copy_record=False)
+
+    def _before_execute(self) -> None:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def _table_rows(self, table: str) -> Dict[str, dict]:
+        return self._tables.setdefault(table, {})
+
+    def _table_index(self, table: str, column: str) -> Dict[Any, Dict[str, dict]]:
+        return self._indexes.setdefault(table, {}).setdefault(column, {})
+
+    def _candidates(self, table: str, filters: List[tuple]):
+        """Usa la clave primaria o un índice hash cuando hay un filtro eq (o in sobre id) aplicable"""
+        rows = self._table_rows(table)
+        indexed = TABLE_INDEXES.get(table, ())
+        for column, op, value in filters:
+            if op == "in" and column == "id":
+                return [rows[key] for key in dict.fromkeys(map(str, _parse_array(value))) if key in rows]
+            if op != "eq":
+                continue
+            if column == "id":
+                row = rows.get(str(value))
+                return [row] if row is not None else []
+            if column in indexed:
+                return list(self._table_index(table, column).get(value, {}).values())
+        return list(rows.values())
+
+    def _index_add(self, table: str, row: dict) -> None:
+        for column in TABLE_INDEXES.get(table, ()):
+            self._table_index(table, column).setdefault(row.get(column), {})[row["id"]] = row
+
+    def _index_remove(self, table: str, row: dict) -> None:
+        for column in TABLE_INDEXES.get(table, ()):
+            bucket = self._table_index(table, column).get(row.get(column))
+            if bucket is not None:
+                bucket.pop(row["id"], None)
+
+    def _next_change_xid(self) -> int:
+        self._change_xid += 1
+        return self._change_xid
+
+    def _insert(self, table: str, record: dict, copy_record: bool = True) -> dict:
+        row = dict(TABLE_DEFAULTS.get(table, {}))
+        if copy_record:
+            row = copy.deepcopy(row)
+            row.update(copy.deepcopy(record))
+        else:
+            row.update(record)
+        row["id"] = str(row.get("id") or uuid.uuid4())
+        now = _now()
+        row.setdefault("created_at", now)
+        if table not in NO_UPDATED_AT:
+            row.setdefault("updated_at", now)
+        if table in SYNC_TABLES:
+            row["change_xid"] = self._next_change_xid()
+        rows = self._table_rows(table)
+        if row["id"] in rows:
+            raise Exception(f'duplicate key value violates unique constraint "{table}_pkey"')
+        rows[row["id"]] = row
+        self._index_add(table, row)
+        self._adjust_counters(table, row, 1)
+        if table == "projects":
+            self._sync_project_members(row)
+        return row
+
+    def _adjust_counters(self, table: str, row: dict, delta: int) -> None:
+        # Como el trigger, no modifica updated_at del padre
+        for parent_table, column, counter in TABLE_COUNTERS.get(table, ()):
+            parent = self._table_rows(parent_table).get(row.get(column))
+            if parent is not None:
+                parent[counter] = parent.get(counter, 0) + delta
+
+    def _update(self, table: str, row: dict, changes: dict) -> dict:
+        self._index_remove(table, row)
+        if table in VERSIONED_TABLES and any(row.get(k) != v for k, v in changes.items()
+                                        if k not in SYSTEM_COLUMNS and k not in ("updated_at", "version")):
+            changes = {**changes, "version": row.get("version", 1) + 1}
+        row.update(copy.deepcopy(changes))
+        if table not in NO_UPDATED_AT and "updated_at" not in changes and not changes.keys() <= SYSTEM_COLUMNS:
+            row["updated_at"] = _now()
+        if table in SYNC_TABLES:
+            row["change_xid"] = self._next_change_xid()
+        self._index_add(table, row)
+        if table == "projects" and changes.keys() & {"created_by", "assigned_to"}:
+            self._sync_project_members(row)
+        return row
+
+    def _sync_project_members(self, project: dict) -> None:
+        """Como sync_projects_members: creador (owner) y asignados (member) con usuario existente"""
+        users = self._table_rows("users")
+        roles = {user_id: "member" for user_id in project.get("assigned_to") or [] if user_id in users}
+        if project.get("created_by") in users:
+            roles[project["created_by"]] = "owner"
+        for member in self._candidates("project_members", [("project_id", "eq", project["id"])]):
+            if roles.get(member["user_id"]) != member["role"]:
+                self._delete("project_members", member)
+        members = self._table_rows("project_members")
+        for user_id, role in roles.items():
+            member_id = f"{project['id']}:{user_id}"
+            if member_id not in members:
+                self._insert("project_members", {"id": member_id, "project_id": project["id"],
+                                                 "user_id": user_id, "role": role})
+
+    def _delete(self, table: str, row: dict) -> None:
+        if self._table_rows(table).pop(row["id"], None) is None:
+            return
+        self._index_remove(table, row)
+        self._adjust_counters(table, row, -1)
+        if table in SYNC_TABLES:
+            self._record_deletion(table, row)
+        for child_table, column in TABLE_CASCADES.get(table, []):
+            for child in self._candidates(child_table, [(column, "eq", row["id"])]):
+                if child.get(column) == row["id"]:
+                    self._delete(child_table, child)
+
+
+    def _record_deletion(self, table: str, row: dict) -> None:
+        # Como record_deletion: las tareas borradas en cascada ya no encuentran su proyecto
+        if table == "projects":
+            project_id, audience = row["id"], list(row.get("assigned_to") or []) + [row.get("created_by")]
+        else:
+            project_id = row.get("project_id")
+            project = self._table_rows("projects").get(project_id)
+            audience = list(project.get("assigned_to") or []) + [project.get("created_by")] if project else []
+            audience.append(row.get("assigned_to"))
+        self._table_rows("deleted_records")[row["id"]] = {
+            "id": row["id"],
+            "entity_id": row["id"],
+            "entity_type": SYNC_TABLES[table],
+            "project_id": project_id,
+            "audience": [user_id for user_id in audience if user_id is not None],
+            "change_xid": self._next_change_xid(),
+            "deleted_at": _now(),
+        }
+
+
+def _rpc_get_comment_thread(client: LocalSupabaseClient, p_task_id: Optional[str] = None,
+                            p_project_id: Optional[str] = None, p_limit: int = 20,
+                            p_after_created_at: Optional[str] = None, p_after_id: Optional[str] = None) -> List[dict]:
+    """Equivalente de la función get_comment_thread de supabase_schema.sql"""
+    column, value = ("task_id", p_task_id) if p_task_id else ("project_id", p_project_id)
+    roots = [
+        c for c in client._candidates("comments", [(column, "eq", value)])
+        if c.get(column) == value and c.get("parent_comment_id") is None
+        and (p_after_created_at is None or (c["created_at"], c["id"]) > (p_after_created_at, p_after_id))
+    ]
+    roots.sort(key=lambda c: (c["created_at"], c["id"]))
+    result = []
+
+    def visit(comment: dict, root_id: str, depth: int) -> None:
+        result.append({**copy.deepcopy(comment), "root_id": root_id, "depth": depth})
+        replies = client._candidates("comments", [("parent_comment_id", "eq", comment["id"])])
+        for reply in sorted(replies, key=lambda c: (c["created_at"], c["id"])):
+            visit(reply, root_id, depth + 1)
+
+    for root in roots[:p_limit]:
+        visit(root, root["id"], 0)
+    return result
+
+
+def _rpc_acquire_scheduler_lease(client: LocalSupabaseClient, p_name: str, p_owner: str,
+                                 p_ttl_seconds: float) -> bool:
+    """Equivalente de la función acquire_scheduler_lease de supabase_schema.sql"""
+    now = datetime.now(timezone.utc)
+    leases = client._table_rows("scheduler_leases")
+    lease = leases.get(p_name)
+    if lease is not None and lease["owner"] != p_owner and datetime.fromisoformat(lease["expires_at"]) >= now:
+        return False
+    expires_at = (now + timedelta(seconds=p_ttl_seconds)).isoformat()
+    if lease is None:
+        # La clave primaria de scheduler_leases es name
+        leases[p_name] = {"id": p_name, "name": p_name, "owner": p_owner, "expires_at": expires_at, "state": None}
+    else:
+        lease.update(owner=p_owner, expires_at=expires_at)
+    return True
+
+
+def _timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Fecha ISO como TIMESTAMP WITH TIME ZONE (sin zona = UTC)"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _rpc_get_timeline(client: LocalSupabaseClient, p_user_id: str, p_from: str, p_to: str,
+                      p_project_id: Optional[str] = None, p_group_by: str = "project", p_limit: int = 200,
+                      p_after_group: Optional[str] = None, p_after_start: Optional[str] = None,
+                      p_after_id: Optional[str] = None) -> List[dict]:
+    """Equivalente de la función get_timeline de supabase_schema.sql (sin índice: recorre las tareas)"""
+    window_start, window_end = _timestamp(p_from), _timestamp(p_to)
+    projects = client._table_rows("projects")
+    after = (p_after_group, _timestamp(p_after_start), p_after_id) if p_after_group is not None else None
+    selected = []
+    for task in client._table_rows("tasks").values():
+        if p_project_id is not None and task.get("project_id") != p_project_id:
+            continue
+        bounds = [d for d in (_timestamp(task.get("start_date")), _timestamp(task.get("due_date"))) if d]
+        if not bounds or max(bounds) < window_start or min(bounds) > window_end:
+            continue
+        project = projects.get(task.get("project_id"))
+        if not project or (project.get("created_by") != p_user_id and p_user_id not in (project.get("assigned_to") or [])):
+            continue
+        group_key = (task.get("assigned_to") or "") if p_group_by == "assignee" else task["project_id"]
+        key = (group_key, min(bounds), task["id"])
+        if after is None or key > after:
+            selected.append((key, task))
+    selected.sort(key=lambda item: item[0])
+    return [
+        {**copy.deepcopy(task), "group_key": key[0], "range_start": key[1].isoformat()}
+        for key, task in selected[:p_limit]
+    ]
+
+
+def _rpc_apply_batch(client: LocalSupabaseClient, p_operations: List[dict]) -> List[dict]:
+    """Equivalente de la función apply_batch de supabase_schema.sql (se deshace entera si falla)"""
+    snapshot = copy.deepcopy((client._tables, client._indexes))
+    try:
+        result = []
+        for operation in p_operations:
+            table = {"task": "tasks", "project": "projects"}[operation["entity"]]
+            if operation["op"] == "create":
+                result.append(copy.deepcopy(client._insert(table, operation["data"])))
+                continue
+            row = client._table_rows(table).get(operation["id"])
+            if row is None:
+                raise Exception(f"No existe {operation['entity']} {operation['id']}")
+            if operation["op"] == "update":
+                if operation.get("version") is not None and row.get("version", 1) != operation["version"]:
+                    raise Exception(f"La versión de {operation['entity']} {operation['id']} ha cambiado")
+                result.append(copy.deepcopy(client._update(table, row, operation["data"])))
+            else:
+                client._delete(table, row)
+                result.append(copy.deepcopy(row))
+        return result
+    except Exception:
+        client._tables, client._indexes = snapshot
+        raise
+
+
+def _rpc_update_task_checked(client: LocalSupabaseClient, p_task_id: str, p_user_id: str,
+                             p_version: Optional[int], p_changes: dict) -> Optional[dict]:
+    """Equivalente de la función update_task_checked de supabase_schema.sql"""
+    task = client._table_rows("tasks").get(p_task_id)
+    if task is None or (p_version is not None and task.get("version", 1) != p_version):
+        return None
+    project = client._table_rows("projects").get(task.get("project_id")) or {}
+    if p_user_id not in (project.get("created_by"), *(project.get("assigned_to") or []), task.get("assigned_to")):
+        return None
+    previous = copy.deepcopy(task)
+    return {"row": copy.deepcopy(client._update("tasks", task, p_changes)), "previous": previous}
+
+
+def _rpc_get_changes(client: LocalSupabaseClient, p_user_id: str, p_after_xid: str = "0", p_after_kind: str = "",
+                     p_after_id: str = "", p_limit: int = 501) -> dict:
+    """Equivalente de la función get_changes de supabase_schema.sql (todo lo escrito ya es visible)"""
+    after = (int(p_after_xid), p_after_kind, p_after_id)
+    projects = client._table_rows("projects")
+
+    def visible(project: Optional[dict]) -> bool:
+        return bool(project) and (project.get("created_by") == p_user_id
+                                  or p_user_id in (project.get("assigned_to") or []))
+
+    changes = []
+    for record in client._table_rows("deleted_records").values():
+        if p_user_id in record["audience"]:
+            row = {k: v for k, v in record.items() if k not in ("id", "audience", "change_xid")}
+            changes.append((record["change_xid"], "deleted", record["entity_id"], row))
+    for project in projects.values():
+        if visible(project):
+            changes.append((project["change_xid"], "project", project["id"], project))
+    for task in client._table_rows("tasks").values():
+        if visible(projects.get(task.get("project_id"))):
+            changes.append((task["change_xid"], "task", task["id"], task))
+    changes = sorted((c for c in changes if c[:3] > after), key=lambda c: c[:3])[:p_limit]
+    return {
+        "horizon": str(client._change_xid + 1),
+        "changes": [
+            {"kind": kind, "position": str(position), "id": entity_id,
+             "row": {k: copy.deepcopy(v) for k, v in row.items() if k != "change_xid"}}
+            for position, kind, entity_id, row in changes
+        ],
+    }
+
+
+def _archive_contents(client: LocalSupabaseClient, project_id: Optional[str], task_ids: List[str]) -> tuple:
+    """Comentarios y adjuntos del proyecto (si se indica) y de las tareas, como en archive_batch"""
+    comments = list(client._candidates("comments", [("project_id", "eq", project_id)])) if project_id else []
+    attachments = list(client._candidates("attachments", [("project_id", "eq", project_id)])) if project_id else []
+    for task_id in task_ids:
+        comments += client._candidates("comments", [("task_id", "eq", task_id)])
+        attachments += client._candidates("attachments", [("task_id", "eq", task_id)])
+    for comment in comments:
+        attachments += client._candidates("attachments", [("comment_id", "eq", comment["id"])])
+    return copy.deepcopy(comments), copy.deepcopy(attachments)
+
+
+def _content_hashes(attachments: List[dict]) -> List[str]:
+    return sorted({a["content_hash"] for a in attachments if a.get("content_hash")})
+
+
+def _rpc_archive_batch(client: LocalSupabaseClient, p_limit: int, p_completed_before: str) -> dict:
+    """Equivalente de la función archive_batch de supabase_schema.sql (el cliente local no tiene bloqueos)"""
+    before = _timestamp(p_completed_before)
+    result = {"projects": [], "tasks": []}
+    archived = sorted((p for p in client._table_rows("projects").values() if p.get("is_archived")),
+                      key=lambda p: p["id"])
+    for project in archived[:p_limit]:
+        tasks = copy.deepcopy(client._candidates("tasks", [("project_id", "eq", project["id"])]))
+        comments, attachments = _archive_contents(client, project["id"], [t["id"] for t in tasks])
+        hashes = _content_hashes(attachments)
+        for loose in client._candidates("archived_tasks", [("project_id", "eq", project["id"])]):
+            tasks.append(loose["task"])
+            comments += loose["data"]["comments"]
+            attachments += loose["data"]["attachments"]
+            hashes = sorted(set(hashes).union(loose["content_hashes"]))
+            client._delete("archived_tasks", loose)
+        client._insert("archived_projects", {
+            "id": project["id"],
+            "members": [u for u in [*(project.get("assigned_to") or []), project.get("created_by")] if u is not None],
+            "project": project,
+            "data": {"tasks": tasks, "comments": comments, "attachments": attachments},
+            "content_hashes": hashes,
+            "archived_at": _now(),
+        })
+        client._delete("projects", project)
+        result["projects"].append(project["id"])
+
+    candidates = [
+        t for t in client._table_rows("tasks").values()
+        if t.get("status") == "completed" and t.get("completed_date")
+        and _timestamp(t["completed_date"]) < before and _timestamp(t["updated_at"]) < before
+        and not client._candidates("tasks", [("parent_task_id", "eq", t["id"])])
+    ]
+    for task in sorted(candidates, key=lambda t: _timestamp(t["completed_date"]))[:p_limit]:
+        comments, attachments = _archive_contents(client, None, [task["id"]])
+        client._insert("archived_tasks", {
+            "id": task["id"],
+            "project_id": task["project_id"],
+            "is_root": task.get("parent_task_id") is None,
+            "task": task,
+            "data": {"comments": comments, "attachments": attachments},
+            "content_hashes": _content_hashes(attachments),
+            "archived_at": _now(),
+        })
+        client._delete("tasks", task)
+        result["tasks"].append({"id": task["id"], "project_id": task["project_id"]})
+    return result
+
+
+def _restore_rows(client: LocalSupabaseClient, table: str, rows: List[dict], deferred: Optional[str] = None) -> None:
+    """Como restore_rows: las autorreferencias se fijan cuando ya existen todas las filas"""
+    stored = client._table_rows(table)
+    for row in rows:
+        client._insert(table, {k: v for k, v in row.items() if k != deferred})
+    if deferred:
+        for row in rows:
+            if row.get(deferred) in stored:
+                client._update(table, stored[row["id"]], {deferred: row[deferred]})
+
+
+def _recount_comments(client: LocalSupabaseClient, column: str, row: dict) -> None:
+    # Los INSERT de comentarios han vuelto a sumar sobre los contadores guardados
+    row["comment_count"] = sum(1 for c in client._candidates("comments", [(column, "eq", row["id"])])
+                               if c.get(column) == row["id"])
+
+
+def _rpc_restore_archived_project(client: LocalSupabaseClient, p_project_id: str) -> Optional[dict]:
+    """Equivalente de la función restore_archived_project de supabase_schema.sql"""
+    entry = client._table_rows("archived_projects").get(p_project_id)
+    if entry is None:
+        return None
+    client._delete("archived_projects", entry)
+    _restore_rows(client, "projects", [{**entry["project"], "is_archived": False}])
+    _restore_rows(client, "tasks", entry["data"]["tasks"], "parent_task_id")
+    _restore_rows(client, "comments", entry["data"]["comments"], "parent_comment_id")
+    _restore_rows(client, "attachments", entry["data"]["attachments"])
+    for task in client._candidates("tasks", [("project_id", "eq", p_project_id)]):
+        _recount_comments(client, "task_id", task)
+    project = client._table_rows("projects")[p_project_id]
+    _recount_comments(client, "project_id", project)
+    return copy.deepcopy(project)
+
+
+def _rpc_restore_archived_task(client: LocalSupabaseClient, p_task_id: str) -> Optional[dict]:
+    """Equivalente de la función restore_archived_task de supabase_schema.sql"""
+    entry = client._table_rows("archived_tasks").get(p_task_id)
+    if entry is None:
+        return None
+    client._delete("archived_tasks", entry)
+    _restore_rows(client, "tasks", [{**entry["task"], "updated_at": _now()}], "parent_task_id")
+    _restore_rows(client, "comments", entry["data"]["comments"], "parent_comment_id")
+    _restore_rows(client, "attachments", entry["data"]["attachments"])
+    task = client._table_rows("tasks")[p_task_id]
+    _recount_comments(client, "task_id", task)
+    return copy.deepcopy(task)
+
+
+def _rpc_maintain_monthly_partitions(client: LocalSupabaseClient, p_table: str, p_retention_months: int,
+                                     p_premake_months: int = 3) -> dict:
+    """Equivalente de maintain_monthly_partitions: el cliente local no tiene particiones, solo borra lo caducado"""
+    if p_table not in ("activity_log", "notifications"):
+        raise ValueError(f"Tabla sin particiones mensuales: {p_table}")
+    if p_retention_months <= 0:
+        return {"created": [], "dropped": []}
+    now = datetime.now(timezone.utc)
+    index = now.year * 12 + now.month - 1 - p_retention_months
+    cutoff = datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+    expired = [row for row in client._table_rows(p_table).values()
+               if row.get("created_at") and _timestamp(row["created_at"]) < cutoff]
+    for row in expired:
+        client._delete(p_table, row)
+    months = sorted({f"{_timestamp(row['created_at']):%Y%m}" for row in expired})
+    return {"created": [], "dropped": [f"{p_table}_p{month}" for month in months]}
+
+
+def _rpc_search_users(client: LocalSupabaseClient, p_prefix: str, p_limit: int = 10) -> List[dict]:
+    """Equivalente de la función search_users de supabase_schema.sql"""
+    prefix = p_prefix.lower()
+    matches = []
+    for user in client._table_rows("users").values():
+        if not user.get("is_active"):
+            continue
+        terms = [(user.get(column) or "").lower() for column in ("username", "name", "email")]
+        terms = [term for term in terms if term.startswith(prefix)]
+        if terms:
+            matches.append((min(terms), user["id"], user))
+    matches.sort(key=lambda match: (match[0].encode(), match[1]))
+    return [{column: user.get(column) for column in ("id", "name", "username", "profile_photo")}
+            for _, _, user in matches[:p_limit]]
+
+
+# Funciones RPC de supabase_schema.sql disponibles en todos los clientes locales
+BUILTIN_RPCS: Dict[str, Callable] = {
+    "get_comment_thread": _rpc_get_comment_thread,
+    "acquire_scheduler_lease": _rpc_acquire_scheduler_lease,
+    "update_task_checked": _rpc_update_task_checked,
+    "get_timeline": _rpc_get_timeline,
+    "apply_batch": _rpc_apply_batch,
+    "get_changes": _rpc_get_changes,
+    "archive_batch": _rpc_archive_batch,
+    "restore_archived_project": _rpc_restore_archived_project,
+    "restore_archived_task": _rpc_restore_archived_task,
+    "maintain_monthly_partitions": _rpc_maintain_monthly_partitions,
+    "search_users": _rpc_search_users,
+}
+
+
+# Instancias compartidas por URL (memory://<nombre>) dentro del proceso
+_instances: Dict[str, LocalSupabaseClient] = {}
+_instances_lock = threading.Lock()
+
+
+def get_local_client(url: str = "memory://default") -> LocalSupabaseClient:
+    """Obtiene (o crea) el cliente local asociado a una URL memory://"""
+    with _instances_lock:
+        if url not in _instances:
+            _instances[url] = LocalSupabaseClient()
+        return _instances[url]
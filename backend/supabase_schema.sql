@@ -47,10 +47,24 @@ CREATE TABLE IF NOT EXISTS projects (
     assigned_to UUID[] DEFAULT '{}', -- Array de UUIDs de usuarios asignados
     tags TEXT[] DEFAULT '{}', -- Array de tags
     is_archived BOOLEAN DEFAULT false,
+    comment_count INTEGER NOT NULL DEFAULT 0, -- mantenido por trigger_update_comment_counts
+    change_xid XID8 NOT NULL DEFAULT pg_current_xact_id(), -- posición de cambio para GET /sync
+    version INTEGER NOT NULL DEFAULT 1, -- ETag de la API (If-Match), ver update_updated_at_unless_counters
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Miembros de cada proyecto (creador y asignados), normalizados para las
+-- búsquedas por usuario. assigned_to sigue siendo la fuente: el trigger
+-- sync_projects_members mantiene esta tabla al día.
+CREATE TABLE IF NOT EXISTS project_members (
+    project_id UUID NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    role VARCHAR(20) NOT NULL DEFAULT 'member' CHECK (role IN ('owner', 'member')),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (project_id, user_id)
+);
+
 -- Tabla de tareas
 CREATE TABLE IF NOT EXISTS tasks (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -69,7 +83,17 @@ CREATE TABLE IF NOT EXISTS tasks (
     actual_hours DECIMAL(8,2),
     tags TEXT[] DEFAULT '{}',
     dependencies UUID[] DEFAULT '{}', -- Array de IDs de tareas dependientes
+    comment_count INTEGER NOT NULL DEFAULT 0, -- mantenido por trigger_update_comment_counts
+    deadline_status VARCHAR(20) CHECK (deadline_status IN ('due_soon', 'overdue')), -- marcado por el barrido de vencimientos
+    -- Intervalo [start_date, due_date] para la línea de tiempo (instante si solo hay una fecha)
+    time_range TSTZRANGE GENERATED ALWAYS AS (
+        CASE WHEN COALESCE(start_date, due_date) IS NOT NULL THEN
+            tstzrange(LEAST(start_date, due_date), GREATEST(start_date, due_date), '[]')
+        END
+    ) STORED,
     created_by UUID REFERENCES users(id) ON DELETE SET NULL,
+    change_xid XID8 NOT NULL DEFAULT pg_current_xact_id(), -- posición de cambio para GET /sync
+    version INTEGER NOT NULL DEFAULT 1, -- ETag de la API (If-Match), ver update_updated_at_unless_counters
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
@@ -98,7 +122,8 @@ CREATE TABLE IF NOT EXISTS attachments (
     original_filename VARCHAR(255) NOT NULL,
     file_size BIGINT NOT NULL,
     mime_type VARCHAR(100) NOT NULL,
-    file_url TEXT NOT NULL, -- URL del archivo en Supabase Storage
+    file_url TEXT NOT NULL, -- URL del archivo en el almacenamiento (ver storage.py)
+    content_hash VARCHAR(64), -- SHA-256 del contenido; filename es la clave del objeto, compartida entre adjuntos iguales
     project_id UUID REFERENCES projects(id) ON DELETE CASCADE,
     task_id UUID REFERENCES tasks(id) ON DELETE CASCADE,
     comment_id UUID REFERENCES comments(id) ON DELETE CASCADE,
@@ -111,9 +136,27 @@ CREATE TABLE IF NOT EXISTS attachments (
     )
 );
 
--- Tabla de notificaciones
+-- Bases creadas antes de particionar notifications y activity_log: la tabla
+-- anterior se renombra (con su clave primaria, y sin sus índices, cuyos
+-- nombres pasan a la tabla nueva) y sus filas se copian más abajo
+DO $$
+DECLARE
+    v_table TEXT;
+BEGIN
+    FOREACH v_table IN ARRAY ARRAY['notifications', 'activity_log'] LOOP
+        IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(v_table)) = 'r' THEN
+            EXECUTE format('ALTER TABLE %I RENAME TO %I', v_table, v_table || '_unpartitioned');
+            EXECUTE format('ALTER INDEX %I RENAME TO %I', v_table || '_pkey', v_table || '_unpartitioned_pkey');
+        END IF;
+    END LOOP;
+END $$;
+DROP INDEX IF EXISTS idx_notifications_user, idx_notifications_user_created, idx_notifications_user_unread,
+    idx_activity_log_entity, idx_activity_log_entity_created, idx_activity_log_project_created;
+ALTER TABLE IF EXISTS activity_log_unpartitioned ADD COLUMN IF NOT EXISTS project_id UUID;
+
+-- Tabla de notificaciones (particionada por mes de created_at, ver maintain_monthly_partitions)
 CREATE TABLE IF NOT EXISTS notifications (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
     user_id UUID REFERENCES users(id) ON DELETE CASCADE,
     title VARCHAR(255) NOT NULL,
     message TEXT NOT NULL,
@@ -121,34 +164,231 @@ CREATE TABLE IF NOT EXISTS notifications (
     entity_type VARCHAR(50), -- 'project', 'task', 'comment'
     entity_id UUID,
     is_read BOOLEAN DEFAULT false,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-);
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE IF NOT EXISTS notifications_default PARTITION OF notifications DEFAULT;
 
--- Tabla de actividad/historial
+-- Tabla de actividad/historial (particionada por mes de created_at)
 CREATE TABLE IF NOT EXISTS activity_log (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
     user_id UUID REFERENCES users(id) ON DELETE SET NULL,
     action VARCHAR(100) NOT NULL, -- 'created', 'updated', 'deleted', 'assigned', etc.
     entity_type VARCHAR(50) NOT NULL, -- 'project', 'task', 'comment', etc.
     entity_id UUID NOT NULL,
+    project_id UUID, -- proyecto de la entidad, para el historial por proyecto
     old_values JSONB,
     new_values JSONB,
     description TEXT,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+CREATE TABLE IF NOT EXISTS activity_log_default PARTITION OF activity_log DEFAULT;
+
+-- Leases y estado de los trabajos periódicos (ver scheduler.py)
+CREATE TABLE IF NOT EXISTS scheduler_leases (
+    name VARCHAR(100) PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    state TEXT
+);
+
+-- Lápidas de proyectos y tareas borrados para la sincronización incremental
+-- (ver sync.py). audience son los usuarios que podían ver la fila al borrarla.
+CREATE TABLE IF NOT EXISTS deleted_records (
+    entity_id UUID PRIMARY KEY,
+    entity_type VARCHAR(20) NOT NULL CHECK (entity_type IN ('project', 'task')),
+    project_id UUID, -- sin FK: la lápida sobrevive al proyecto
+    audience UUID[] NOT NULL DEFAULT '{}',
+    change_xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Archivo de proyectos archivados y de tareas completadas antiguas (ver
+-- archive.py). Cada entrada guarda las filas completas en JSONB fuera de las
+-- tablas calientes y restore_archived_* las devuelve. Sin FK: el archivo no
+-- bloquea el borrado de usuarios. content_hashes son los objetos de
+-- almacenamiento de sus adjuntos, que no se borran mientras sigan archivados.
+CREATE TABLE IF NOT EXISTS archived_projects (
+    id UUID PRIMARY KEY, -- id del proyecto
+    members UUID[] NOT NULL DEFAULT '{}', -- creador y asignados al archivarlo
+    project JSONB NOT NULL,
+    data JSONB NOT NULL, -- {tasks, comments, attachments}
+    content_hashes TEXT[] NOT NULL DEFAULT '{}',
+    archived_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS archived_tasks (
+    id UUID PRIMARY KEY, -- id de la tarea
+    project_id UUID NOT NULL, -- proyecto activo; al archivarlo la tarea pasa a su entrada
+    is_root BOOLEAN NOT NULL, -- sin tarea padre (cuenta en el progreso del proyecto)
+    task JSONB NOT NULL,
+    data JSONB NOT NULL, -- {comments, attachments}
+    content_hashes TEXT[] NOT NULL DEFAULT '{}',
+    archived_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
 );
 
 -- Índices para mejorar rendimiento
 CREATE INDEX IF NOT EXISTS idx_projects_created_by ON projects(created_by);
 CREATE INDEX IF NOT EXISTS idx_projects_category ON projects(category_id);
 CREATE INDEX IF NOT EXISTS idx_projects_status ON projects(status);
+CREATE INDEX IF NOT EXISTS idx_project_members_user ON project_members(user_id, project_id); -- "mis proyectos"
 CREATE INDEX IF NOT EXISTS idx_tasks_project ON tasks(project_id);
 CREATE INDEX IF NOT EXISTS idx_tasks_assigned_to ON tasks(assigned_to);
 CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
-CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks(due_date);
+CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks(due_date); -- barrido de vencimientos por rango
 CREATE INDEX IF NOT EXISTS idx_comments_project ON comments(project_id);
 CREATE INDEX IF NOT EXISTS idx_comments_task ON comments(task_id);
-CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id);
-CREATE INDEX IF NOT EXISTS idx_activity_log_entity ON activity_log(entity_type, entity_id);
+-- Hilos de comentarios: página de comentarios raíz por keyset y respuestas por padre
+CREATE INDEX IF NOT EXISTS idx_comments_task_thread ON comments(task_id, created_at, id) WHERE parent_comment_id IS NULL;
+CREATE INDEX IF NOT EXISTS idx_comments_project_thread ON comments(project_id, created_at, id) WHERE parent_comment_id IS NULL;
+CREATE INDEX IF NOT EXISTS idx_comments_parent ON comments(parent_comment_id);
+-- Contadores de comentarios en bases creadas antes de añadir las columnas
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS comment_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS comment_count INTEGER NOT NULL DEFAULT 0;
+-- Paginación por keyset de GET /notifications y contador de no leídas
+CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_notifications_user_unread ON notifications(user_id) WHERE is_read = false;
+DROP INDEX IF EXISTS idx_notifications_user;
+-- Historial por entidad o por proyecto, paginado por keyset (created_at, id)
+ALTER TABLE activity_log ADD COLUMN IF NOT EXISTS project_id UUID; -- sin FK: el historial sobrevive al proyecto (bases creadas antes)
+CREATE INDEX IF NOT EXISTS idx_activity_log_entity_created ON activity_log(entity_type, entity_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_activity_log_project_created ON activity_log(project_id, created_at DESC, id DESC);
+DROP INDEX IF EXISTS idx_activity_log_entity;
+-- Adjuntos por entidad y referencias a cada objeto almacenado (deduplicación por contenido)
+ALTER TABLE attachments ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+CREATE INDEX IF NOT EXISTS idx_attachments_task ON attachments(task_id, created_at) WHERE task_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_attachments_project ON attachments(project_id, created_at) WHERE project_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_attachments_content_hash ON attachments(content_hash);
+-- Marcado de vencimientos en bases creadas antes de añadir la columna
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS deadline_status VARCHAR(20) CHECK (deadline_status IN ('due_soon', 'overdue'));
+-- Línea de tiempo: búsqueda de solapamientos de intervalos con GiST
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS time_range TSTZRANGE GENERATED ALWAYS AS (
+    CASE WHEN COALESCE(start_date, due_date) IS NOT NULL THEN
+        tstzrange(LEAST(start_date, due_date), GREATEST(start_date, due_date), '[]')
+    END
+) STORED;
+CREATE INDEX IF NOT EXISTS idx_tasks_time_range ON tasks USING GIST (time_range);
+-- Sincronización incremental: cambios por posición (keyset change_xid, id) y lápidas
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS change_xid XID8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS change_xid XID8 NOT NULL DEFAULT pg_current_xact_id();
+CREATE INDEX IF NOT EXISTS idx_projects_change_xid ON projects(change_xid, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_change_xid ON tasks(change_xid, id);
+CREATE INDEX IF NOT EXISTS idx_deleted_records_change_xid ON deleted_records(change_xid, entity_id);
+CREATE INDEX IF NOT EXISTS idx_deleted_records_deleted_at ON deleted_records(deleted_at);
+-- Control de concurrencia optimista: versión de cada fila (ETag / If-Match)
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+-- Archivo: candidatos de cada lote, listados por keyset (archived_at, id) y referencias a objetos
+CREATE INDEX IF NOT EXISTS idx_projects_is_archived ON projects(id) WHERE is_archived;
+CREATE INDEX IF NOT EXISTS idx_tasks_completed_date ON tasks(completed_date) WHERE status = 'completed';
+CREATE INDEX IF NOT EXISTS idx_archived_projects_members ON archived_projects USING GIN (members);
+CREATE INDEX IF NOT EXISTS idx_archived_projects_archived_at ON archived_projects(archived_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_archived_tasks_project ON archived_tasks(project_id, archived_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_archived_projects_hashes ON archived_projects USING GIN (content_hashes);
+CREATE INDEX IF NOT EXISTS idx_archived_tasks_hashes ON archived_tasks USING GIN (content_hashes);
+-- Búsqueda de usuarios por prefijo (search_users): rangos sobre lower(columna) en orden de bytes
+CREATE INDEX IF NOT EXISTS idx_users_username_prefix ON users (lower(username) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_name_prefix ON users (lower(name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_email_prefix ON users (lower(email) text_pattern_ops);
+
+-- Particiones mensuales de notifications y activity_log (ver partitions.py):
+-- <tabla>_pAAAAMM cubre ese mes en UTC. La partición DEFAULT recoge las filas
+-- sin partición (p. ej. fechas fuera de la retención) y normalmente está
+-- vacía; si tiene filas del mes que se crea, pasan a la partición nueva. Las
+-- particiones no tienen políticas: con RLS activado solo se leen a través de
+-- la tabla principal.
+CREATE OR REPLACE FUNCTION create_monthly_partition(p_table TEXT, p_month DATE)
+RETURNS TEXT AS $$
+DECLARE
+    v_start DATE := date_trunc('month', p_month)::date;
+    v_name TEXT := p_table || '_p' || to_char(p_month, 'YYYYMM');
+    v_from TIMESTAMPTZ := v_start::timestamp AT TIME ZONE 'UTC';
+    v_to TIMESTAMPTZ := (v_start + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC';
+BEGIN
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE format('CREATE TEMP TABLE partition_rows ON COMMIT DROP AS
+                    WITH moved AS (DELETE FROM %I WHERE created_at >= %L AND created_at < %L RETURNING *)
+                    SELECT * FROM moved', p_table || '_default', v_from, v_to);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', v_name, p_table, v_from, v_to);
+    EXECUTE format('ALTER TABLE %I ENABLE ROW LEVEL SECURITY', v_name);
+    EXECUTE format('INSERT INTO %I SELECT * FROM partition_rows', v_name);
+    DROP TABLE partition_rows;
+    RETURN v_name;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Crea las particiones del mes actual y de los p_premake_months siguientes y
+-- elimina las anteriores a los p_retention_months meses previos al actual
+-- (0 = conservar todo). Eliminar una partición es una operación de catálogo:
+-- sin DELETE fila a fila ni filas muertas para VACUUM. Devuelve {created, dropped}.
+CREATE OR REPLACE FUNCTION maintain_monthly_partitions(p_table TEXT, p_retention_months INTEGER,
+                                                       p_premake_months INTEGER DEFAULT 3)
+RETURNS JSONB AS $$
+DECLARE
+    v_current DATE := date_trunc('month', NOW() AT TIME ZONE 'UTC')::date;
+    v_cutoff DATE;
+    v_created TEXT[] := '{}';
+    v_dropped TEXT[] := '{}';
+    v_name TEXT;
+BEGIN
+    IF p_table NOT IN ('notifications', 'activity_log') THEN
+        RAISE EXCEPTION 'Tabla no particionada por mes: %', p_table;
+    END IF;
+    FOR i IN 0..p_premake_months LOOP
+        v_name := create_monthly_partition(p_table, (v_current + make_interval(months => i))::date);
+        IF v_name IS NOT NULL THEN
+            v_created := v_created || v_name;
+        END IF;
+    END LOOP;
+
+    IF p_retention_months > 0 THEN
+        v_cutoff := (v_current - make_interval(months => p_retention_months))::date;
+        FOR v_name IN
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = p_table::regclass AND c.relname ~ ('^' || p_table || '_p[0-9]{6}$')
+              AND to_date(right(c.relname, 6), 'YYYYMM') < v_cutoff
+            ORDER BY c.relname
+        LOOP
+            EXECUTE format('DROP TABLE %I', v_name);
+            v_dropped := v_dropped || v_name;
+        END LOOP;
+        EXECUTE format('DELETE FROM %I WHERE created_at < %L', p_table || '_default',
+                       v_cutoff::timestamp AT TIME ZONE 'UTC');
+    END IF;
+    RETURN jsonb_build_object('created', to_jsonb(v_created), 'dropped', to_jsonb(v_dropped));
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Filas de las tablas anteriores a particionar (solo si existen) y particiones
+-- de los próximos meses
+DO $$
+DECLARE
+    v_table TEXT;
+    v_month DATE;
+    v_columns TEXT;
+BEGIN
+    FOREACH v_table IN ARRAY ARRAY['notifications', 'activity_log'] LOOP
+        IF to_regclass(v_table || '_unpartitioned') IS NOT NULL THEN
+            FOR v_month IN EXECUTE format(
+                'SELECT DISTINCT date_trunc(''month'', COALESCE(created_at, NOW()) AT TIME ZONE ''UTC'')::date FROM %I',
+                v_table || '_unpartitioned')
+            LOOP
+                PERFORM create_monthly_partition(v_table, v_month);
+            END LOOP;
+            SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO v_columns
+            FROM pg_attribute WHERE attrelid = v_table::regclass AND attnum > 0 AND NOT attisdropped;
+            EXECUTE format('UPDATE %I SET created_at = NOW() WHERE created_at IS NULL', v_table || '_unpartitioned');
+            EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM %I', v_table, v_columns, v_columns,
+                           v_table || '_unpartitioned');
+            EXECUTE format('DROP TABLE %I', v_table || '_unpartitioned');
+        END IF;
+    END LOOP;
+END $$;
+SELECT maintain_monthly_partitions('notifications', 0);
+SELECT maintain_monthly_partitions('activity_log', 0);
 
 -- Función para actualizar updated_at automáticamente
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -159,6 +399,25 @@ BEGIN
 END;
 $$ language 'plpgsql';
 
+-- Igual que la anterior, pero un cambio que solo toca columnas mantenidas por
+-- el sistema (el contador comment_count o el deadline_status del barrido de
+-- vencimientos) no cuenta como modificación de la fila. time_range se excluye
+-- porque en un trigger BEFORE las columnas generadas aún no están calculadas.
+-- Cada modificación incrementa también version, que la API devuelve como ETag
+-- y exige en If-Match (ver etags.py).
+CREATE OR REPLACE FUNCTION update_updated_at_unless_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF to_jsonb(NEW) - 'comment_count' - 'deadline_status' - 'time_range' - 'updated_at' - 'change_xid' - 'version'
+       = to_jsonb(OLD) - 'comment_count' - 'deadline_status' - 'time_range' - 'updated_at' - 'change_xid' - 'version' THEN
+        RETURN NEW;
+    END IF;
+    NEW.updated_at = NOW();
+    NEW.version = OLD.version + 1;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
 -- Triggers para actualizar updated_at
 CREATE TRIGGER update_users_updated_at BEFORE UPDATE ON users
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
@@ -166,24 +425,113 @@ CREATE TRIGGER update_users_updated_at BEFORE UPDATE ON users
 CREATE TRIGGER update_categories_updated_at BEFORE UPDATE ON categories
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+DROP TRIGGER IF EXISTS update_projects_updated_at ON projects;
 CREATE TRIGGER update_projects_updated_at BEFORE UPDATE ON projects
-    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_unless_counters();
 
+DROP TRIGGER IF EXISTS update_tasks_updated_at ON tasks;
 CREATE TRIGGER update_tasks_updated_at BEFORE UPDATE ON tasks
-    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_unless_counters();
 
 CREATE TRIGGER update_comments_updated_at BEFORE UPDATE ON comments
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Posición de cambio de proyectos y tareas: id de la transacción que escribió
+-- la fila por última vez (incluidos los contadores, que el frontend también cachea)
+CREATE OR REPLACE FUNCTION touch_change_xid()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.change_xid = pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS touch_projects_change_xid ON projects;
+CREATE TRIGGER touch_projects_change_xid BEFORE INSERT OR UPDATE ON projects
+    FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+
+DROP TRIGGER IF EXISTS touch_tasks_change_xid ON tasks;
+CREATE TRIGGER touch_tasks_change_xid BEFORE INSERT OR UPDATE ON tasks
+    FOR EACH ROW EXECUTE FUNCTION touch_change_xid();
+
+-- Lápida de cada proyecto o tarea borrado. Las tareas borradas en cascada con
+-- su proyecto ya no lo encuentran y solo llevan a su responsable: el resto lo
+-- cubre la lápida del proyecto (el cliente descarta sus tareas).
+CREATE OR REPLACE FUNCTION record_deletion()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_project_id UUID;
+    v_audience UUID[];
+BEGIN
+    IF TG_TABLE_NAME = 'projects' THEN
+        v_project_id := OLD.id;
+        v_audience := COALESCE(OLD.assigned_to, '{}') || OLD.created_by;
+    ELSE
+        v_project_id := OLD.project_id;
+        SELECT COALESCE(p.assigned_to, '{}') || p.created_by INTO v_audience FROM projects p WHERE p.id = OLD.project_id;
+        v_audience := COALESCE(v_audience, '{}') || OLD.assigned_to;
+    END IF;
+    INSERT INTO deleted_records (entity_id, entity_type, project_id, audience)
+    VALUES (OLD.id, rtrim(TG_TABLE_NAME, 's'), v_project_id, array_remove(v_audience, NULL))
+    ON CONFLICT (entity_id) DO UPDATE SET entity_type = excluded.entity_type, project_id = excluded.project_id,
+        audience = excluded.audience, change_xid = excluded.change_xid, deleted_at = excluded.deleted_at;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS record_projects_deletion ON projects;
+CREATE TRIGGER record_projects_deletion AFTER DELETE ON projects
+    FOR EACH ROW EXECUTE FUNCTION record_deletion();
+
+DROP TRIGGER IF EXISTS record_tasks_deletion ON tasks;
+CREATE TRIGGER record_tasks_deletion AFTER DELETE ON tasks
+    FOR EACH ROW EXECUTE FUNCTION record_deletion();
+
+-- Miembros de un proyecto tras crearlo o cambiar su creador o sus asignados.
+-- Los ids de assigned_to sin usuario (el array no tiene FK) se ignoran.
+CREATE OR REPLACE FUNCTION sync_project_members()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM project_members m
+    WHERE m.project_id = NEW.id
+      AND m.user_id IS DISTINCT FROM NEW.created_by
+      AND NOT m.user_id = ANY(COALESCE(NEW.assigned_to, '{}'));
+    INSERT INTO project_members (project_id, user_id, role)
+    SELECT NEW.id, u.id, CASE WHEN u.id = NEW.created_by THEN 'owner' ELSE 'member' END
+    FROM users u
+    WHERE u.id = NEW.created_by OR u.id = ANY(COALESCE(NEW.assigned_to, '{}'))
+    ON CONFLICT (project_id, user_id) DO UPDATE SET role = excluded.role
+    WHERE project_members.role <> excluded.role;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS sync_projects_members ON projects;
+CREATE TRIGGER sync_projects_members AFTER INSERT OR UPDATE OF created_by, assigned_to ON projects
+    FOR EACH ROW EXECUTE FUNCTION sync_project_members();
+
+-- Miembros de los proyectos existentes (bases creadas antes de project_members; idempotente)
+INSERT INTO project_members (project_id, user_id, role)
+SELECT p.id, u.id, CASE WHEN u.id = p.created_by THEN 'owner' ELSE 'member' END
+FROM projects p
+JOIN users u ON u.id = p.created_by OR u.id = ANY(COALESCE(p.assigned_to, '{}'))
+ON CONFLICT (project_id, user_id) DO NOTHING;
+
 -- Función para calcular progreso de proyecto basado en tareas
+-- (las tareas completadas que están en el archivo siguen contando)
 CREATE OR REPLACE FUNCTION calculate_project_progress(project_uuid UUID)
 RETURNS INTEGER AS $$
 DECLARE
     total_tasks INTEGER;
     completed_tasks INTEGER;
+    archived_tasks_count INTEGER;
     progress_percentage INTEGER;
 BEGIN
-    SELECT COUNT(*) INTO total_tasks
+    SELECT COUNT(*) INTO archived_tasks_count
+    FROM archived_tasks
+    WHERE project_id = project_uuid AND is_root;
+
+    SELECT COUNT(*) + archived_tasks_count INTO total_tasks
     FROM tasks
     WHERE project_id = project_uuid AND parent_task_id IS NULL;
     
@@ -191,7 +539,7 @@ BEGIN
         RETURN 0;
     END IF;
     
-    SELECT COUNT(*) INTO completed_tasks
+    SELECT COUNT(*) + archived_tasks_count INTO completed_tasks
     FROM tasks
     WHERE project_id = project_uuid 
     AND parent_task_id IS NULL 
@@ -215,10 +563,520 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Solo las columnas que afectan al cálculo (no, p. ej., comment_count)
+DROP TRIGGER IF EXISTS trigger_update_project_progress ON tasks;
 CREATE TRIGGER trigger_update_project_progress
-    AFTER INSERT OR UPDATE OR DELETE ON tasks
+    AFTER INSERT OR DELETE OR UPDATE OF status, project_id, parent_task_id ON tasks
     FOR EACH ROW EXECUTE FUNCTION update_project_progress();
 
+-- Contadores de comentarios de tareas y proyectos, mantenidos de forma incremental
+CREATE OR REPLACE FUNCTION update_comment_counts()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.task_id IS NOT NULL THEN
+            UPDATE tasks SET comment_count = comment_count + 1 WHERE id = NEW.task_id;
+        ELSE
+            UPDATE projects SET comment_count = comment_count + 1 WHERE id = NEW.project_id;
+        END IF;
+        RETURN NEW;
+    END IF;
+    
+    IF OLD.task_id IS NOT NULL THEN
+        UPDATE tasks SET comment_count = comment_count - 1 WHERE id = OLD.task_id;
+    ELSE
+        UPDATE projects SET comment_count = comment_count - 1 WHERE id = OLD.project_id;
+    END IF;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_update_comment_counts ON comments;
+CREATE TRIGGER trigger_update_comment_counts
+    AFTER INSERT OR DELETE ON comments
+    FOR EACH ROW EXECUTE FUNCTION update_comment_counts();
+
+-- Recalcular los contadores existentes (idempotente)
+UPDATE tasks t SET comment_count = c.total
+FROM (SELECT task_id, COUNT(*) AS total FROM comments WHERE task_id IS NOT NULL GROUP BY task_id) c
+WHERE t.id = c.task_id AND t.comment_count <> c.total;
+UPDATE projects p SET comment_count = c.total
+FROM (SELECT project_id, COUNT(*) AS total FROM comments WHERE project_id IS NOT NULL GROUP BY project_id) c
+WHERE p.id = c.project_id AND p.comment_count <> c.total;
+
+-- Hilo de comentarios de una tarea o de un proyecto en una sola consulta:
+-- una página de comentarios raíz (keyset ascendente por created_at, id) y
+-- todas sus respuestas a cualquier profundidad, en orden de lectura.
+CREATE OR REPLACE FUNCTION get_comment_thread(
+    p_task_id UUID DEFAULT NULL,
+    p_project_id UUID DEFAULT NULL,
+    p_limit INTEGER DEFAULT 20,
+    p_after_created_at TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_after_id UUID DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    content TEXT,
+    project_id UUID,
+    task_id UUID,
+    created_by UUID,
+    parent_comment_id UUID,
+    is_edited BOOLEAN,
+    created_at TIMESTAMP WITH TIME ZONE,
+    updated_at TIMESTAMP WITH TIME ZONE,
+    root_id UUID,
+    depth INTEGER
+) AS $$
+BEGIN
+    -- SQL dinámico para que cada llamada se planifique con la columna concreta
+    -- y use el índice parcial correspondiente
+    RETURN QUERY EXECUTE format($q$
+        WITH RECURSIVE roots AS (
+            SELECT c.* FROM comments c
+            WHERE c.%1$I = $1 AND c.parent_comment_id IS NULL
+              AND ($2::timestamptz IS NULL OR (c.created_at, c.id) > ($2, $3))
+            ORDER BY c.created_at, c.id
+            LIMIT $4
+        ), thread AS (
+            SELECT r.*, r.id AS root_id, 0 AS depth,
+                   ARRAY[to_char(r.created_at AT TIME ZONE 'UTC', 'YYYYMMDDHH24MISSUS') || r.id::text] AS sort_path
+            FROM roots r
+            UNION ALL
+            SELECT c.*, t.root_id, t.depth + 1,
+                   t.sort_path || (to_char(c.created_at AT TIME ZONE 'UTC', 'YYYYMMDDHH24MISSUS') || c.id::text)
+            FROM comments c
+            JOIN thread t ON c.parent_comment_id = t.id
+        )
+        SELECT id, content, project_id, task_id, created_by, parent_comment_id, is_edited,
+               created_at, updated_at, root_id, depth
+        FROM thread
+        ORDER BY sort_path
+    $q$, CASE WHEN p_task_id IS NOT NULL THEN 'task_id' ELSE 'project_id' END)
+    USING COALESCE(p_task_id, p_project_id), p_after_created_at, p_after_id, p_limit;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Línea de tiempo de los proyectos de un usuario: tareas cuyo time_range se
+-- solapa con [p_from, p_to], ordenadas por (grupo, inicio, id) y paginadas por
+-- keyset. El grupo es el proyecto o el responsable ('' si no tiene).
+CREATE OR REPLACE FUNCTION get_timeline(
+    p_user_id UUID,
+    p_from TIMESTAMP WITH TIME ZONE,
+    p_to TIMESTAMP WITH TIME ZONE,
+    p_project_id UUID DEFAULT NULL,
+    p_group_by TEXT DEFAULT 'project',
+    p_limit INTEGER DEFAULT 200,
+    p_after_group TEXT DEFAULT NULL,
+    p_after_start TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_after_id UUID DEFAULT NULL
+)
+RETURNS TABLE (
+    group_key TEXT,
+    range_start TIMESTAMP WITH TIME ZONE,
+    id UUID,
+    title VARCHAR,
+    project_id UUID,
+    assigned_to UUID,
+    status VARCHAR,
+    priority VARCHAR,
+    progress INTEGER,
+    start_date TIMESTAMP WITH TIME ZONE,
+    due_date TIMESTAMP WITH TIME ZONE,
+    deadline_status VARCHAR
+) AS $$
+    SELECT g.group_key, lower(t.time_range), t.id, t.title, t.project_id, t.assigned_to, t.status,
+           t.priority, t.progress, t.start_date, t.due_date, t.deadline_status
+    FROM tasks t
+    JOIN projects p ON p.id = t.project_id
+    CROSS JOIN LATERAL (
+        SELECT CASE WHEN p_group_by = 'assignee' THEN COALESCE(t.assigned_to::text, '')
+                    ELSE t.project_id::text END AS group_key
+    ) g
+    WHERE t.time_range && tstzrange(p_from, p_to, '[]')
+      AND (p_project_id IS NULL OR t.project_id = p_project_id)
+      AND EXISTS (SELECT 1 FROM project_members m WHERE m.project_id = p.id AND m.user_id = p_user_id)
+      AND (p_after_group IS NULL
+           OR (g.group_key, lower(t.time_range), t.id) > (p_after_group, p_after_start, p_after_id))
+    ORDER BY g.group_key, lower(t.time_range), t.id
+    LIMIT p_limit
+$$ LANGUAGE sql STABLE;
+
+-- Cambios visibles para un usuario posteriores a la posición (p_after_xid,
+-- p_after_kind, p_after_id), como {horizon, changes: [{kind, position, id,
+-- row}]} ordenados por ese keyset. Solo se devuelven posiciones anteriores al
+-- xmin de la instantánea (horizon): ninguna transacción aún abierta puede
+-- escribir ya una posición menor, así que lo que falta llega en la llamada
+-- siguiente. Las comparaciones de texto usan COLLATE "C" (mismo orden que Python).
+CREATE OR REPLACE FUNCTION get_changes(
+    p_user_id UUID,
+    p_after_xid TEXT DEFAULT '0',
+    p_after_kind TEXT DEFAULT '',
+    p_after_id TEXT DEFAULT '',
+    p_limit INTEGER DEFAULT 501
+)
+RETURNS JSONB AS $$
+    WITH horizon AS (
+        SELECT pg_snapshot_xmin(pg_current_snapshot()) AS xmin
+    ), changes AS (
+        (SELECT 'deleted'::text AS kind, d.change_xid AS position, d.entity_id::text AS id,
+                to_jsonb(d) - 'audience' - 'change_xid' AS row
+         FROM deleted_records d, horizon h
+         WHERE d.change_xid >= p_after_xid::xid8 AND d.change_xid < h.xmin
+           AND (d.change_xid, 'deleted' COLLATE "C", d.entity_id::text COLLATE "C")
+               > (p_after_xid::xid8, p_after_kind, p_after_id)
+           AND p_user_id = ANY(d.audience)
+         ORDER BY d.change_xid, d.entity_id::text COLLATE "C"
+         LIMIT p_limit)
+        UNION ALL
+        (SELECT 'project', p.change_xid, p.id::text, to_jsonb(p) - 'change_xid'
+         FROM projects p, horizon h
+         WHERE p.change_xid >= p_after_xid::xid8 AND p.change_xid < h.xmin
+           AND (p.change_xid, 'project' COLLATE "C", p.id::text COLLATE "C")
+               > (p_after_xid::xid8, p_after_kind, p_after_id)
+           AND EXISTS (SELECT 1 FROM project_members m WHERE m.project_id = p.id AND m.user_id = p_user_id)
+         ORDER BY p.change_xid, p.id::text COLLATE "C"
+         LIMIT p_limit)
+        UNION ALL
+        (SELECT 'task', t.change_xid, t.id::text, to_jsonb(t) - 'change_xid' - 'time_range'
+         FROM tasks t JOIN projects p ON p.id = t.project_id, horizon h
+         WHERE t.change_xid >= p_after_xid::xid8 AND t.change_xid < h.xmin
+           AND (t.change_xid, 'task' COLLATE "C", t.id::text COLLATE "C")
+               > (p_after_xid::xid8, p_after_kind, p_after_id)
+           AND EXISTS (SELECT 1 FROM project_members m WHERE m.project_id = p.id AND m.user_id = p_user_id)
+         ORDER BY t.change_xid, t.id::text COLLATE "C"
+         LIMIT p_limit)
+    ), page AS (
+        SELECT * FROM changes
+        ORDER BY position, kind COLLATE "C", id COLLATE "C"
+        LIMIT p_limit
+    )
+    SELECT jsonb_build_object(
+        'horizon', (SELECT xmin::text FROM horizon),
+        'changes', COALESCE(
+            (SELECT jsonb_agg(jsonb_build_object('kind', kind, 'position', position::text, 'id', id, 'row', row)
+                              ORDER BY position, kind COLLATE "C", id COLLATE "C") FROM page),
+            '[]'::jsonb)
+    );
+$$ LANGUAGE sql STABLE;
+
+-- Toma o renueva el lease de un trabajo periódico: solo si está libre, ha
+-- caducado o ya es de p_owner. Devuelve si p_owner lo posee tras la llamada.
+CREATE OR REPLACE FUNCTION acquire_scheduler_lease(
+    p_name VARCHAR,
+    p_owner TEXT,
+    p_ttl_seconds DOUBLE PRECISION
+)
+RETURNS BOOLEAN AS $$
+    WITH acquired AS (
+        INSERT INTO scheduler_leases (name, owner, expires_at)
+        VALUES (p_name, p_owner, NOW() + make_interval(secs => p_ttl_seconds))
+        ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+        WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.expires_at < NOW()
+        RETURNING 1
+    )
+    SELECT EXISTS (SELECT 1 FROM acquired);
+$$ LANGUAGE sql SECURITY DEFINER;
+
+-- SECURITY DEFINER: solo la service role (con la clave anon cualquiera podría
+-- quedarse con el lease de un trabajo por /rpc y bloquearlo). El planificador
+-- de main_supabase.py la llama con el cliente administrativo.
+REVOKE EXECUTE ON FUNCTION acquire_scheduler_lease(VARCHAR, TEXT, DOUBLE PRECISION) FROM PUBLIC;
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'anon') THEN
+        REVOKE EXECUTE ON FUNCTION acquire_scheduler_lease(VARCHAR, TEXT, DOUBLE PRECISION) FROM anon, authenticated;
+    END IF;
+END $$;
+
+-- Usuarios activos cuyo nombre de usuario, nombre o email empieza por p_prefix
+-- (sin distinguir mayúsculas), ordenados por el primer término que coincide.
+-- Es la alternativa de GET /users/search cuando la API no tiene el directorio
+-- en memoria (ver user_search.py). Cada rama recorre solo el rango
+-- [prefijo, prefijo || U+10FFFF) de su índice text_pattern_ops y para en
+-- p_limit filas; una consulta con LIKE y un parámetro no usaría el índice.
+CREATE OR REPLACE FUNCTION search_users(p_prefix TEXT, p_limit INTEGER DEFAULT 10)
+RETURNS TABLE (id UUID, name VARCHAR, username VARCHAR, profile_photo TEXT) AS $$
+    WITH bounds AS (
+        SELECT lower(p_prefix) AS low, lower(p_prefix) || chr(1114111) AS high
+    ), matches AS (
+        (SELECT u.id, lower(u.username) AS term FROM users u, bounds b
+         WHERE lower(u.username) ~>=~ b.low AND lower(u.username) ~<~ b.high AND u.is_active
+         ORDER BY lower(u.username) USING ~<~ LIMIT p_limit)
+        UNION ALL
+        (SELECT u.id, lower(u.name) FROM users u, bounds b
+         WHERE lower(u.name) ~>=~ b.low AND lower(u.name) ~<~ b.high AND u.is_active
+         ORDER BY lower(u.name) USING ~<~ LIMIT p_limit)
+        UNION ALL
+        (SELECT u.id, lower(u.email) FROM users u, bounds b
+         WHERE lower(u.email) ~>=~ b.low AND lower(u.email) ~<~ b.high AND u.is_active
+         ORDER BY lower(u.email) USING ~<~ LIMIT p_limit)
+    ), best AS (
+        SELECT m.id, min(m.term COLLATE "C") AS term FROM matches m GROUP BY m.id
+    )
+    SELECT u.id, u.name, u.username, u.profile_photo
+    FROM best JOIN users u ON u.id = best.id
+    ORDER BY best.term COLLATE "C", u.id
+    LIMIT p_limit;
+$$ LANGUAGE sql STABLE;
+
+-- Lote de altas, cambios y bajas de tareas y proyectos (POST /batch) en una
+-- sola transacción: si una operación falla no se aplica ninguna. p_operations
+-- es un array ordenado de {op: create|update|delete, entity: task|project,
+-- id, data, version}; la API ya ha validado las columnas de data y los
+-- permisos. Un update con version solo se aplica si la fila sigue en esa
+-- versión. Devuelve la fila resultante de cada operación, en el mismo orden.
+CREATE OR REPLACE FUNCTION apply_batch(p_operations JSONB)
+RETURNS SETOF JSONB AS $$
+DECLARE
+    operation JSONB;
+    target TEXT;
+    column_list TEXT;
+    result JSONB;
+BEGIN
+    FOR operation IN SELECT value FROM jsonb_array_elements(p_operations) LOOP
+        target := CASE operation->>'entity' WHEN 'task' THEN 'tasks' WHEN 'project' THEN 'projects' END;
+        IF target IS NULL THEN
+            RAISE EXCEPTION 'Entidad no válida: %', operation->>'entity';
+        END IF;
+        SELECT string_agg(quote_ident(key), ', ') INTO column_list
+        FROM jsonb_object_keys(CASE jsonb_typeof(operation->'data') WHEN 'object' THEN operation->'data' ELSE '{}' END) AS key;
+
+        IF operation->>'op' = 'create' THEN
+            EXECUTE format('INSERT INTO %I (%s) SELECT %s FROM jsonb_populate_record(NULL::%I, $1) RETURNING to_jsonb(%I.*)',
+                           target, column_list, column_list, target, target)
+            INTO result USING operation->'data';
+        ELSIF operation->>'op' = 'update' THEN
+            EXECUTE format('UPDATE %I SET (%s) = (SELECT %s FROM jsonb_populate_record(NULL::%I, $1)) '
+                           'WHERE id = $2 AND ($3::int IS NULL OR version = $3::int) RETURNING to_jsonb(%I.*)',
+                           target, column_list, column_list, target, target)
+            INTO result USING operation->'data', (operation->>'id')::uuid, (operation->>'version')::int;
+        ELSIF operation->>'op' = 'delete' THEN
+            EXECUTE format('DELETE FROM %I WHERE id = $1 RETURNING to_jsonb(%I.*)', target, target)
+            INTO result USING (operation->>'id')::uuid;
+        ELSE
+            RAISE EXCEPTION 'Operación no válida: %', operation->>'op';
+        END IF;
+
+        IF result IS NULL AND operation->>'op' = 'update' AND operation->>'version' IS NOT NULL THEN
+            RAISE EXCEPTION 'La versión de % % ha cambiado', operation->>'entity', operation->>'id'
+                USING ERRCODE = 'serialization_failure';
+        END IF;
+        IF result IS NULL THEN
+            RAISE EXCEPTION 'No existe % %', operation->>'entity', operation->>'id' USING ERRCODE = 'no_data_found';
+        END IF;
+        RETURN NEXT result;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- PUT /tasks/{id} vía PostgREST: el mismo UPDATE de una sola sentencia que
+-- UPDATE_TASK_SQL en pg_direct.py, con los permisos de can_edit_task
+-- (creador o asignado del proyecto, o responsable de la tarea) y la versión
+-- leída (NULL = cualquiera) en el WHERE. p_changes solo trae columnas
+-- editables, ya validadas por la API. Devuelve {row, previous} o NULL si no
+-- ha modificado nada (no existe, sin permisos o la versión ha cambiado).
+CREATE OR REPLACE FUNCTION update_task_checked(p_task_id UUID, p_user_id UUID, p_version INTEGER, p_changes JSONB)
+RETURNS JSONB AS $$
+DECLARE
+    column_list TEXT;
+    result JSONB;
+BEGIN
+    SELECT string_agg(quote_ident(key), ', ') INTO column_list FROM jsonb_object_keys(p_changes) AS key;
+    EXECUTE format('UPDATE tasks t SET (%s) = (SELECT %s FROM jsonb_populate_record(NULL::tasks, $4)) '
+                   'FROM (SELECT * FROM tasks WHERE id = $1 FOR UPDATE) old, projects p '
+                   'WHERE t.id = old.id AND p.id = t.project_id AND ($3::int IS NULL OR t.version = $3::int) '
+                   'AND (p.created_by = $2 OR $2 = ANY(p.assigned_to) OR t.assigned_to = $2) '
+                   'RETURNING jsonb_build_object(''row'', to_jsonb(t), ''previous'', to_jsonb(old))',
+                   column_list, column_list)
+    INTO result USING p_task_id, p_user_id, p_version, p_changes;
+    RETURN result;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Archivo (ver archive.py). Las filas se guardan con to_jsonb y se restauran
+-- con jsonb_populate_recordset sobre las columnas insertables (sin columnas
+-- generadas como time_range). Las autorreferencias (p_deferred) se insertan a
+-- NULL y se fijan al final, cuando ya existen todas las filas restauradas; si
+-- la fila referenciada ya no existe se quedan a NULL.
+CREATE OR REPLACE FUNCTION restore_rows(p_table REGCLASS, p_rows JSONB, p_deferred TEXT DEFAULT NULL)
+RETURNS VOID AS $$
+DECLARE
+    v_columns TEXT;
+BEGIN
+    IF COALESCE(jsonb_array_length(p_rows), 0) = 0 THEN
+        RETURN;
+    END IF;
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO v_columns
+    FROM pg_attribute
+    WHERE attrelid = p_table AND attnum > 0 AND NOT attisdropped AND attgenerated = '';
+    EXECUTE format('INSERT INTO %s (%s) SELECT %s FROM jsonb_populate_recordset(NULL::%s, $1)',
+                   p_table, v_columns, v_columns, p_table)
+    USING CASE WHEN p_deferred IS NULL THEN p_rows
+               ELSE (SELECT jsonb_agg(r - p_deferred) FROM jsonb_array_elements(p_rows) AS r) END;
+    IF p_deferred IS NOT NULL THEN
+        EXECUTE format('UPDATE %1$s t SET %2$I = r.%2$I FROM jsonb_populate_recordset(NULL::%1$s, $1) r
+                        WHERE t.id = r.id AND EXISTS (SELECT 1 FROM %1$s p WHERE p.id = r.%2$I)',
+                       p_table, p_deferred)
+        USING p_rows;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Un lote del archivo: hasta p_limit proyectos con is_archived (con sus
+-- tareas, comentarios y adjuntos, y las tareas suyas que ya estaban en
+-- archived_tasks) y hasta p_limit tareas completadas y sin cambios antes de
+-- p_completed_before que no tengan subtareas (con sus comentarios y adjuntos).
+-- Los candidatos se bloquean con SKIP LOCKED: los que otra transacción está
+-- escribiendo quedan para el lote siguiente. Los borrados de las tablas
+-- calientes dejan lápidas para GET /sync. Devuelve {projects: [id], tasks:
+-- [{id, project_id}]} con lo archivado.
+CREATE OR REPLACE FUNCTION archive_batch(p_limit INTEGER, p_completed_before TIMESTAMPTZ)
+RETURNS JSONB AS $$
+DECLARE
+    v_project projects;
+    v_task tasks;
+    v_projects JSONB := '[]';
+    v_tasks JSONB := '[]';
+BEGIN
+    FOR v_project IN
+        SELECT * FROM projects WHERE is_archived ORDER BY id LIMIT p_limit FOR UPDATE SKIP LOCKED
+    LOOP
+        WITH project_tasks AS (
+            SELECT * FROM tasks WHERE project_id = v_project.id
+        ), project_comments AS (
+            SELECT * FROM comments
+            WHERE project_id = v_project.id OR task_id IN (SELECT id FROM project_tasks)
+        ), project_attachments AS (
+            SELECT * FROM attachments
+            WHERE project_id = v_project.id OR task_id IN (SELECT id FROM project_tasks)
+               OR comment_id IN (SELECT id FROM project_comments)
+        ), loose AS (
+            DELETE FROM archived_tasks WHERE project_id = v_project.id RETURNING task, data, content_hashes
+        )
+        INSERT INTO archived_projects (id, members, project, data, content_hashes)
+        SELECT v_project.id,
+               array_remove(COALESCE(v_project.assigned_to, '{}') || v_project.created_by, NULL),
+               to_jsonb(v_project),
+               jsonb_build_object(
+                   'tasks', (SELECT COALESCE(jsonb_agg(to_jsonb(t)), '[]') FROM project_tasks t)
+                            || (SELECT COALESCE(jsonb_agg(l.task), '[]') FROM loose l),
+                   'comments', (SELECT COALESCE(jsonb_agg(to_jsonb(c)), '[]') FROM project_comments c)
+                               || (SELECT COALESCE(jsonb_agg(c), '[]') FROM loose l, jsonb_array_elements(l.data->'comments') c),
+                   'attachments', (SELECT COALESCE(jsonb_agg(to_jsonb(a)), '[]') FROM project_attachments a)
+                                  || (SELECT COALESCE(jsonb_agg(a), '[]') FROM loose l, jsonb_array_elements(l.data->'attachments') a)
+               ),
+               ARRAY(
+                   SELECT content_hash FROM project_attachments WHERE content_hash IS NOT NULL
+                   UNION SELECT unnest(l.content_hashes) FROM loose l
+               );
+        DELETE FROM projects WHERE id = v_project.id;
+        v_projects := v_projects || to_jsonb(v_project.id);
+    END LOOP;
+
+    FOR v_task IN
+        SELECT * FROM tasks t
+        WHERE t.status = 'completed' AND t.completed_date < p_completed_before AND t.updated_at < p_completed_before
+          AND NOT EXISTS (SELECT 1 FROM tasks s WHERE s.parent_task_id = t.id)
+        ORDER BY t.completed_date LIMIT p_limit FOR UPDATE SKIP LOCKED
+    LOOP
+        -- La entrada se crea antes del DELETE para que el progreso del proyecto la siga contando
+        WITH task_comments AS (
+            SELECT * FROM comments WHERE task_id = v_task.id
+        ), task_attachments AS (
+            SELECT * FROM attachments WHERE task_id = v_task.id OR comment_id IN (SELECT id FROM task_comments)
+        )
+        INSERT INTO archived_tasks (id, project_id, is_root, task, data, content_hashes)
+        SELECT v_task.id, v_task.project_id, v_task.parent_task_id IS NULL, to_jsonb(v_task),
+               jsonb_build_object(
+                   'comments', (SELECT COALESCE(jsonb_agg(to_jsonb(c)), '[]') FROM task_comments c),
+                   'attachments', (SELECT COALESCE(jsonb_agg(to_jsonb(a)), '[]') FROM task_attachments a)
+               ),
+               ARRAY(SELECT DISTINCT content_hash FROM task_attachments WHERE content_hash IS NOT NULL);
+        DELETE FROM tasks WHERE id = v_task.id;
+        v_tasks := v_tasks || jsonb_build_object('id', v_task.id, 'project_id', v_task.project_id);
+    END LOOP;
+
+    RETURN jsonb_build_object('projects', v_projects, 'tasks', v_tasks);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Devuelve un proyecto del archivo con todo su contenido (is_archived = false
+-- para que el lote siguiente no lo vuelva a archivar). Devuelve la fila del
+-- proyecto, o NULL si no está en el archivo.
+CREATE OR REPLACE FUNCTION restore_archived_project(p_project_id UUID)
+RETURNS JSONB AS $$
+DECLARE
+    v_entry archived_projects;
+    v_project JSONB;
+BEGIN
+    DELETE FROM archived_projects WHERE id = p_project_id RETURNING * INTO v_entry;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    PERFORM restore_rows('projects', jsonb_build_array(v_entry.project || '{"is_archived": false}'));
+    PERFORM restore_rows('tasks', v_entry.data->'tasks', 'parent_task_id');
+    PERFORM restore_rows('comments', v_entry.data->'comments', 'parent_comment_id');
+    PERFORM restore_rows('attachments', v_entry.data->'attachments');
+    -- Los INSERT de comentarios han vuelto a sumar sobre los contadores guardados
+    UPDATE tasks t SET comment_count = (SELECT COUNT(*) FROM comments c WHERE c.task_id = t.id)
+    WHERE t.project_id = p_project_id;
+    UPDATE projects p SET comment_count = (SELECT COUNT(*) FROM comments c WHERE c.project_id = p.id)
+    WHERE p.id = p_project_id
+    RETURNING to_jsonb(p.*) INTO v_project;
+    RETURN v_project;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Devuelve una tarea del archivo a su proyecto. updated_at pasa a ahora: la
+-- tarea no vuelve al archivo hasta que pase otra vez el plazo. Devuelve la
+-- fila de la tarea, o NULL si no está en el archivo.
+CREATE OR REPLACE FUNCTION restore_archived_task(p_task_id UUID)
+RETURNS JSONB AS $$
+DECLARE
+    v_entry archived_tasks;
+    v_task JSONB;
+BEGIN
+    DELETE FROM archived_tasks WHERE id = p_task_id RETURNING * INTO v_entry;
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+    PERFORM restore_rows('tasks', jsonb_build_array(v_entry.task || jsonb_build_object('updated_at', NOW())),
+                         'parent_task_id');
+    PERFORM restore_rows('comments', v_entry.data->'comments', 'parent_comment_id');
+    PERFORM restore_rows('attachments', v_entry.data->'attachments');
+    UPDATE tasks t SET comment_count = (SELECT COUNT(*) FROM comments c WHERE c.task_id = t.id)
+    WHERE t.id = p_task_id
+    RETURNING to_jsonb(t.*) INTO v_task;
+    RETURN v_task;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Las tareas sueltas del archivo (sin FK) se borran con su proyecto
+CREATE OR REPLACE FUNCTION drop_archived_tasks()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM archived_tasks WHERE project_id = OLD.id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS drop_projects_archived_tasks ON projects;
+CREATE TRIGGER drop_projects_archived_tasks AFTER DELETE ON projects
+    FOR EACH ROW EXECUTE FUNCTION drop_archived_tasks();
+
+-- Las funciones del archivo son SECURITY DEFINER: solo la service role puede
+-- ejecutarlas (con la clave anon cualquiera archivaría o restauraría cualquier
+-- proyecto por /rpc). La API las llama con el cliente administrativo.
+REVOKE EXECUTE ON FUNCTION archive_batch(INTEGER, TIMESTAMPTZ), restore_archived_project(UUID),
+    restore_archived_task(UUID) FROM PUBLIC;
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'anon') THEN
+        REVOKE EXECUTE ON FUNCTION archive_batch(INTEGER, TIMESTAMPTZ), restore_archived_project(UUID),
+            restore_archived_task(UUID) FROM anon, authenticated;
+    END IF;
+END $$;
+
 -- Insertar categorías por defecto
 INSERT INTO categories (name, description, color, icon) VALUES
 ('Desarrollo', 'Proyectos de desarrollo de software', '#3498db', 'code'),
@@ -242,6 +1100,25 @@ ALTER TABLE comments ENABLE ROW LEVEL SECURITY;
 ALTER TABLE attachments ENABLE ROW LEVEL SECURITY;
 ALTER TABLE notifications ENABLE ROW LEVEL SECURITY;
 ALTER TABLE activity_log ENABLE ROW LEVEL SECURITY;
+ALTER TABLE notifications_default ENABLE ROW LEVEL SECURITY;
+ALTER TABLE activity_log_default ENABLE ROW LEVEL SECURITY;
+
+-- Funciones de mantenimiento de particiones: solo la service role (las claves
+-- anon y authenticated no pueden llamarlas por /rpc)
+REVOKE EXECUTE ON FUNCTION create_monthly_partition(TEXT, DATE), maintain_monthly_partitions(TEXT, INTEGER, INTEGER)
+    FROM PUBLIC;
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'anon') THEN
+        REVOKE EXECUTE ON FUNCTION create_monthly_partition(TEXT, DATE), maintain_monthly_partitions(TEXT, INTEGER, INTEGER)
+            FROM anon, authenticated;
+    END IF;
+END $$;
+ALTER TABLE scheduler_leases ENABLE ROW LEVEL SECURITY; -- sin políticas: solo la service role
+ALTER TABLE deleted_records ENABLE ROW LEVEL SECURITY;
+ALTER TABLE project_members ENABLE ROW LEVEL SECURITY;
+ALTER TABLE archived_projects ENABLE ROW LEVEL SECURITY;
+ALTER TABLE archived_tasks ENABLE ROW LEVEL SECURITY;
 
 -- Políticas RLS básicas (los usuarios pueden ver sus propios datos)
 CREATE POLICY "Users can view own profile" ON users
@@ -253,10 +1130,13 @@ CREATE POLICY "Users can update own profile" ON users
 CREATE POLICY "Anyone can view categories" ON categories
     FOR SELECT USING (true);
 
+-- El creador se comprueba en la propia fila: al insertar con RETURNING la
+-- política se evalúa antes de que sync_projects_members cree los miembros
+DROP POLICY IF EXISTS "Users can view projects they created or are assigned to" ON projects;
 CREATE POLICY "Users can view projects they created or are assigned to" ON projects
     FOR SELECT USING (
-        auth.uid() = created_by OR 
-        auth.uid() = ANY(assigned_to)
+        auth.uid() = created_by OR
+        id IN (SELECT project_id FROM project_members WHERE user_id = auth.uid())
     );
 
 CREATE POLICY "Users can create projects" ON projects
@@ -265,21 +1145,23 @@ CREATE POLICY "Users can create projects" ON projects
 CREATE POLICY "Project creators can update their projects" ON projects
     FOR UPDATE USING (auth.uid() = created_by);
 
+DROP POLICY IF EXISTS "Users can view tasks in their projects" ON tasks;
 CREATE POLICY "Users can view tasks in their projects" ON tasks
     FOR SELECT USING (
         EXISTS (
             SELECT 1 FROM projects p 
             WHERE p.id = tasks.project_id 
-            AND (p.created_by = auth.uid() OR auth.uid() = ANY(p.assigned_to))
+            AND EXISTS (SELECT 1 FROM project_members m WHERE m.project_id = p.id AND m.user_id = auth.uid())
         )
     );
 
+DROP POLICY IF EXISTS "Users can create tasks in their projects" ON tasks;
 CREATE POLICY "Users can create tasks in their projects" ON tasks
     FOR INSERT WITH CHECK (
         EXISTS (
             SELECT 1 FROM projects p 
             WHERE p.id = tasks.project_id 
-            AND (p.created_by = auth.uid() OR auth.uid() = ANY(p.assigned_to))
+            AND EXISTS (SELECT 1 FROM project_members m WHERE m.project_id = p.id AND m.user_id = auth.uid())
         )
     );
 
@@ -294,18 +1176,19 @@ CREATE POLICY "Users can update tasks assigned to them or in their projects" ON
     );
 
 -- Comentarios: usuarios pueden ver comentarios en proyectos/tareas que pueden ver
+DROP POLICY IF EXISTS "Users can view comments in accessible projects/tasks" ON comments;
 CREATE POLICY "Users can view comments in accessible projects/tasks" ON comments
     FOR SELECT USING (
         (project_id IS NOT NULL AND EXISTS (
             SELECT 1 FROM projects p 
             WHERE p.id = comments.project_id 
-            AND (p.created_by = auth.uid() OR auth.uid() = ANY(p.assigned_to))
+            AND EXISTS (SELECT 1 FROM project_members m WHERE m.project_id = p.id AND m.user_id = auth.uid())
         )) OR
         (task_id IS NOT NULL AND EXISTS (
             SELECT 1 FROM tasks t 
             JOIN projects p ON p.id = t.project_id
             WHERE t.id = comments.task_id 
-            AND (p.created_by = auth.uid() OR auth.uid() = ANY(p.assigned_to))
+            AND EXISTS (SELECT 1 FROM project_members m WHERE m.project_id = p.id AND m.user_id = auth.uid())
         ))
     );
 
@@ -313,20 +1196,41 @@ CREATE POLICY "Users can create comments" ON comments
     FOR INSERT WITH CHECK (auth.uid() = created_by);
 
 -- Notificaciones: usuarios solo ven sus propias notificaciones
+DROP POLICY IF EXISTS "Users can view own notifications" ON notifications;
 CREATE POLICY "Users can view own notifications" ON notifications
     FOR SELECT USING (auth.uid() = user_id);
 
+DROP POLICY IF EXISTS "Users can update own notifications" ON notifications;
 CREATE POLICY "Users can update own notifications" ON notifications
     FOR UPDATE USING (auth.uid() = user_id);
 
 -- Log de actividad: usuarios pueden ver actividad de sus proyectos
+DROP POLICY IF EXISTS "Users can view activity in their projects" ON activity_log;
 CREATE POLICY "Users can view activity in their projects" ON activity_log
     FOR SELECT USING (
         entity_type = 'project' AND EXISTS (
             SELECT 1 FROM projects p 
             WHERE p.id = activity_log.entity_id::UUID 
-            AND (p.created_by = auth.uid() OR auth.uid() = ANY(p.assigned_to))
+            AND EXISTS (SELECT 1 FROM project_members m WHERE m.project_id = p.id AND m.user_id = auth.uid())
         )
     );
 
-COMMIT;
\ No newline at end of file
+-- Miembros: cada usuario ve sus propias membresías (las que usan las políticas de arriba)
+DROP POLICY IF EXISTS "Users can view own memberships" ON project_members;
+CREATE POLICY "Users can view own memberships" ON project_members
+    FOR SELECT USING (auth.uid() = user_id);
+
+-- Lápidas: cada usuario ve las de las filas que podía ver
+CREATE POLICY "Users can view their tombstones" ON deleted_records
+    FOR SELECT USING (auth.uid() = ANY(audience));
+
+-- Archivo: los miembros del proyecto al archivarlo, o los del proyecto activo de la tarea
+CREATE POLICY "Members can view archived projects" ON archived_projects
+    FOR SELECT USING (auth.uid() = ANY(members));
+
+CREATE POLICY "Members can view archived tasks" ON archived_tasks
+    FOR SELECT USING (
+        EXISTS (SELECT 1 FROM project_members m WHERE m.project_id = archived_tasks.project_id AND m.user_id = auth.uid())
+    );
+
+COMMIT;
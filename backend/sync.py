@@ -0,0 +1,175 @@
+# Sincronización incremental del caché local del frontend (GET /sync)
+#
+# Cada alta o cambio de un proyecto o una tarea recibe una posición de cambio
+# creciente, y cada baja deja una lápida con la suya en deleted_records. El
+# cliente guarda el cursor de la última respuesta y al reconectar lo envía en
+# ?since=<cursor> (también se acepta ?cursor=) y recibe solo lo que cambió
+# después: filas nuevas o modificadas y los ids borrados. Sin cursor se recibe
+# todo (sincronización completa).
+#   - SQLite: contador de sync_state que incrementan los triggers de projects
+#     y tasks dentro de la transacción de escritura. SQLite serializa las
+#     escrituras, así que el orden de las posiciones es el de confirmación
+#     (ver init_db en main.py).
+#   - Postgres: id de la transacción que escribió la fila (xid8). Solo se
+#     devuelven cambios de transacciones anteriores al xmin de la instantánea,
+#     porque ninguna transacción en curso puede añadir ya una posición menor;
+#     lo demás llega en la llamada siguiente (ver get_changes en
+#     supabase_schema.sql).
+# Las respuestas se paginan por keyset (posición, tipo, id). Las lápidas se
+# conservan RETENTION_DAYS días y un cursor más antiguo recibe reset y una
+# sincronización completa (el cliente descarta su copia).
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from pagination import decode_keyset, encode_keyset
+
+# Días que se conservan las lápidas (y validez máxima de un cursor)
+RETENTION_DAYS = float(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "30"))
+# Intervalo entre limpiezas de lápidas caducadas (s)
+PRUNE_SECONDS = float(os.getenv("SYNC_PRUNE_SECONDS", "3600"))
+# Cambios por respuesta
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+
+class SyncCursor(NamedTuple):
+    position: int
+    kind: str
+    entity_id: str
+    issued_at: int  # inicio de la sincronización que lo generó (s Unix)
+
+
+def decode_sync_cursor(cursor: Optional[str], now: Optional[float] = None) -> Tuple[SyncCursor, bool]:
+    """Cursor desde el que continuar y si hay que reiniciar la copia; ValueError si no es válido"""
+    now = int(now if now is not None else time.time())
+    start = SyncCursor(0, "", "", now)
+    if not cursor:
+        return start, False
+    position, kind, entity_id, issued_at = decode_keyset(cursor, 4)
+    try:
+        decoded = SyncCursor(int(position), str(kind), str(entity_id), int(issued_at))
+    except (TypeError, ValueError):
+        raise ValueError("Cursor inválido")
+    if now - decoded.issued_at > RETENTION_DAYS * 86400:
+        # Puede haber lápidas ya borradas posteriores al cursor
+        return start, True
+    return decoded, False
+
+
+def build_page(changes: List[tuple], limit: int, horizon: int, after: SyncCursor) -> Tuple[dict, Optional[str], bool]:
+    """Reparte los cambios (posición, tipo, id, fila) ordenados; se piden limit + 1 para saber si hay más
+
+    horizon es la primera posición que aún no se ha podido leer entera.
+    """
+    page = {"project": [], "task": [], "deleted": []}
+    for _, kind, _, row in changes[:limit]:
+        page[kind].append(row)
+    has_more = len(changes) > limit
+    if has_more:
+        # Las páginas siguientes conservan el inicio de la sincronización para la caducidad
+        position, kind, entity_id, _ = changes[limit - 1]
+        cursor = encode_keyset([str(position), kind, entity_id, after.issued_at])
+    else:
+        cursor = encode_keyset([str(horizon), "", "", int(time.time())])
+    return page, cursor, has_more
+
+
+# SQLite
+SQLITE_SOURCES = (
+    ("project", "projects", "id"),
+    ("task", "tasks", "id"),
+    ("deleted", "deleted_records", "entityId"),
+)
+
+SQLITE_CHANGES_SQL = """
+    SELECT * FROM {table}
+    WHERE changeSeq >= :position AND (changeSeq, '{kind}', {id_column}) > (:position, :kind, :entity_id)
+    ORDER BY changeSeq, {id_column}
+    LIMIT :limit
+"""
+
+
+def sqlite_sync(conn, cursor: Optional[str], limit: int) -> dict:
+    """Cambios posteriores al cursor en la base SQLite; ValueError si el cursor no es válido"""
+    after, reset = decode_sync_cursor(cursor)
+    params = {"position": after.position, "kind": after.kind, "entity_id": after.entity_id, "limit": limit + 1}
+    changes = []
+    # Una sola transacción de lectura: el horizonte y los cambios son de la misma instantánea
+    conn.execute("BEGIN")
+    try:
+        horizon = conn.execute("SELECT changeSeq FROM sync_state WHERE id = 1").fetchone()[0] + 1
+        for kind, table, id_column in SQLITE_SOURCES:
+            sql = SQLITE_CHANGES_SQL.format(table=table, kind=kind, id_column=id_column)
+            changes += [(row["changeSeq"], kind, row[id_column], dict(row)) for row in conn.execute(sql, params)]
+    finally:
+        conn.rollback()
+    changes.sort(key=lambda change: change[:3])
+    page, next_cursor, has_more = build_page(changes, limit, horizon, after)
+    return {
+        "projects": page["project"],
+        "tasks": page["task"],
+        "deleted": page["deleted"],
+        "cursor": next_cursor,
+        "hasMore": has_more,
+        "reset": reset,
+    }
+
+
+class SqliteTombstones:
+    """Limpieza periódica de las lápidas caducadas de SQLite (deletedAt en hora local)"""
+
+    def __init__(self, connect):
+        self.connect = connect
+
+    def _prune(self, cutoff: str) -> None:
+        with self.connect() as conn:
+            conn.execute("DELETE FROM deleted_records WHERE deletedAt < ?", (cutoff,))
+            conn.commit()
+
+    async def prune(self, context) -> None:
+        cutoff = datetime.now() - timedelta(days=RETENTION_DAYS)
+        await run_in_threadpool(self._prune, cutoff.isoformat())
+
+
+# Postgres / Supabase
+async def fetch_sync(client, pg, user_id: str, cursor: Optional[str], limit: int) -> dict:
+    """Cambios de los proyectos del usuario posteriores al cursor; ValueError si el cursor no es válido"""
+    after, reset = decode_sync_cursor(cursor)
+    params = {
+        "p_user_id": user_id,
+        "p_after_xid": str(after.position),
+        "p_after_kind": after.kind,
+        "p_after_id": after.entity_id,
+        "p_limit": limit + 1,
+    }
+    if pg.enabled:
+        result = await pg.changes(**params)
+    else:
+        result = await run_in_threadpool(lambda: client.rpc("get_changes", params).execute().data)
+    changes = [(int(c["position"]), c["kind"], c["id"], c["row"]) for c in result["changes"]]
+    page, next_cursor, has_more = build_page(changes, limit, int(result["horizon"]), after)
+    return {
+        "projects": page["project"],
+        "tasks": page["task"],
+        "deleted": page["deleted"],
+        "cursor": next_cursor,
+        "has_more": has_more,
+        "reset": reset,
+    }
+
+
+class SupabaseTombstones:
+    """Limpieza periódica de las lápidas caducadas de deleted_records"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def prune(self, context) -> None:
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS)).isoformat()
+        await run_in_threadpool(
+            lambda: self.client.table("deleted_records").delete().lt("deleted_at", cutoff).execute()
+        )
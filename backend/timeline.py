@@ -0,0 +1,147 @@
+# Vista de calendario / Gantt: tareas cuyo intervalo de fechas se solapa con
+# una ventana visible
+#
+# El intervalo de una tarea va de start_date a due_date (si solo tiene una de
+# las dos fechas, es un instante). La búsqueda de solapamientos usa un índice
+# de intervalos en cada backend:
+#   - Postgres: columna generada tasks.time_range (tstzrange) con índice GiST,
+#     consultada por la función get_timeline de supabase_schema.sql.
+#   - SQLite: tabla virtual R*Tree tasks_timeline mantenida por triggers
+#     (ver init_db en main.py).
+# Las filas se ordenan por (grupo, inicio, id) y se paginan por keyset: la
+# primera página trae las primeras tareas de los primeros grupos y el cliente
+# pide la siguiente al hacer scroll. Un grupo puede continuar en la página
+# siguiente (mismo key).
+from calendar import timegm
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from pagination import decode_keyset, encode_keyset
+
+# Ventana máxima de una consulta (días)
+MAX_WINDOW_DAYS = 732
+
+
+def parse_window(start: str, end: str) -> Tuple[datetime, datetime]:
+    """Valida la ventana (fechas ISO); ValueError si no es válida"""
+    try:
+        window_start, window_end = datetime.fromisoformat(start), datetime.fromisoformat(end)
+    except ValueError:
+        raise ValueError("Las fechas 'from' y 'to' deben estar en formato ISO 8601")
+    if (window_start.tzinfo is None) != (window_end.tzinfo is None):
+        raise ValueError("'from' y 'to' deben indicar zona horaria las dos o ninguna")
+    if window_end < window_start:
+        raise ValueError("'to' debe ser posterior a 'from'")
+    if (window_end - window_start).days > MAX_WINDOW_DAYS:
+        raise ValueError(f"La ventana no puede superar {MAX_WINDOW_DAYS} días")
+    return window_start, window_end
+
+
+def build_groups(rows: List[dict], limit: int, group_key: Callable[[dict], Optional[str]],
+                 cursor_values: Callable[[dict], list]) -> Tuple[List[dict], Optional[str]]:
+    """Agrupa filas ya ordenadas por grupo; se piden limit + 1 para saber si hay más"""
+    groups: List[dict] = []
+    for row in rows[:limit]:
+        key = group_key(row)
+        if not groups or groups[-1]["key"] != key:
+            groups.append({"key": key, "tasks": []})
+        groups[-1]["tasks"].append(row)
+    next_cursor = encode_keyset(cursor_values(rows[limit - 1])) if len(rows) > limit else None
+    return groups, next_cursor
+
+
+# SQLite
+def _epoch(value: datetime) -> int:
+    """Segundos Unix como los calcula strftime('%s') de SQLite (sin zona = UTC)"""
+    if value.tzinfo is None:
+        return timegm(value.timetuple())
+    return int(value.timestamp())
+
+
+SQLITE_GROUP_COLUMNS = {"project": "t.projectId", "assignee": "t.assignedTo"}
+
+SQLITE_TIMELINE_SQL = """
+    SELECT t.id, t.title, t.projectId, t.assignedTo, t.status, t.priority,
+           t.startDate, t.dueDate, t.deadlineStatus,
+           COALESCE({group}, '') AS groupKey, r.startAt, r.endAt
+    FROM tasks_timeline r
+    JOIN tasks t ON t.rowid = r.id
+    WHERE r.maxT >= :start AND r.minT <= :end
+      AND r.endAt >= :start AND r.startAt <= :end
+      {filters}
+    ORDER BY groupKey, r.startAt, t.id
+    LIMIT :limit
+"""
+
+
+def sqlite_timeline(conn, start: str, end: str, group_by: str, limit: int,
+                    project_id: Optional[str] = None, cursor: Optional[str] = None) -> dict:
+    """Página de la línea de tiempo desde la tabla R*Tree; ValueError si los parámetros no son válidos"""
+    window_start, window_end = parse_window(start, end)
+    params = {"start": _epoch(window_start), "end": _epoch(window_end), "limit": limit + 1}
+    filters = []
+    if project_id:
+        filters.append("AND t.projectId = :project_id")
+        params["project_id"] = project_id
+    if cursor:
+        params["after_group"], params["after_start"], params["after_id"] = decode_keyset(cursor, 3)
+        filters.append("AND (COALESCE({group}, ''), r.startAt, t.id) > (:after_group, :after_start, :after_id)")
+    group = SQLITE_GROUP_COLUMNS[group_by]
+    sql = SQLITE_TIMELINE_SQL.format(group=group, filters=" ".join(filters).format(group=group))
+    rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+    groups, next_cursor = build_groups(
+        rows, limit, lambda row: row["groupKey"] or None,
+        lambda row: [row["groupKey"], row["startAt"], row["id"]],
+    )
+    for group in groups:
+        for task in group["tasks"]:
+            for column in ("groupKey", "startAt", "endAt"):
+                del task[column]
+    return {"groups": groups, "nextCursor": next_cursor}
+
+
+# Postgres / Supabase
+TIMELINE_COLUMNS = ("id", "title", "project_id", "assigned_to", "status", "priority", "progress",
+                    "start_date", "due_date", "deadline_status")
+
+
+async def fetch_timeline(client, pg, user_id: str, start: str, end: str, group_by: str, limit: int,
+                         project_id: Optional[str] = None, cursor: Optional[str] = None) -> dict:
+    """Página de la línea de tiempo de los proyectos del usuario; ValueError si los parámetros no son válidos"""
+    window_start, window_end = parse_window(start, end)
+    if window_start.tzinfo is None:
+        window_start, window_end = (value.replace(tzinfo=timezone.utc) for value in (window_start, window_end))
+    after_group = after_start = after_id = None
+    if cursor:
+        after_group, after_start, after_id = decode_keyset(cursor, 3)
+        try:
+            datetime.fromisoformat(after_start)
+        except (TypeError, ValueError):
+            raise ValueError("Cursor inválido")
+    params = {
+        "p_user_id": user_id,
+        "p_from": window_start.isoformat(),
+        "p_to": window_end.isoformat(),
+        "p_project_id": project_id,
+        "p_group_by": group_by,
+        "p_limit": limit + 1,
+        "p_after_group": after_group,
+        "p_after_start": after_start,
+        "p_after_id": after_id,
+    }
+    if pg.enabled:
+        rows = await pg.timeline(**params)
+    else:
+        rows = await run_in_threadpool(lambda: client.rpc("get_timeline", params).execute().data)
+    groups, next_cursor = build_groups(
+        [{**{c: row.get(c) for c in TIMELINE_COLUMNS}, "_group": row["group_key"], "_start": row["range_start"]}
+         for row in rows],
+        limit, lambda row: row["_group"] or None,
+        lambda row: [row["_group"], row["_start"], row["id"]],
+    )
+    for group in groups:
+        for task in group["tasks"]:
+            del task["_group"], task["_start"]
+    return {"groups": groups, "next_cursor": next_cursor}
@@ -0,0 +1,111 @@
+# Búsqueda de usuarios por prefijo (selector de responsables, GET /users/search)
+#
+# La instantánea del directorio de usuarios (ver reference_data.py) lleva un
+# índice de prefijos: una lista ordenada de términos normalizados (nombre de
+# usuario, email, el nombre completo y el resto del nombre a partir de cada
+# palabra, para encontrar por apellido) con la fila de cada uno. Una búsqueda
+# es un bisect hasta el primer término >= prefijo y un recorrido hasta reunir
+# limit usuarios distintos: O(log n + limit) y sin consultas, del orden de
+# microsegundos con 100.000 usuarios. El índice se reconstruye con cada recarga
+# de la instantánea (al registrarse un usuario o al caducar).
+#
+# Si el directorio no se puede cargar se busca en la base de datos con
+# search_users (ver supabase_schema.sql), que recorre los índices
+# lower(columna) text_pattern_ops por rango; no ignora los acentos ni busca
+# por apellido.
+import unicodedata
+from bisect import bisect_left
+from typing import List
+
+from fastapi.concurrency import run_in_threadpool
+
+from reference_data import Snapshot
+
+# Columnas que se devuelven de cada usuario (el email solo se usa para buscar)
+DIRECTORY_COLUMNS = ("id", "name", "username", "profile_photo")
+LOAD_COLUMNS = "id, name, username, email, profile_photo"
+# Filas por página al cargar el directorio (PostgREST limita las filas de cada respuesta)
+PAGE_SIZE = 1000
+
+
+def normalize(text: str) -> str:
+    """Minúsculas y sin acentos, para comparar prefijos"""
+    if text.isascii():
+        return text.lower().strip()
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).strip()
+
+
+def search_terms(user: dict) -> List[str]:
+    terms = [normalize(user.get("username") or ""), normalize(user.get("email") or "")]
+    words = normalize(user.get("name") or "").split()
+    terms += [" ".join(words[i:]) for i in range(len(words))]
+    return [term for term in terms if term]
+
+
+class PrefixIndex:
+    """Términos ordenados con la posición de su usuario; búsqueda por bisect"""
+
+    def __init__(self, users: List[dict]):
+        entries = sorted({(term, position) for position, user in enumerate(users) for term in search_terms(user)})
+        self.terms = [term for term, _ in entries]
+        self.positions = [position for _, position in entries]
+
+    def search(self, prefix: str, limit: int) -> List[int]:
+        """Posiciones de hasta limit usuarios con algún término que empieza por prefix (por orden de término)"""
+        key = normalize(prefix)
+        if not key:
+            return []
+        found: dict = {}
+        terms, positions = self.terms, self.positions
+        for index in range(bisect_left(terms, key), len(terms)):
+            if not terms[index].startswith(key):
+                break
+            found.setdefault(positions[index], None)
+            if len(found) >= limit:
+                break
+        return list(found)
+
+
+class UserDirectorySnapshot(Snapshot):
+    """Directorio de usuarios activos sin email, con su índice de prefijos"""
+
+    def __init__(self, rows: List[dict]):
+        self.public = [{column: row.get(column) for column in DIRECTORY_COLUMNS} for row in rows]
+        super().__init__(rows, self.public)
+        self.index = PrefixIndex(rows)
+
+    def search(self, prefix: str, limit: int) -> List[dict]:
+        return [self.public[position] for position in self.index.search(prefix, limit)]
+
+
+def load_user_directory(client) -> List[dict]:
+    """Usuarios activos por páginas de keyset sobre id, ordenados por nombre"""
+    rows: List[dict] = []
+    last_id = None
+    while True:
+        query = client.table("users").select(LOAD_COLUMNS).eq("is_active", True)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = query.order("id").limit(PAGE_SIZE).execute().data
+        rows += page
+        if len(page) < PAGE_SIZE:
+            break
+        last_id = page[-1]["id"]
+    rows.sort(key=lambda row: (normalize(row.get("name") or ""), row["id"]))
+    return rows
+
+
+class SupabaseUserSearch:
+    """Búsqueda en la base de datos (search_users) cuando no hay directorio en memoria"""
+
+    def __init__(self, client, pg):
+        self.client = client
+        self.pg = pg
+
+    async def search(self, prefix: str, limit: int) -> List[dict]:
+        if self.pg.enabled:
+            return await self.pg.search_users(prefix, limit)
+        return await run_in_threadpool(
+            lambda: self.client.rpc("search_users", {"p_prefix": prefix, "p_limit": limit}).execute().data
+        )
@@ -0,0 +1,187 @@
+# Carga de trabajo y capacidad por persona (backend Supabase)
+#
+# Las columnas necesarias de las tareas asignadas que se solapan con la ventana
+# se leen en una sola consulta como arrays (array_agg con conexión directa) y el
+# cálculo se hace con NumPy, sin bucles por tarea:
+#   - las horas de cada tarea (estimated_hours, o actual_hours si no tiene
+#     estimación) se reparten a partes iguales entre los días de su intervalo
+#     [start_date, due_date]; el reparto se acumula con un array de diferencias
+#     por persona (np.bincount) y una suma acumulada por días,
+#   - los días se agrupan en semanas ISO (lunes a domingo, en UTC) y se marcan
+#     las semanas por encima de la capacidad semanal,
+#   - la precisión de las estimaciones compara horas estimadas y reales de las
+#     tareas completadas de la ventana.
+# El resultado se cachea por ventana y cada escritura de tareas lo invalida en
+# todos los workers (ver cache.py).
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from cache import SharedCache
+
+# Horas disponibles por persona y semana
+WEEKLY_CAPACITY_HOURS = float(os.getenv("WORKLOAD_WEEKLY_CAPACITY_HOURS", "40"))
+# Semanas por defecto y máximas de una consulta
+DEFAULT_WEEKS = 12
+MAX_WEEKS = 104
+# Validez máxima de un resultado cacheado
+CACHE_TTL_SECONDS = float(os.getenv("WORKLOAD_CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = 32
+# Filas por página al leer vía PostgREST
+PAGE_SIZE = 1000
+
+DAY_SECONDS = 86400.0
+
+
+def parse_week_window(start: Optional[str], end: Optional[str], today: Optional[date] = None) -> Tuple[date, int]:
+    """Lunes de la primera semana y número de semanas; ValueError si no es válida"""
+    try:
+        first = date.fromisoformat(start[:10]) if start else (today or datetime.now(timezone.utc).date())
+        last = date.fromisoformat(end[:10]) if end else first + timedelta(weeks=DEFAULT_WEEKS) - timedelta(days=1)
+    except ValueError:
+        raise ValueError("Las fechas 'from' y 'to' deben estar en formato ISO 8601")
+    if last < first:
+        raise ValueError("'to' debe ser posterior a 'from'")
+    monday = first - timedelta(days=first.weekday())
+    weeks = (last - monday).days // 7 + 1
+    if weeks > MAX_WEEKS:
+        raise ValueError(f"La ventana no puede superar {MAX_WEEKS} semanas")
+    return monday, weeks
+
+
+def _epoch(day: date) -> float:
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()
+
+
+def compute_workload(columns: Dict[str, np.ndarray], monday: date, weeks: int,
+                     capacity: float = WEEKLY_CAPACITY_HOURS) -> dict:
+    """Horas por persona y semana, sobreasignación y precisión de las estimaciones"""
+    n_days = weeks * 7
+    origin = _epoch(monday)
+    start_at, end_at = columns["start_at"], columns["end_at"]
+    # Con una sola fecha el intervalo es ese día
+    start_at = np.where(np.isnan(start_at), end_at, start_at)
+    end_at = np.where(np.isnan(end_at), start_at, end_at)
+    first_day = np.floor((np.minimum(start_at, end_at) - origin) / DAY_SECONDS)
+    last_day = np.floor((np.maximum(start_at, end_at) - origin) / DAY_SECONDS)
+    in_window = ~np.isnan(first_day) & (last_day >= 0) & (first_day < n_days)
+
+    users, user_index = np.unique(columns["assigned_to"][in_window], return_inverse=True)
+    n_users = len(users)
+    first_day, last_day = first_day[in_window].astype(np.int64), last_day[in_window].astype(np.int64)
+    estimated, actual = columns["estimated_hours"][in_window], columns["actual_hours"][in_window]
+    completed = columns["completed"][in_window]
+
+    # Reparto uniforme por días: +tasa el primer día visible, -tasa tras el último
+    hours = np.where(np.isnan(estimated), actual, estimated)
+    planned = ~np.isnan(hours) & (hours > 0)
+    rate = hours[planned] / (last_day[planned] - first_day[planned] + 1)
+    row = user_index[planned] * (n_days + 1)
+    diff = np.bincount(
+        np.concatenate([row + np.clip(first_day[planned], 0, n_days), row + np.clip(last_day[planned] + 1, 0, n_days)]),
+        weights=np.concatenate([rate, -rate]),
+        minlength=n_users * (n_days + 1),
+    ).reshape(n_users, n_days + 1)
+    weekly = np.cumsum(diff[:, :n_days], axis=1).reshape(n_users, weeks, 7).sum(axis=2)
+    weekly = np.round(weekly, 2) + 0.0  # sin -0.0 por los residuos de la suma
+    over = weekly > capacity
+
+    compared = completed & ~np.isnan(estimated) & ~np.isnan(actual) & (estimated > 0)
+    compared_count = np.bincount(user_index[compared], minlength=n_users)
+    estimated_sum = np.bincount(user_index[compared], weights=estimated[compared], minlength=n_users)
+    actual_sum = np.bincount(user_index[compared], weights=actual[compared], minlength=n_users)
+
+    week_starts = [(monday + timedelta(weeks=w)).isoformat() for w in range(weeks)]
+    result_users = []
+    for i, user_id in enumerate(users.tolist()):
+        result_users.append({
+            "user_id": user_id,
+            "weekly_hours": weekly[i].tolist(),
+            "total_hours": round(float(weekly[i].sum()), 2),
+            "peak_hours": float(weekly[i].max()) if weeks else 0.0,
+            "over_allocated_weeks": [week_starts[w] for w in np.flatnonzero(over[i]).tolist()],
+            "estimate_accuracy": {
+                "tasks": int(compared_count[i]),
+                "estimated_hours": round(float(estimated_sum[i]), 2),
+                "actual_hours": round(float(actual_sum[i]), 2),
+                # > 1: se tardó más de lo estimado
+                "ratio": round(float(actual_sum[i] / estimated_sum[i]), 3) if compared_count[i] else None,
+            },
+        })
+    return {
+        "from": monday.isoformat(),
+        "to": (monday + timedelta(days=n_days - 1)).isoformat(),
+        "weeks": week_starts,
+        "capacity_hours": capacity,
+        "over_allocated_users": int(over.any(axis=1).sum()),
+        "users": result_users,
+    }
+
+
+def _timestamp_seconds(value: Optional[str]) -> float:
+    if not value:
+        return np.nan
+    parsed = datetime.fromisoformat(value)
+    return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def _postgrest_columns(client, window_start: str, window_end: str) -> Dict[str, np.ndarray]:
+    """Lee las tareas de la ventana por páginas vía PostgREST y las pasa a columnas"""
+    rows = []
+    while True:
+        page = (
+            client.table("tasks").select("id, assigned_to, start_date, due_date, estimated_hours, actual_hours, status")
+            .neq("status", "cancelled")
+            # Prefiltro de solapamiento; el filtro exacto se hace en compute_workload
+            .or_(f'and(assigned_to.not.is.null,or(due_date.gte."{window_start}",start_date.gte."{window_start}"),'
+                 f'or(start_date.lt."{window_end}",and(start_date.is.null,due_date.lt."{window_end}")))')
+            .order("id").range(len(rows), len(rows) + PAGE_SIZE - 1).execute().data
+        )
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+    return {
+        "assigned_to": np.array([r["assigned_to"] for r in rows], dtype=object),
+        "start_at": np.array([_timestamp_seconds(r.get("start_date")) for r in rows], dtype=np.float64),
+        "end_at": np.array([_timestamp_seconds(r.get("due_date")) for r in rows], dtype=np.float64),
+        "estimated_hours": np.array([r.get("estimated_hours") for r in rows], dtype=np.float64),
+        "actual_hours": np.array([r.get("actual_hours") for r in rows], dtype=np.float64),
+        "completed": np.array([r.get("status") == "completed" for r in rows], dtype=bool),
+    }
+
+
+async def load_task_columns(client, pg, monday: date, weeks: int) -> Dict[str, np.ndarray]:
+    """Columnas de las tareas asignadas y no canceladas que se solapan con la ventana"""
+    window_start = datetime(monday.year, monday.month, monday.day, tzinfo=timezone.utc)
+    window_end = window_start + timedelta(weeks=weeks)
+    if not pg.enabled:
+        return await run_in_threadpool(_postgrest_columns, client, window_start.isoformat(), window_end.isoformat())
+    data = await pg.workload_columns(window_start.isoformat(), window_end.isoformat())
+    return {
+        "assigned_to": np.array(data["assigned_to"] or [], dtype=object),
+        "start_at": np.array(data["start_at"] or [], dtype=np.float64),
+        "end_at": np.array(data["end_at"] or [], dtype=np.float64),
+        "estimated_hours": np.array(data["estimated_hours"] or [], dtype=np.float64),
+        "actual_hours": np.array(data["actual_hours"] or [], dtype=np.float64),
+        "completed": np.array(data["completed"] or [], dtype=bool),
+    }
+
+
+class WorkloadCache:
+    """Resultados por ventana; invalidate() los descarta en todos los workers tras una escritura de tareas"""
+
+    def __init__(self, bus, ttl: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.cache = SharedCache("workload", bus, ttl, max_entries)
+
+    def invalidate(self) -> None:
+        self.cache.invalidate()
+
+    async def get(self, client, pg, monday: date, weeks: int) -> dict:
+        async def load() -> dict:
+            columns = await load_task_columns(client, pg, monday, weeks)
+            return await run_in_threadpool(compute_workload, columns, monday, weeks)
+
+        return await self.cache.aget_or_load((monday, weeks), load)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Compara dos ficheros de resultados de run_load.py (por ejemplo, de dos commits)
+
+Uso:
+    python benchmarks/compare.py results/antes.json results/despues.json
+"""
+
+import json
+import sys
+from typing import Optional
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def _delta(before: Optional[float], after: Optional[float]) -> str:
+    if not before or after is None:
+        return "n/a"
+    change = (after - before) / before * 100.0
+    return f"{change:+.1f}%"
+
+
+def compare(before: dict, after: dict) -> None:
+    print(f"Antes:   {before['meta']['commit']} ({before['meta']['timestamp']})")
+    print(f"Después: {after['meta']['commit']} ({after['meta']['timestamp']})")
+    for backend, after_result in after["backends"].items():
+        before_result = before["backends"].get(backend)
+        if not before_result:
+            print(f"\n{backend}: sin resultados previos")
+            continue
+        print(f"\n📊 {backend}: throughput {before_result['throughput_rps']:.1f} -> "
+              f"{after_result['throughput_rps']:.1f} req/s "
+              f"({_delta(before_result['throughput_rps'], after_result['throughput_rps'])})")
+        print(f"{'endpoint':<40} " + " ".join(f"{m:>22}" for m in METRICS))
+        for name, stats in after_result["endpoints"].items():
+            previous = before_result["endpoints"].get(name, {})
+            cells = []
+            for metric in METRICS:
+                old = previous.get(metric)
+                old_text = f"{old:.2f}" if old is not None else "-"
+                cells.append(f"{old_text:>7} -> {stats[metric]:>7.2f} {_delta(old, stats[metric]):>7}")
+            print(f"{name:<40} " + " ".join(f"{c:>22}" for c in cells))
+
+
+def main() -> int:
+    if len(sys.argv) != 3:
+        print(__doc__)
+        return 1
+    with open(sys.argv[1], encoding="utf-8") as handle:
+        before = json.load(handle)
+    with open(sys.argv[2], encoding="utf-8") as handle:
+        after = json.load(handle)
+    compare(before, after)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Generador de datos sintéticos para los benchmarks de Project Planner
+
+Genera usuarios, proyectos y tareas con distribuciones realistas
+(tamaños de proyecto de cola larga, asignaciones concentradas en pocos
+usuarios, dependencias entre tareas del mismo proyecto) de forma
+determinista a partir de una semilla. Escala hasta 1M de tareas generando
+las tareas en bloques para no mantener copias intermedias.
+"""
+
+import hashlib
+import itertools
+import random
+import sqlite3
+import uuid
+from bisect import bisect
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional
+
+BASE_DATE = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+TASK_STATUSES = ["todo", "in_progress", "review", "completed", "cancelled"]
+TASK_STATUS_WEIGHTS = [35, 25, 10, 25, 5]
+PROJECT_STATUSES = ["planning", "active", "on_hold", "completed", "cancelled"]
+PROJECT_STATUS_WEIGHTS = [20, 50, 10, 15, 5]
+PRIORITIES = ["low", "medium", "high", "urgent"]
+PRIORITY_WEIGHTS = [20, 50, 22, 8]
+
+CATEGORIES = [
+    ("Desarrollo", "Proyectos de desarrollo de software", "#3498db", "code"),
+    ("Marketing", "Campañas y estrategias de marketing", "#e74c3c", "bullhorn"),
+    ("Diseño", "Proyectos de diseño gráfico y UX/UI", "#9b59b6", "paint-brush"),
+    ("Investigación", "Proyectos de investigación y análisis", "#f39c12", "search"),
+    ("General", "Proyectos generales", "#95a5a6", "folder"),
+]
+
+# Contraseña de todos los usuarios sintéticos (los benchmarks firman tokens directamente)
+BENCHMARK_PASSWORD = "benchmark123"
+
+
+@dataclass
+class DatasetSpec:
+    users: int = 200
+    projects: int = 2000
+    tasks: int = 100_000
+    seed: int = 42
+
+
+def _cumulative(weights: List[float]) -> List[float]:
+    return list(itertools.accumulate(weights))
+
+
+def _iso(moment: datetime) -> str:
+    return moment.isoformat()
+
+
+class SyntheticDataset:
+    """Conjunto de datos sintético y reproducible
+
+    Los usuarios y proyectos se materializan en memoria; las tareas se
+    generan bajo demanda en bloques con `iter_task_chunks`.
+    """
+
+    def __init__(self, spec: DatasetSpec):
+        self.spec = spec
+        self._rng = random.Random(spec.seed)
+        # Popularidad tipo Zipf: pocos usuarios concentran la mayoría de asignaciones
+        self._user_cum = _cumulative([1.0 / (rank ** 1.1) for rank in range(1, spec.users + 1)])
+        self.categories = self._build_categories()
+        self.users = self._build_users()
+        self.projects = self._build_projects()
+        # Tamaño de proyecto de cola larga (Pareto)
+        self._project_cum = _cumulative([self._rng.paretovariate(1.2) for _ in self.projects])
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self._rng.getrandbits(128), version=4))
+
+    def _pick_user(self) -> dict:
+        return self.users[bisect(self._user_cum, self._rng.random() * self._user_cum[-1])]
+
+    def _build_categories(self) -> List[dict]:
+        return [
+            {"id": self._uuid(), "name": name, "description": description, "color": color, "icon": icon}
+            for name, description, color, icon in CATEGORIES
+        ]
+
+    def _build_users(self) -> List[dict]:
+        users = []
+        for index in range(self.spec.users):
+            created = BASE_DATE - timedelta(days=self._rng.randint(30, 720))
+            users.append({
+                "id": self._uuid(),
+                "name": f"Usuario {index:06d}",
+                "username": f"user{index:06d}",
+                "email": f"user{index:06d}@planner.test",
+                "password_hash": "$2b$12$benchmark.synthetic.hash.not.valid.for.login........",
+                "role": "admin" if index == 0 else "user",
+                "profile_photo": "",
+                "is_active": True,
+                "created_at": _iso(created),
+                "updated_at": _iso(created),
+            })
+        return users
+
+    def _build_projects(self) -> List[dict]:
+        rng = self._rng
+        projects = []
+        for index in range(self.spec.projects):
+            owner = self._pick_user()
+            members = {self._pick_user()["id"] for _ in range(rng.randint(0, 5))}
+            members.discard(owner["id"])
+            start = BASE_DATE + timedelta(days=rng.randint(-365, 365))
+            end = start + timedelta(days=rng.randint(30, 240))
+            created = start - timedelta(days=rng.randint(0, 30))
+            projects.append({
+                "id": self._uuid(),
+                "name": f"Proyecto {index:06d}",
+                "description": "Proyecto sintético para benchmarks. " * rng.randint(1, 6),
+                "start_date": start.date().isoformat(),
+                "end_date": end.date().isoformat(),
+                "priority": rng.choices(PRIORITIES, PRIORITY_WEIGHTS)[0],
+                "status": rng.choices(PROJECT_STATUSES, PROJECT_STATUS_WEIGHTS)[0],
+                "progress": rng.randint(0, 100),
+                "budget": round(rng.lognormvariate(9, 1), 2),
+                "category_id": rng.choice(self.categories)["id"],
+                "created_by": owner["id"],
+                "assigned_to": sorted(members),
+                "tags": rng.sample(["frontend", "backend", "ux", "infra", "q1", "q2", "cliente"], rng.randint(0, 3)),
+                "is_archived": rng.random() < 0.05,
+                "created_at": _iso(created),
+                "updated_at": _iso(created),
+            })
+        return projects
+
+    def iter_task_chunks(self, chunk_size: int = 50_000) -> Iterator[List[dict]]:
+        """Genera las tareas en bloques, con dependencias a tareas previas del mismo proyecto"""
+        rng = random.Random(self.spec.seed + 1)
+        recent: Dict[int, deque] = {}
+        chunk: List[dict] = []
+        for index in range(self.spec.tasks):
+            project_index = bisect(self._project_cum, rng.random() * self._project_cum[-1])
+            project = self.projects[project_index]
+            previous = recent.setdefault(project_index, deque(maxlen=8))
+
+            roll = rng.random()
+            if roll < 0.10:
+                assignee = None
+            elif roll < 0.85:
+                assignee = rng.choice(project["assigned_to"] + [project["created_by"]])
+            else:
+                assignee = self._pick_user()["id"]
+
+            dependencies = []
+            if previous and rng.random() < 0.3:
+                dependencies = rng.sample(list(previous), min(len(previous), rng.randint(1, 3)))
+
+            start = datetime.fromisoformat(project["start_date"]).replace(tzinfo=timezone.utc)
+            start += timedelta(days=rng.randint(0, 90), hours=rng.randint(8, 18))
+            due = start + timedelta(days=max(1, int(rng.lognormvariate(2, 0.7))))
+            status = rng.choices(TASK_STATUSES, TASK_STATUS_WEIGHTS)[0]
+            estimated = round(rng.lognormvariate(1.5, 0.8) * 2) / 2 or 0.5
+            task_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            created = start - timedelta(days=rng.randint(0, 14))
+            chunk.append({
+                "id": task_id,
+                "title": f"Tarea {index:07d}",
+                "description": "Descripción sintética de la tarea. " * rng.randint(0, 8),
+                "project_id": project["id"],
+                "parent_task_id": rng.choice(list(previous)) if previous and rng.random() < 0.1 else None,
+                "assigned_to": assignee,
+                "priority": rng.choices(PRIORITIES, PRIORITY_WEIGHTS)[0],
+                "status": status,
+                "progress": 100 if status == "completed" else rng.randint(0, 90),
+                "due_date": _iso(due),
+                "start_date": _iso(start),
+                "completed_date": _iso(due + timedelta(days=rng.randint(-5, 5))) if status == "completed" else None,
+                "estimated_hours": estimated,
+                "actual_hours": round(estimated * rng.lognormvariate(0, 0.35), 1) if status == "completed" else None,
+                "tags": [],
+                "dependencies": dependencies,
+                "created_by": project["created_by"],
+                "created_at": _iso(created),
+                "updated_at": _iso(created),
+            })
+            previous.append(task_id)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def load_sqlite(conn: sqlite3.Connection, dataset: SyntheticDataset,
+                on_chunk: Optional[Callable[[List[dict]], None]] = None) -> None:
+    """Carga el conjunto de datos en el esquema SQLite de main.py (columnas camelCase)"""
+    password = hashlib.sha256(BENCHMARK_PASSWORD.encode()).hexdigest()
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany(
+        "INSERT INTO users (id, name, username, email, password, role, profilePhoto, createdAt) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(u["id"], u["name"], u["username"], u["email"], password, u["role"], u["profile_photo"], u["created_at"])
+         for u in dataset.users],
+    )
+    conn.executemany(
+        "INSERT INTO projects (id, name, description, startDate, endDate, priority, status, createdBy, createdAt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(p["id"], p["name"], p["description"], p["start_date"], p["end_date"], p["priority"], p["status"],
+          p["created_by"], p["created_at"]) for p in dataset.projects],
+    )
+    for chunk in dataset.iter_task_chunks():
+        if on_chunk:
+            on_chunk(chunk)
+        conn.executemany(
+            "INSERT INTO tasks (id, title, description, assignedTo, priority, status, dueDate, projectId, createdAt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(t["id"], t["title"], t["description"], t["assigned_to"], t["priority"], t["status"], t["due_date"],
+              t["project_id"], t["created_at"]) for t in chunk],
+        )
+    conn.commit()
+    conn.execute("PRAGMA synchronous = FULL")
+
+
+def load_local_supabase(client, dataset: SyntheticDataset,
+                        on_chunk: Optional[Callable[[List[dict]], None]] = None) -> None:
+    """Carga el conjunto de datos en el sustituto local de Supabase"""
+    client.bulk_load("categories", dataset.categories)
+    client.bulk_load("users", dataset.users)
+    client.bulk_load("projects", dataset.projects)
+    for chunk in dataset.iter_task_chunks():
+        if on_chunk:
+            on_chunk(chunk)
+        client.bulk_load("tasks", chunk)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Genera un conjunto de datos sintético en SQLite")
+    parser.add_argument("output", help="Ruta del fichero SQLite a crear")
+    parser.add_argument("--users", type=int, default=DatasetSpec.users)
+    parser.add_argument("--projects", type=int, default=DatasetSpec.projects)
+    parser.add_argument("--tasks", type=int, default=DatasetSpec.tasks)
+    parser.add_argument("--seed", type=int, default=DatasetSpec.seed)
+    args = parser.parse_args()
+
+    import os
+    import sys
+    os.environ["SQLITE_DB_PATH"] = args.output
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+    import main
+
+    started = time.perf_counter()
+    main.init_db()
+    spec = DatasetSpec(users=args.users, projects=args.projects, tasks=args.tasks, seed=args.seed)
+    with main.get_db() as conn:
+        load_sqlite(conn, SyntheticDataset(spec))
+    print(f"✅ {args.tasks} tareas generadas en {time.perf_counter() - started:.1f}s -> {args.output}")
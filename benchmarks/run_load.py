@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+Suite de carga para Project Planner
+
+Siembra un conjunto de datos sintético, lanza una carga mixta de lecturas y
+escrituras contra los dos backends (SQLite de main.py y Supabase de
+main_supabase.py con el sustituto local en memoria) y reporta throughput y
+percentiles p50/p95/p99 por endpoint. Los resultados se guardan en JSON para
+poder compararlos entre commits con compare.py.
+
+Uso:
+    python benchmarks/run_load.py --backend both --tasks 100000 --requests 5000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from bisect import bisect
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Callable, Dict, List, Optional, Tuple
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BENCHMARKS_DIR, "..", "backend")
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx  # noqa: E402
+
+from datagen import DatasetSpec, SyntheticDataset, load_local_supabase, load_sqlite  # noqa: E402
+
+# Proporción de lecturas por tipo de carga
+WORKLOADS = {"read-heavy": 0.9, "mixed": 0.7, "write-heavy": 0.5}
+
+# Máximo de tareas que se conservan como muestra para las operaciones de escritura
+TASK_SAMPLE_SIZE = 5000
+
+RequestSpec = Tuple[str, str, Optional[dict], str, Dict[str, str]]  # método, url, cuerpo json, token, cabeceras
+
+
+@dataclass
+class Operation:
+    name: str
+    weight: float
+    is_write: bool
+    build: Callable[[random.Random], RequestSpec]
+
+
+@dataclass
+class EndpointStats:
+    count: int = 0
+    errors: int = 0
+    mean_ms: float = 0.0
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    p99_ms: float = 0.0
+    max_ms: float = 0.0
+    status_codes: Dict[str, int] = field(default_factory=dict)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: List[Tuple[str, float, int]]) -> Dict[str, EndpointStats]:
+    """Agrupa las muestras (endpoint, latencia en s, status) en estadísticas por endpoint"""
+    grouped: Dict[str, List[Tuple[float, int]]] = {}
+    for name, elapsed, status_code in samples:
+        grouped.setdefault(name, []).append((elapsed * 1000.0, status_code))
+    result = {}
+    for name, values in sorted(grouped.items()):
+        latencies = sorted(v for v, _ in values)
+        stats = EndpointStats(
+            count=len(values),
+            errors=sum(1 for _, code in values if code >= 400),
+            mean_ms=sum(latencies) / len(latencies),
+            p50_ms=percentile(latencies, 50),
+            p95_ms=percentile(latencies, 95),
+            p99_ms=percentile(latencies, 99),
+            max_ms=latencies[-1],
+        )
+        for _, code in values:
+            stats.status_codes[str(code)] = stats.status_codes.get(str(code), 0) + 1
+        result[name] = stats
+    return result
+
+
+class WeightedPicker:
+    def __init__(self, items: list, weights: List[float]):
+        self.items = items
+        self.cumulative = list(accumulate(weights))
+
+    def pick(self, rng: random.Random):
+        return self.items[bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+class BackendTarget:
+    """Backend preparado: aplicación ASGI con datos sembrados y operaciones de la carga"""
+
+    name = ""
+
+    def __init__(self, dataset: SyntheticDataset):
+        self.dataset = dataset
+        self.users = WeightedPicker(dataset.users, [1.0 / (r ** 1.1) for r in range(1, len(dataset.users) + 1)])
+        self.projects_by_id = {p["id"]: p for p in dataset.projects}
+        self.task_sample: List[dict] = []
+        self.tokens: Dict[str, str] = {}
+        # Último ETag de cada url (If-Match en las actualizaciones)
+        self.etags: Dict[str, str] = {}
+        self.app = None
+        self._sample_rng = random.Random(dataset.spec.seed + 2)
+        self._seen_tasks = 0
+
+    def _sample_tasks(self, chunk: List[dict]) -> None:
+        """Muestreo por reservorio de las tareas sembradas (para lecturas y escrituras dirigidas)"""
+        for task in chunk:
+            self._seen_tasks += 1
+            if len(self.task_sample) < TASK_SAMPLE_SIZE:
+                self.task_sample.append(task)
+            else:
+                slot = self._sample_rng.randrange(self._seen_tasks)
+                if slot < TASK_SAMPLE_SIZE:
+                    self.task_sample[slot] = task
+
+    def token_for(self, user_id: str) -> str:
+        if user_id not in self.tokens:
+            self.tokens[user_id] = self._create_token(user_id)
+        return self.tokens[user_id]
+
+    def _create_token(self, user_id: str) -> str:
+        raise NotImplementedError
+
+    def record_response(self, url: str, response: httpx.Response) -> None:
+        etag = response.headers.get("etag")
+        if etag:
+            self.etags[url] = etag
+
+    def operations(self) -> List[Operation]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteTarget(BackendTarget):
+    """main.py sobre un fichero SQLite temporal"""
+
+    name = "sqlite"
+
+    def __init__(self, dataset: SyntheticDataset):
+        super().__init__(dataset)
+        self._tmpdir = tempfile.TemporaryDirectory(prefix="planner-bench-")
+        os.environ["SQLITE_DB_PATH"] = os.path.join(self._tmpdir.name, "planner.db")
+        import main
+        self.module = main
+        main.DATABASE_PATH = os.environ["SQLITE_DB_PATH"]
+        main.init_db()
+        with main.get_db() as conn:
+            load_sqlite(conn, dataset, on_chunk=self._sample_tasks)
+        self.app = main.app
+
+    def _create_token(self, user_id: str) -> str:
+        return self.module.create_access_token({"sub": user_id})
+
+    def operations(self) -> List[Operation]:
+        def auth(rng):
+            return self.token_for(self.users.pick(rng)["id"])
+
+        def list_projects(rng):
+            return "GET", "/api/projects", None, auth(rng), {}
+
+        def list_project_tasks(rng):
+            task = rng.choice(self.task_sample)
+            return "GET", f"/api/tasks?project_id={task['project_id']}", None, auth(rng), {}
+
+        def list_all_tasks(rng):
+            return "GET", "/api/tasks", None, auth(rng), {}
+
+        def me(rng):
+            return "GET", "/api/auth/me", None, auth(rng), {}
+
+        def create_project(rng):
+            body = {
+                "name": f"Proyecto carga {rng.randrange(10**9)}", "description": "Creado por la suite de carga",
+                "startDate": "2025-01-01", "endDate": "2025-06-30", "priority": "medium", "status": "planning",
+            }
+            return "POST", "/api/projects", body, auth(rng), {}
+
+        def create_task(rng):
+            task = rng.choice(self.task_sample)
+            body = {
+                "title": f"Tarea carga {rng.randrange(10**9)}", "description": "Creada por la suite de carga",
+                "assignedTo": task["assigned_to"] or "", "priority": "medium", "status": "todo",
+                "dueDate": task["due_date"], "projectId": task["project_id"],
+            }
+            return "POST", "/api/tasks", body, auth(rng), {}
+
+        return [
+            Operation("GET /api/projects", 30, False, list_projects),
+            Operation("GET /api/tasks?project_id", 50, False, list_project_tasks),
+            Operation("GET /api/tasks", 2, False, list_all_tasks),
+            Operation("GET /api/auth/me", 18, False, me),
+            Operation("POST /api/projects", 20, True, create_project),
+            Operation("POST /api/tasks", 80, True, create_task),
+        ]
+
+    def close(self) -> None:
+        self._tmpdir.cleanup()
+
+
+class SupabaseTarget(BackendTarget):
+    """main_supabase.py con el sustituto local de Supabase en memoria"""
+
+    name = "supabase"
+
+    def __init__(self, dataset: SyntheticDataset, latency_ms: float = 0.0):
+        super().__init__(dataset)
+        os.environ["SUPABASE_URL"] = "memory://benchmark"
+        os.environ.setdefault("SUPABASE_ANON_KEY", "benchmark")
+        from supabase_local import get_local_client
+        client = get_local_client("memory://benchmark")
+        load_local_supabase(client, dataset, on_chunk=self._sample_tasks)
+        client.latency_ms = latency_ms
+        import main_supabase
+        self.module = main_supabase
+        self.app = main_supabase.app
+
+    def _create_token(self, user_id: str) -> str:
+        return self.module.create_access_token({"sub": user_id}, expires_delta=timedelta(hours=12))
+
+    def operations(self) -> List[Operation]:
+        def owner_token(project_id):
+            return self.token_for(self.projects_by_id[project_id]["created_by"])
+
+        def list_projects(rng):
+            return "GET", "/projects", None, self.token_for(self.users.pick(rng)["id"]), {}
+
+        def get_project(rng):
+            project = rng.choice(self.dataset.projects)
+            return "GET", f"/projects/{project['id']}", None, owner_token(project["id"]), {}
+
+        def list_project_tasks(rng):
+            task = rng.choice(self.task_sample)
+            return "GET", f"/projects/{task['project_id']}/tasks", None, owner_token(task["project_id"]), {}
+
+        def me(rng):
+            return "GET", "/auth/me", None, self.token_for(self.users.pick(rng)["id"]), {}
+
+        def categories(rng):
+            return "GET", "/categories", None, self.token_for(self.users.pick(rng)["id"]), {}
+
+        def create_project(rng):
+            body = {"name": f"Proyecto carga {rng.randrange(10**9)}", "description": "Creado por la suite de carga"}
+            return "POST", "/projects", body, self.token_for(self.users.pick(rng)["id"]), {}
+
+        def create_task(rng):
+            task = rng.choice(self.task_sample)
+            body = {
+                "title": f"Tarea carga {rng.randrange(10**9)}", "project_id": task["project_id"],
+                "assigned_to": task["assigned_to"], "due_date": task["due_date"], "estimated_hours": 3,
+            }
+            return "POST", "/tasks", body, owner_token(task["project_id"]), {}
+
+        def update_task(rng):
+            task = rng.choice(self.task_sample)
+            body = {"status": rng.choice(["todo", "in_progress", "review", "completed"]), "progress": rng.randint(0, 100)}
+            url = f"/tasks/{task['id']}"
+            # Las tareas sembradas están en la versión 1; después, la del ETag de la última respuesta
+            return "PUT", url, body, owner_token(task["project_id"]), {"If-Match": self.etags.get(url, '"1"')}
+
+        return [
+            Operation("GET /projects", 25, False, list_projects),
+            Operation("GET /projects/{project_id}", 20, False, get_project),
+            Operation("GET /projects/{project_id}/tasks", 35, False, list_project_tasks),
+            Operation("GET /auth/me", 15, False, me),
+            Operation("GET /categories", 5, False, categories),
+            Operation("POST /projects", 10, True, create_project),
+            Operation("POST /tasks", 40, True, create_task),
+            Operation("PUT /tasks/{task_id}", 50, True, update_task),
+        ]
+
+
+def build_picker(operations: List[Operation], read_ratio: float, exclude: List[str]) -> WeightedPicker:
+    """Escala los pesos internos de lecturas y escrituras según la proporción de la carga"""
+    operations = [op for op in operations if op.name not in exclude]
+    read_total = sum(op.weight for op in operations if not op.is_write) or 1.0
+    write_total = sum(op.weight for op in operations if op.is_write) or 1.0
+    weights = [
+        op.weight / (write_total if op.is_write else read_total) * ((1 - read_ratio) if op.is_write else read_ratio)
+        for op in operations
+    ]
+    return WeightedPicker(operations, weights)
+
+
+async def drive(target: BackendTarget, picker: WeightedPicker, requests: int, concurrency: int,
+                warmup: int, seed: int) -> Tuple[List[Tuple[str, float, int]], float]:
+    """Ejecuta la carga con `concurrency` clientes concurrentes contra la app ASGI en proceso"""
+    transport = httpx.ASGITransport(app=target.app)
+    samples: List[Tuple[str, float, int]] = []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        async def worker(worker_id: int, budget: Dict[str, int], measured: bool):
+            rng = random.Random(seed * 1000 + worker_id + (0 if measured else 500))
+            while budget["remaining"] > 0:
+                budget["remaining"] -= 1
+                operation = picker.pick(rng)
+                method, url, body, token, headers = operation.build(rng)
+                started = time.perf_counter()
+                response = await client.request(method, url, json=body,
+                                                headers={"Authorization": f"Bearer {token}", **headers})
+                elapsed = time.perf_counter() - started
+                target.record_response(url, response)
+                if measured:
+                    samples.append((operation.name, elapsed, response.status_code))
+
+        # El calentamiento se ejecuta antes de empezar a medir el tiempo total
+        warmup_budget = {"remaining": warmup}
+        await asyncio.gather(*(worker(i, warmup_budget, False) for i in range(concurrency)))
+        measured_budget = {"remaining": requests}
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i, measured_budget, True) for i in range(concurrency)))
+        duration = time.perf_counter() - started
+    return samples, duration
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(backend: str, result: dict) -> None:
+    print(f"\n📊 {backend}: {result['throughput_rps']:.1f} req/s "
+          f"({result['requests']} peticiones en {result['duration_s']:.2f}s, seed {result['seed_s']:.1f}s)")
+    print(f"{'endpoint':<40} {'n':>6} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:<40} {stats['count']:>6} {stats['errors']:>5} {stats['p50_ms']:>9.2f} "
+              f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+
+
+def run_backend(backend: str, args) -> dict:
+    spec = DatasetSpec(users=args.users, projects=args.projects, tasks=args.tasks, seed=args.seed)
+    started = time.perf_counter()
+    dataset = SyntheticDataset(spec)
+    if backend == "sqlite":
+        target = SQLiteTarget(dataset)
+    else:
+        target = SupabaseTarget(dataset, latency_ms=args.latency_ms)
+    seed_seconds = time.perf_counter() - started
+    try:
+        picker = build_picker(target.operations(), WORKLOADS[args.workload], args.exclude)
+        samples, duration = asyncio.run(
+            drive(target, picker, args.requests, args.concurrency, args.warmup, args.seed)
+        )
+    finally:
+        target.close()
+    return {
+        "seed_s": seed_seconds,
+        "requests": len(samples),
+        "duration_s": duration,
+        "throughput_rps": len(samples) / duration if duration else 0.0,
+        "errors": sum(1 for _, _, code in samples if code >= 400),
+        "endpoints": {name: asdict(stats) for name, stats in summarize(samples).items()},
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de carga de Project Planner")
+    parser.add_argument("--backend", choices=["sqlite", "supabase", "both"], default="both")
+    parser.add_argument("--users", type=int, default=DatasetSpec.users)
+    parser.add_argument("--projects", type=int, default=DatasetSpec.projects)
+    parser.add_argument("--tasks", type=int, default=DatasetSpec.tasks)
+    parser.add_argument("--seed", type=int, default=DatasetSpec.seed)
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="Latencia simulada por llamada al sustituto de Supabase")
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="Nombre de endpoint a excluir de la carga (repetible)")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="Mantener activo el control de admisión (desactivado por defecto)")
+    parser.add_argument("--output", help="Fichero JSON de resultados (por defecto benchmarks/results/)")
+    args = parser.parse_args()
+
+    if not args.rate_limits:
+        os.environ["RATE_LIMITS_ENABLED"] = "false"
+    backends = ["sqlite", "supabase"] if args.backend == "both" else [args.backend]
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "backends": {},
+    }
+    for backend in backends:
+        result = run_backend(backend, args)
+        report["backends"][backend] = result
+        print_report(backend, result)
+
+    output = args.output or os.path.join(
+        BENCHMARKS_DIR, "results", f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"\n💾 Resultados guardados en {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
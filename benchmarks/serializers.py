@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark de la serialización de listas de tareas (backend/serializers.py)
+
+Compara, sobre las mismas filas sintéticas, el camino anterior (un dict por
+fila con format_task_for_response, jsonable_encoder de FastAPI y json.dumps
+como en JSONResponse) con TASK_SERIALIZER, y sale con código 1 si la mejora
+es menor que --min-speedup.
+
+Uso:
+    python benchmarks/serializers.py --tasks 10000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, List
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BENCHMARKS_DIR, "..", "backend")
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from datagen import DatasetSpec, SyntheticDataset  # noqa: E402
+from serializers import TASK_SERIALIZER, orjson  # noqa: E402
+
+
+def format_task_for_response(task_data: dict) -> dict:
+    """Copia de DatabaseUtils.format_task_for_response antes de serializers.py (con los campos añadidos después)"""
+    if not task_data:
+        return {}
+
+    return {
+        "id": task_data.get("id"),
+        "title": task_data.get("title"),
+        "description": task_data.get("description"),
+        "project_id": task_data.get("project_id"),
+        "parent_task_id": task_data.get("parent_task_id"),
+        "assigned_to": task_data.get("assigned_to"),
+        "priority": task_data.get("priority", "medium"),
+        "status": task_data.get("status", "todo"),
+        "progress": task_data.get("progress", 0),
+        "due_date": task_data.get("due_date"),
+        "start_date": task_data.get("start_date"),
+        "completed_date": task_data.get("completed_date"),
+        "estimated_hours": task_data.get("estimated_hours"),
+        "actual_hours": task_data.get("actual_hours"),
+        "tags": task_data.get("tags", []),
+        "dependencies": task_data.get("dependencies", []),
+        "comment_count": task_data.get("comment_count", 0),
+        "deadline_status": task_data.get("deadline_status"),
+        "created_by": task_data.get("created_by"),
+        "created_at": task_data.get("created_at"),
+        "updated_at": task_data.get("updated_at"),
+        "version": task_data.get("version", 1)
+    }
+
+
+def previous_path(rows: List[dict]) -> bytes:
+    tasks = [format_task_for_response(task) for task in rows]
+    return json.dumps(jsonable_encoder(tasks), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def serializer_path(rows: List[dict]) -> bytes:
+    return TASK_SERIALIZER.encode(rows)
+
+
+def best_of(function: Callable[[List[dict]], bytes], rows: List[dict], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(rows)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-speedup", type=float, default=5.0)
+    args = parser.parse_args()
+
+    dataset = SyntheticDataset(DatasetSpec(users=200, projects=200, tasks=args.tasks))
+    rows = [row for chunk in dataset.iter_task_chunks() for row in chunk]
+    # Mismo contenido por los dos caminos
+    assert json.loads(previous_path(rows)) == json.loads(serializer_path(rows))
+
+    before = best_of(previous_path, rows, args.repeat)
+    after = best_of(serializer_path, rows, args.repeat)
+    speedup = before / after
+    print(f"{len(rows)} tareas (codificador: {'orjson' if orjson is not None else 'json'})")
+    print(f"  format_* + jsonable_encoder: {before * 1000:8.1f} ms")
+    print(f"  TASK_SERIALIZER.encode:      {after * 1000:8.1f} ms")
+    print(f"  mejora: x{speedup:.1f}")
+    return 0 if speedup >= args.min_speedup else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
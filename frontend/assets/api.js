@@ -5,17 +5,25 @@ const API_BASE_URL = 'http://localhost:8001/api';
 class ApiClient {
     constructor() {
         this.token = localStorage.getItem('access_token');
+        // Último ETag recibido por recurso (p. ej. '/tasks/<id>'), para If-Match al actualizar
+        this.etags = new Map();
+    }
+
+    // If-Match con la versión indicada o con el último ETag del recurso (sin cabecera si no se conoce)
+    ifMatch(endpoint, version) {
+        const etag = version != null ? `"${version}"` : this.etags.get(endpoint);
+        return etag ? { 'If-Match': etag } : {};
     }
 
     // Método para hacer peticiones HTTP
     async request(endpoint, options = {}) {
         const url = `${API_BASE_URL}${endpoint}`;
         const config = {
+            ...options,
             headers: {
                 'Content-Type': 'application/json',
                 ...options.headers,
             },
-            ...options,
         };
 
         // Agregar token de autorización si existe
@@ -31,6 +39,10 @@ class ApiClient {
                 throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
             }
 
+            const etag = response.headers.get('ETag');
+            if (etag) {
+                this.etags.set(endpoint, etag);
+            }
             return await response.json();
         } catch (error) {
             console.error('API Error:', error);
@@ -89,10 +101,11 @@ class ApiClient {
         localStorage.removeItem('currentUser');
     }
 
-    // Métodos de proyectos
-    async getProjects() {
+    // Métodos de proyectos (fields: lista opcional de campos, p. ej. ['name', 'status'])
+    async getProjects(fields = null) {
         try {
-            return await this.request('/projects');
+            const endpoint = fields ? `/projects?fields=${fields.join(',')}` : '/projects';
+            return await this.request(endpoint);
         } catch (error) {
             console.error('Error getting projects:', error);
             return [];
@@ -111,10 +124,13 @@ class ApiClient {
         }
     }
 
-    async updateProject(projectId, projectData) {
+    // version: la del objeto leído (campo version); 412 si otro usuario lo ha cambiado después
+    async updateProject(projectId, projectData, version = null) {
         try {
-            await this.request(`/projects/${projectId}`, {
+            const endpoint = `/projects/${projectId}`;
+            await this.request(endpoint, {
                 method: 'PUT',
+                headers: this.ifMatch(endpoint, version),
                 body: JSON.stringify(projectData),
             });
             return { success: true };
@@ -135,10 +151,13 @@ class ApiClient {
     }
 
     // Métodos de tareas
-    async getTasks(projectId = null) {
+    async getTasks(projectId = null, fields = null) {
         try {
-            const endpoint = projectId ? `/tasks?project_id=${projectId}` : '/tasks';
-            return await this.request(endpoint);
+            const params = new URLSearchParams();
+            if (projectId) params.set('project_id', projectId);
+            if (fields) params.set('fields', fields.join(','));
+            const query = params.toString();
+            return await this.request(query ? `/tasks?${query}` : '/tasks');
         } catch (error) {
             console.error('Error getting tasks:', error);
             return [];
@@ -157,10 +176,13 @@ class ApiClient {
         }
     }
 
-    async updateTask(taskId, taskData) {
+    // version: la del objeto leído (campo version); 412 si otro usuario lo ha cambiado después
+    async updateTask(taskId, taskData, version = null) {
         try {
-            await this.request(`/tasks/${taskId}`, {
+            const endpoint = `/tasks/${taskId}`;
+            await this.request(endpoint, {
                 method: 'PUT',
+                headers: this.ifMatch(endpoint, version),
                 body: JSON.stringify(taskData),
             });
             return { success: true };
@@ -179,6 +201,28 @@ class ApiClient {
             return { success: false, message: error.message };
         }
     }
+
+    // Varias altas, cambios o bajas en una sola petición (todo o nada), p. ej.
+    // [{ op: 'update', entity: 'task', id, version, data: { status: 'completed' } }, ...]
+    // (version es opcional: con ella el update falla si la fila ha cambiado)
+    async batch(operations) {
+        try {
+            const response = await this.request('/batch', {
+                method: 'POST',
+                body: JSON.stringify({ operations }),
+            });
+            return { success: true, results: response.results };
+        } catch (error) {
+            return { success: false, message: error.message };
+        }
+    }
+
+    // Cambios desde el cursor de la última sincronización (null = todo). Con
+    // reset el cliente descarta su copia; con hasMore se vuelve a llamar con el cursor
+    async sync(cursor = null) {
+        const endpoint = cursor ? `/sync?since=${encodeURIComponent(cursor)}` : '/sync';
+        return await this.request(endpoint);
+    }
 }
 
 // Instancia global del cliente API
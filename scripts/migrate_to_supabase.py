@@ -25,6 +25,9 @@ except ImportError:
     print("pip install supabase psycopg2-binary python-dotenv")
     sys.exit(1)
 
+# Valores por consulta al buscar filas existentes en Supabase (el filtro in va en la URL)
+LOOKUP_BATCH_SIZE = 200
+
 class SQLiteToSupabaseMigrator:
     def __init__(self, sqlite_db_path: str = "planner.db"):
         self.sqlite_db_path = sqlite_db_path
@@ -74,11 +77,11 @@ class SQLiteToSupabaseMigrator:
             return True
         
         try:
+            # Usuarios que ya existen en Supabase (una consulta por lote)
+            existing = self.find_ids_by("users", "username", [user["username"] for user in sqlite_users])
+            
             for user in sqlite_users:
-                # Verificar si el usuario ya existe
-                existing = self.supabase.table("users").select("id").eq("username", user["username"]).execute()
-                
-                if existing.data:
+                if user["username"] in existing:
                     print(f"⚠️  Usuario {user['username']} ya existe, omitiendo...")
                     continue
                 
@@ -201,37 +204,30 @@ class SQLiteToSupabaseMigrator:
             print(f"❌ Error en migración de tareas: {e}")
             return False
     
+    def find_ids_by(self, table: str, column: str, values: List[str]) -> Dict[str, str]:
+        """UUIDs de Supabase por valor de column, con una consulta por lote en lugar de una por fila"""
+        ids = {}
+        unique_values = list(dict.fromkeys(values))
+        for start in range(0, len(unique_values), LOOKUP_BATCH_SIZE):
+            batch = unique_values[start:start + LOOKUP_BATCH_SIZE]
+            result = self.supabase.table(table).select(f"id, {column}").in_(column, batch).order("id").execute()
+            for row in result.data:
+                ids.setdefault(row[column], row["id"])
+        return ids
+    
     def create_user_mapping(self) -> Dict[int, str]:
         """Crea mapeo de IDs SQLite a UUIDs Supabase para usuarios"""
-        mapping = {}
-        
-        # Obtener usuarios de SQLite
+        # Obtener usuarios de SQLite y buscar los correspondientes en Supabase
         sqlite_users = self.get_sqlite_data("users")
-        
-        for sqlite_user in sqlite_users:
-            # Buscar usuario correspondiente en Supabase
-            supabase_user = self.supabase.table("users").select("id").eq("username", sqlite_user["username"]).execute()
-            
-            if supabase_user.data:
-                mapping[sqlite_user["id"]] = supabase_user.data[0]["id"]
-        
-        return mapping
+        ids = self.find_ids_by("users", "username", [user["username"] for user in sqlite_users])
+        return {user["id"]: ids[user["username"]] for user in sqlite_users if user["username"] in ids}
     
     def create_project_mapping(self) -> Dict[int, str]:
         """Crea mapeo de IDs SQLite a UUIDs Supabase para proyectos"""
-        mapping = {}
-        
-        # Obtener proyectos de SQLite
+        # Obtener proyectos de SQLite y buscar los correspondientes en Supabase (por nombre)
         sqlite_projects = self.get_sqlite_data("projects")
-        
-        for sqlite_project in sqlite_projects:
-            # Buscar proyecto correspondiente en Supabase
-            supabase_project = self.supabase.table("projects").select("id").eq("name", sqlite_project["name"]).execute()
-            
-            if supabase_project.data:
-                mapping[sqlite_project["id"]] = supabase_project.data[0]["id"]
-        
-        return mapping
+        ids = self.find_ids_by("projects", "name", [project["name"] for project in sqlite_projects])
+        return {project["id"]: ids[project["name"]] for project in sqlite_projects if project["name"] in ids}
     
     def backup_sqlite(self) -> bool:
         """Crea backup de la base de datos SQLite"""
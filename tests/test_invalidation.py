@@ -0,0 +1,149 @@
+"""
+Pruebas del bus de invalidación de cachés entre workers (backend/invalidation.py, backend/cache.py y
+backend/reference_data.py)
+
+Cada "worker" es un proceso creado con fork después de construir el bus y la
+caché, como hace Gunicorn con preload_app. Los datos viven en un fichero SQLite
+común y cada worker los cachea en memoria.
+"""
+
+import asyncio
+import multiprocessing
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from cache import SharedCache  # noqa: E402
+from invalidation import InvalidationBus  # noqa: E402
+from reference_data import ReferenceData  # noqa: E402
+
+pytestmark = pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="Requiere fork (Linux/macOS)"
+)
+
+WORKERS = 3
+
+
+def _worker(conn, data_path: str, cache: SharedCache) -> None:
+    """Atiende órdenes ("get", clave), ("set", clave, valor) y ("loads",) hasta recibir None"""
+    loads = 0
+
+    def read(key):
+        nonlocal loads
+        loads += 1
+        with sqlite3.connect(data_path) as db:
+            row = db.execute("SELECT value FROM items WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    while True:
+        command = conn.recv()
+        if command is None:
+            return
+        if command[0] == "get":
+            conn.send(cache.get_or_load(command[1], lambda: read(command[1])))
+        elif command[0] == "set":
+            with sqlite3.connect(data_path) as db:
+                db.execute("INSERT OR REPLACE INTO items (key, value) VALUES (?, ?)", command[1:])
+            cache.invalidate(command[1])
+            conn.send("ok")
+        elif command[0] == "loads":
+            conn.send(loads)
+
+
+@pytest.fixture
+def workers(tmp_path):
+    data_path = str(tmp_path / "data.db")
+    with sqlite3.connect(data_path) as db:
+        db.execute("CREATE TABLE items (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute("INSERT INTO items VALUES ('proyecto', 'v1'), ('usuario', 'ana')")
+    # Bus y caché creados antes del fork, como con preload_app
+    bus = InvalidationBus(str(tmp_path / "invalidation.db"))
+    cache = SharedCache("items", bus, ttl=3600)
+    context = multiprocessing.get_context("fork")
+    pipes, processes = [], []
+    for _ in range(WORKERS):
+        parent, child = context.Pipe()
+        process = context.Process(target=_worker, args=(child, data_path, cache), daemon=True)
+        process.start()
+        pipes.append(parent)
+        processes.append(process)
+
+    def call(index, *command):
+        pipes[index].send(command)
+        assert pipes[index].poll(10), "el worker no responde"
+        return pipes[index].recv()
+
+    yield call
+    for pipe, process in zip(pipes, processes):
+        pipe.send(None)
+        process.join(5)
+
+
+def test_values_are_cached_per_worker(workers):
+    for _ in range(3):
+        assert [workers(i, "get", "proyecto") for i in range(WORKERS)] == ["v1"] * WORKERS
+    assert [workers(i, "loads") for i in range(WORKERS)] == [1] * WORKERS
+
+
+def test_write_in_one_worker_evicts_the_others(workers):
+    for i in range(WORKERS):
+        workers(i, "get", "proyecto")
+        workers(i, "get", "usuario")
+
+    assert workers(0, "set", "proyecto", "v2") == "ok"
+    # La lectura siguiente en cualquier worker ya ve el valor nuevo
+    assert [workers(i, "get", "proyecto") for i in range(WORKERS)] == ["v2"] * WORKERS
+    # Solo se descarta la clave invalidada
+    assert [workers(i, "get", "usuario") for i in range(WORKERS)] == ["ana"] * WORKERS
+    assert [workers(i, "loads") for i in range(WORKERS)] == [3, 3, 3]
+
+    for value in ("v3", "v4", "v5"):
+        workers(WORKERS - 1, "set", "proyecto", value)
+        assert [workers(i, "get", "proyecto") for i in range(WORKERS)] == [value] * WORKERS
+
+
+def test_bus_without_shared_file_only_invalidates_locally():
+    bus = InvalidationBus(None)
+    cache = SharedCache("local", bus, ttl=3600)
+    assert cache.get_or_load("k", lambda: 1) == 1
+    assert cache.get_or_load("k", lambda: 2) == 1
+    cache.invalidate("k")
+    assert cache.get_or_load("k", lambda: 3) == 3
+
+
+def test_reference_data_reloads_after_invalidation_or_ttl(monkeypatch):
+    bus = InvalidationBus(None)
+    rows = [{"id": 1, "name": "Trabajo"}]
+    data = ReferenceData("categorias", lambda: list(rows), bus, ttl=3600)
+
+    async def scenario():
+        first = await data.get()
+        assert (await data.get()) is first
+        response = first.response(first.etag)
+        assert response.status_code == 304 and response.headers["ETag"] == first.etag
+
+        rows.append({"id": 2, "name": "Personal"})
+        assert (await data.get()) is first
+        data.invalidate()
+        second = await data.get()
+        assert second.rows == rows and second.etag != first.etag
+        assert second.response(f"W/{first.etag}").body == second.body
+
+        # Al caducar también se recarga (y un fallo sigue sirviendo la instantánea anterior)
+        monkeypatch.setattr(data, "ttl", 0)
+        attempts = []
+        data.load = lambda: attempts.append(1) or 1 / 0
+        assert (await data.get()) is second
+        # Tras el fallo no se reintenta hasta que pasa data.retry
+        assert await asyncio.gather(data.get(), data.refresh()) == [second, second]
+        assert len(attempts) == 1
+        monkeypatch.setattr(data, "_retry_at", 0.0)
+        data.load = lambda: list(rows)
+        assert (await data.get()) is not second
+
+    asyncio.run(scenario())
@@ -0,0 +1,238 @@
+"""
+Presupuestos de consultas por petición y detección de N+1
+
+Cada petición se hace dentro de metrics.capture_queries(), que registra las
+sentencias de SQLite y Postgres y las idas y vueltas a Supabase (también las
+hechas en el pool de hilos). La prueba falla si una ruta supera el número de
+consultas declarado en su presupuesto o si una misma forma de consulta (la
+sentencia sin valores) se repite más de REPEAT_LIMIT veces en una petición.
+
+Todo corre contra sustitutos locales: main.py con un SQLite temporal y
+main_supabase.py con SUPABASE_URL=memory:// (sin conexión directa a Postgres;
+el presupuesto de pg_direct se comprueba en test_pg_direct.py).
+"""
+
+import asyncio
+import sqlite3
+import sys
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from metrics import capture_queries  # noqa: E402
+from query_log import normalize_sql  # noqa: E402
+
+# Veces que puede repetirse una misma forma de consulta en una petición
+REPEAT_LIMIT = 2
+
+# Consultas por petición (ruta de FastAPI). Los de main_supabase.py son idas y
+# vueltas a PostgREST con la caché de proyectos caliente cuando la petición
+# anterior ya ha leído el proyecto.
+SQLITE_BUDGETS = {
+    "POST /api/auth/register": 3,
+    "POST /api/auth/login": 1,
+    "GET /api/auth/me": 1,
+    "POST /api/projects": 2,
+    "GET /api/projects": 1,
+    "POST /api/tasks": 2,
+    "GET /api/tasks": 1,
+    "GET /api/sync": 5,
+}
+SUPABASE_BUDGETS = {
+    "POST /auth/register": 3,
+    "POST /auth/login": 1,
+    "GET /users/directory": 1,
+    "GET /users/search": 1,
+    "POST /projects": 1,
+    "GET /projects": 1,
+    "GET /projects/{project_id}": 1,
+    "PUT /projects/{project_id}": 2,
+    "GET /projects/{project_id}/tasks": 2,
+    "POST /tasks": 2,
+    "PUT /tasks/{task_id}": 1,
+    "DELETE /tasks/{task_id}": 2,
+    "GET /notifications": 2,
+}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(scope="module")
+def data_dir(tmp_path_factory):
+    """Directorio temporal y variables de entorno de los sustitutos locales mientras duran las pruebas
+
+    main.py, main_supabase.py y supabase_config.py leen la configuración al
+    importarse. Los módulos de la aplicación ya importados por otras pruebas
+    (p. ej. supabase_config desde test_supabase.py, con el entorno vacío) se
+    retiran antes de configurar el entorno y se restauran al terminar; los que
+    se importan aquí se descartan para que no lleguen a otras pruebas.
+    """
+    path = tmp_path_factory.mktemp("query_budgets")
+    with pytest.MonkeyPatch.context() as mp:
+        for name in [name for name in sys.modules if _is_app_module(name)]:
+            mp.delitem(sys.modules, name)
+        for name, value in {
+            "SUPABASE_URL": "memory://query-budgets",
+            "SUPABASE_KEY": "local",
+            "SQLITE_DB_PATH": str(path / "planner.db"),
+            "ACTIVITY_SPILL_PATH": str(path / "activity_spill.jsonl"),
+            "STORAGE_ROOT": str(path / "attachments"),
+            "RATE_LIMITS_ENABLED": "false",
+        }.items():
+            mp.setenv(name, value)
+        loaded = set(sys.modules)
+        yield path
+        for name in set(sys.modules) - loaded:
+            if _is_app_module(name):
+                del sys.modules[name]
+
+
+def _is_app_module(name: str) -> bool:
+    """Módulo de backend/ o scripts/ que depende del entorno (metrics y query_log no: las pruebas los comparten)"""
+    if name in ("metrics", "query_log"):
+        return False
+    module_file = getattr(sys.modules[name], "__file__", None) or ""
+    return module_file.startswith((str(BACKEND_DIR), str(SCRIPTS_DIR)))
+
+
+def query_shape(record) -> str:
+    return record.shape if record.backend == "supabase" else normalize_sql(record.shape)
+
+
+def check_budget(label: str, queries: list, budget: int) -> None:
+    listing = "\n".join(f"  {record.backend} {query_shape(record)}" for record in queries)
+    assert len(queries) <= budget, f"{label}: {len(queries)} consultas, presupuesto {budget}\n{listing}"
+    repeated = {shape: count for shape, count in Counter(map(query_shape, queries)).items() if count > REPEAT_LIMIT}
+    assert not repeated, f"{label}: consultas repetidas (N+1) {repeated}"
+
+
+class BudgetClient:
+    """Cliente HTTP que comprueba el presupuesto de cada ruta"""
+
+    def __init__(self, client, budgets: dict):
+        self.client = client
+        self.budgets = budgets
+        self.headers = {}
+
+    async def call(self, route: str, json=None, params=None, headers=None, **path):
+        method, template = route.split(" ", 1)
+        with capture_queries() as queries:
+            response = await self.client.request(method, template.format(**path), json=json, params=params,
+                                                 headers={**self.headers, **(headers or {})})
+        assert response.status_code < 400, f"{route}: {response.status_code} {response.text}"
+        check_budget(route, queries, self.budgets[route])
+        return response
+
+
+async def _with_app(app, budgets: dict, body):
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await body(BudgetClient(client, budgets))
+
+
+def test_budget_check_detects_repeated_queries(data_dir):
+    from supabase_config import supabase_config
+
+    with capture_queries() as queries:
+        client = supabase_config.get_client()
+        for username in ("a", "b", "c"):
+            client.table("users").select("id").eq("username", username).execute()
+    assert {query_shape(record) for record in queries} == {"users select(id) eq(username)"}
+    with pytest.raises(AssertionError, match="N\\+1"):
+        check_budget("prueba", queries, 5)
+    with pytest.raises(AssertionError, match="presupuesto 2"):
+        check_budget("prueba", queries, 2)
+
+
+def test_sqlite_routes_stay_within_budget(data_dir):
+    import main
+
+    async def body(api):
+        user = {"name": "Ana", "username": "ana", "email": "ana@test.com",
+                "password": "secreto123", "confirmPassword": "secreto123"}
+        await api.call("POST /api/auth/register", json=user)
+        login = await api.call("POST /api/auth/login", json={"username": "ana", "password": "secreto123"})
+        api.headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        await api.call("GET /api/auth/me")
+        project = await api.call("POST /api/projects", json={
+            "name": "Proyecto", "description": "", "startDate": "2024-01-01", "endDate": "2024-02-01",
+            "priority": "medium", "status": "planning",
+        })
+        for title in ("Uno", "Dos", "Tres"):
+            await api.call("POST /api/tasks", json={
+                "title": title, "description": "", "assignedTo": "", "priority": "low", "status": "todo",
+                "dueDate": "2024-01-10", "projectId": project.json()["id"],
+            })
+        await api.call("GET /api/projects")
+        await api.call("GET /api/tasks")
+        synced = (await api.call("GET /api/sync")).json()
+        assert (len(synced["projects"]), len(synced["tasks"])) == (1, 3)
+        later = (await api.call("GET /api/sync", params={"since": synced["cursor"]})).json()
+        assert (later["projects"], later["tasks"], later["reset"]) == ([], [], False)
+
+    run(_with_app(main.app, SQLITE_BUDGETS, body))
+
+
+def test_supabase_routes_stay_within_budget(data_dir):
+    import main_supabase
+
+    async def body(api):
+        for name in ("Ana", "Beto"):
+            await api.call("POST /auth/register", json={
+                "name": name, "username": name.lower(), "email": f"{name.lower()}@test.com", "password": "secreto123",
+            })
+        login = await api.call("POST /auth/login", json={"username": "ana", "password": "secreto123"})
+        api.headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        directory = (await api.call("GET /users/directory")).json()
+        beto = next(user["id"] for user in directory if user["username"] == "beto")
+        assert [user["id"] for user in (await api.call("GET /users/search", params={"prefix": "be"})).json()] == [beto]
+
+        project = (await api.call("POST /projects", json={"name": "Proyecto", "assigned_to": [beto]})).json()
+        await api.call("GET /projects/{project_id}", project_id=project["id"])
+        tasks = [
+            (await api.call("POST /tasks", json={"title": title, "project_id": project["id"], "assigned_to": beto}))
+            for title in ("Uno", "Dos", "Tres")
+        ]
+        await api.call("GET /projects")
+        await api.call("GET /projects/{project_id}/tasks", project_id=project["id"])
+        task = tasks[0].json()
+        await api.call("PUT /tasks/{task_id}", task_id=task["id"], json={"status": "in_progress"},
+                       headers={"If-Match": tasks[0].headers["ETag"]})
+        await api.call("PUT /projects/{project_id}", project_id=project["id"], json={"description": "Nueva"},
+                       headers={"If-Match": "*"})
+        await api.call("GET /projects/{project_id}/tasks", project_id=project["id"])
+        await api.call("DELETE /tasks/{task_id}", task_id=tasks[1].json()["id"])
+        await api.call("GET /notifications")
+
+    run(_with_app(main_supabase.app, SUPABASE_BUDGETS, body))
+
+
+def test_migration_mappings_use_one_query_per_batch(data_dir):
+    from migrate_to_supabase import LOOKUP_BATCH_SIZE, SQLiteToSupabaseMigrator
+    from supabase_config import supabase_config
+
+    sqlite_path = str(data_dir / "migration.db")
+    usernames = [f"migrado_{i}" for i in range(LOOKUP_BATCH_SIZE + 50)]
+    with sqlite3.connect(sqlite_path) as conn:
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)")
+        conn.executemany("INSERT INTO users (username) VALUES (?)", [(name,) for name in usernames])
+    client = supabase_config.get_client()
+    client.table("users").insert([
+        {"name": name, "username": name, "email": f"{name}@test.com", "password_hash": "x"} for name in usernames[1:]
+    ]).execute()
+
+    with capture_queries() as queries:
+        mapping = SQLiteToSupabaseMigrator(sqlite_path).create_user_mapping()
+    check_budget("create_user_mapping", queries, 2)
+    assert len(mapping) == len(usernames) - 1 and 1 not in mapping